@@ -65,9 +65,36 @@ int LED      = LED_BUILTIN;
 #define   CMD_CHPERASE  byte(0x0D)
 #define   CMD_RESUME    byte(0x0E)
 #define   CMD_HALT      byte(0x0F)
+#define   CMD_XDATA_RD  byte(0x10)
+#define   CMD_XDATA_WR  byte(0x11)
+#define   CMD_CODE_RD   byte(0x12)
+#define   CMD_BRUSTDAT  byte(0x13)
+#define   CMD_BRUSTRLE  byte(0x14)
 #define   CMD_PING      byte(0xF0)
 #define   CMD_INSTR_VER byte(0xF1)
 #define   CMD_INSTR_UPD byte(0xF2)
+#define   CMD_CAPS      byte(0xF3)
+#define   CMD_UPGRADE   byte(0xF4)
+
+// Capability flags reported by CMD_CAPS
+#define   CAP_BLOCK_RW  byte(0x01)
+#define   CAP_RELIABLE  byte(0x02)
+#define   CAP_BRUST_RLE byte(0x04)
+
+// Maximum size of a block transfer
+#define   BLOCK_RD_MAX  2048
+#define   BLOCK_WR_MAX  128
+
+// Reliable link configuration
+#define   PKT_PAYLOAD_MAX   128   // Largest packet payload
+#define   PKT_CACHE         16    // Responses kept for re-transmission
+#define   PKT_BYTE_TIMEOUT  20    // Max ms between the bytes of a packet
+#define   PKT_BAD_MAX       8     // Bad packets in a row before we fall back
+#define   LINK_CONFIRM_MS   2000  // Time the host has to confirm an upgrade
+#define   BRUST_IDLE_MS     1000  // Time to wait for the next burst packet
+
+// Baud rates selectable with CMD_UPGRADE
+const unsigned long linkBaudRates[] = { 115200, 250000, 500000, 1000000, 2000000 };
 
 // Response constants
 #define   ANS_OK       byte(0x01)
@@ -80,6 +107,20 @@ byte inByte, bAns, bIdle;
 byte c1, c2, c3;
 unsigned short s1;
 int iLen, iRead;
+byte blockBuffer[BLOCK_WR_MAX];
+
+// Reliable link state
+boolean linkReliable = false, linkConfirmed = false;
+unsigned long linkDeadline, tIdle;
+byte linkBadPackets = 0;
+byte rxSeq, rxLen, expectSeq = 0;
+byte rxPayload[PKT_PAYLOAD_MAX];
+byte replyCache[PKT_CACHE][3];
+byte lastPayloadSeq, lastPayloadLen = 0;
+
+// Brust decompression state
+boolean brustRle, rleRepeat;
+byte rleLeft;
 
 /**
  * Initialize debugger
@@ -101,10 +142,163 @@ void setup() {
 
 }
 
+/**
+ * Update a CRC-8 (polynomial 0x07) with the given byte
+ */
+byte crc8( byte crc, const byte data ) {
+  crc ^= data;
+  for (byte i = 0; i < 8; i++) {
+    if (crc & 0x80) {
+      crc = (crc << 1) ^ 0x07;
+    } else {
+      crc <<= 1;
+    }
+  }
+  return crc;
+}
+
+/**
+ * Write a CRC-protected response packet on the reliable link
+ */
+void writePacket( const byte ans, const byte bH, const byte bL, const byte seq, const byte * payload, const byte len ) {
+  byte crc = 0;
+  crc = crc8( crc, ans ); Serial.write( ans );
+  crc = crc8( crc, bH );  Serial.write( bH );
+  crc = crc8( crc, bL );  Serial.write( bL );
+  crc = crc8( crc, seq ); Serial.write( seq );
+  crc = crc8( crc, len ); Serial.write( len );
+  for (byte i = 0; i < len; i++) {
+    crc = crc8( crc, payload[i] );
+    Serial.write( payload[i] );
+  }
+  Serial.write( crc );
+  Serial.flush();
+}
+
+/**
+ * Respond to the packet we are handling, keeping the response in case
+ * the host asks for it again
+ */
+void sendPacket( const byte ans, const byte bH, const byte bL, const byte * payload, const byte len ) {
+  byte * cached = replyCache[ rxSeq % PKT_CACHE ];
+  cached[0] = ans;
+  cached[1] = bH;
+  cached[2] = bL;
+  if (len > 0) {
+    lastPayloadSeq = rxSeq;
+    lastPayloadLen = len;
+  }
+  writePacket( ans, bH, bL, rxSeq, payload, len );
+}
+
+/**
+ * Re-send the response of a packet that was already handled
+ */
+void replayPacket( const byte seq ) {
+  byte * cached = replyCache[ seq % PKT_CACHE ];
+  if ((lastPayloadLen > 0) && (seq == lastPayloadSeq) && (byte(expectSeq - 1) == seq)) {
+    writePacket( cached[0], cached[1], cached[2], seq, blockBuffer, lastPayloadLen );
+  } else {
+    writePacket( cached[0], cached[1], cached[2], seq, 0, 0 );
+  }
+}
+
+/**
+ * Fall back to the default, unprotected link at 115200 baud
+ */
+void revertLink() {
+  Serial.flush();
+  Serial.begin(115200);
+  linkReliable = false;
+}
+
+/**
+ * Wait for the next byte of a packet
+ */
+boolean readPacketByte( byte * b ) {
+  unsigned long tStart = millis();
+  while (Serial.available() < 1) {
+    if ((millis() - tStart) > PKT_BYTE_TIMEOUT)
+      return false;
+  }
+  *b = Serial.read();
+  return true;
+}
+
+/**
+ * Discard a bad packet, together with anything still arriving, so the
+ * next packet the host re-transmits starts on a clean buffer.
+ */
+boolean dropPacket() {
+  do {
+    while (Serial.available() > 0) Serial.read();
+    delay(2);
+  } while (Serial.available() > 0);
+
+  // Too many bad packets mean the host is not talking our protocol
+  // (or our baud rate) any more
+  if (++linkBadPackets >= PKT_BAD_MAX) {
+    revertLink();
+  }
+  return false;
+}
+
+/**
+ * Read a CRC-protected packet from the reliable link:
+ *
+ *  [cmd] [c1] [c2] [c3] [seq] [len] [payload ...] [crc]
+ *
+ * Returns true if this is the next packet in sequence. Packets we have
+ * already handled get their cached response again and the rest is dropped,
+ * so the host can simply re-transmit everything after a lost packet.
+ */
+boolean readPacket() {
+  byte hdr[6], crc = 0, b;
+
+  // Read header
+  for (byte i = 0; i < 6; i++) {
+    if (!readPacketByte(&hdr[i])) return dropPacket();
+    crc = crc8( crc, hdr[i] );
+  }
+  if (hdr[5] > PKT_PAYLOAD_MAX) return dropPacket();
+
+  // Read payload & validate
+  for (byte i = 0; i < hdr[5]; i++) {
+    if (!readPacketByte(&rxPayload[i])) return dropPacket();
+    crc = crc8( crc, rxPayload[i] );
+  }
+  if (!readPacketByte(&b) || (b != crc)) return dropPacket();
+  linkBadPackets = 0;
+
+  // Handle duplicates & out-of-order packets
+  if (hdr[4] != expectSeq) {
+    b = expectSeq - hdr[4];
+    if ((b >= 1) && (b <= PKT_CACHE)) {
+      replayPacket( hdr[4] );
+    }
+    return false;
+  }
+
+  // Accept packet
+  inByte = hdr[0];
+      c1 = hdr[1];
+      c2 = hdr[2];
+      c3 = hdr[3];
+   rxSeq = hdr[4];
+   rxLen = hdr[5];
+  expectSeq++;
+  linkConfirmed = true;
+  return true;
+}
+
 /**
  * Send a response frame
  */
 void sendFrame( const byte ans, const byte b0=0, const byte b1=0 ) {
+    if (linkReliable) {
+      sendPacket( ans, b1, b0, 0, 0 );
+      return;
+    }
     Serial.write(ans);
     Serial.write(b1); // Send High-order first
     Serial.write(b0); // Send Low-order second
@@ -123,20 +317,77 @@ boolean handleError( ) {
   return false;
 }
 
+/**
+ * Forward a byte of brust data to the debugger, expanding it first if the
+ * brust is RLE-compressed. A control byte below 0x80 is followed by that
+ * many + 1 literal bytes, and a control byte from 0x80 on by a single byte
+ * repeated (control & 0x7F) + 2 times. Returns the number of bytes written.
+ */
+int brustFeed( const byte b ) {
+  int n;
+
+  // Uncompressed data go straight through
+  if (!brustRle) {
+    dbg->write( b );
+    return 1;
+  }
+
+  // Control byte
+  if (rleLeft == 0) {
+    rleRepeat = (b & 0x80) != 0;
+    rleLeft = rleRepeat ? (b & 0x7F) + 2 : b + 1;
+    return 0;
+  }
+
+  // Repeated byte (never write past the end of the brust)
+  if (rleRepeat) {
+    n = (rleLeft < iRead) ? rleLeft : iRead;
+    for (int i = 0; i < n; i++) {
+      dbg->write( b );
+    }
+    rleLeft = 0;
+    return n;
+  }
+
+  // Literal byte
+  rleLeft--;
+  if (iRead <= 0) return 0;
+  dbg->write( b );
+  return 1;
+}
+
 /**
  * Main program loop
  */
 void loop() {
   
-  // Wait for incoming data frame
-  if (Serial.available() < 4)
-    return;
-  
-  // Read input frame
-  inByte = Serial.read();
-      c1 = Serial.read();
-      c2 = Serial.read();
-      c3 = Serial.read();  
+  // On the reliable link, wait for the next valid packet
+  if (linkReliable) {
+
+    // Fall back to the default link if the host never confirmed the upgrade
+    if (!linkConfirmed && ((long)(millis() - linkDeadline) > 0)) {
+      revertLink();
+      return;
+    }
+
+    if (Serial.available() < 1)
+      return;
+    if (!readPacket())
+      return;
+
+  } else {
+
+    // Wait for incoming data frame
+    if (Serial.available() < 4)
+      return;
+    
+    // Read input frame
+    inByte = Serial.read();
+        c1 = Serial.read();
+        c2 = Serial.read();
+        c3 = Serial.read();  
+
+  }
   
   // Handle commands
   if (inByte == CMD_PING) {
@@ -195,10 +446,12 @@ void loop() {
     if (handleError()) return;
     sendFrame( ANS_OK, bAns );
   
-  } else if (inByte == CMD_BRUSTWR) {
+  } else if ((inByte == CMD_BRUSTWR) || (inByte == CMD_BRUSTRLE)) {
     
-    // Calculate the size of the incoming brust
+    // Calculate the size of the incoming brust (after expansion)
     iLen = (c1 << 8) | c2;
+    brustRle = (inByte == CMD_BRUSTRLE);
+    rleLeft = 0;
     
     // Validate length
     if (iLen > 2048) {
@@ -213,17 +466,52 @@ void loop() {
     dbg->write( 0x80 | (c1 & 0x07) ); // High-order bits
     dbg->write( c2 ); // Low-order bits
     
-    // Start serial loop
+    // On the reliable link the data arrive in CMD_BRUSTDAT packets, which
+    // we acknowledge one by one so the host can keep a window in flight
     iRead = iLen;
+    tIdle = millis();
+    while (linkReliable && (iRead > 0)) {
+
+      // Wait for the next packet
+      if (Serial.available() < 1) {
+        if ((millis() - tIdle) <= BRUST_IDLE_MS) continue;
+      } else if (!readPacket()) {
+        continue;
+      } else if ((inByte == CMD_BRUSTDAT) && (brustRle || (rxLen <= iRead))) {
+
+        // Forward data & acknowledge
+        for (byte i = 0; (i < rxLen) && (iRead > 0); i++) {
+          iRead -= brustFeed( rxPayload[i] );
+        }
+        tIdle = millis();
+        if (iRead > 0) sendFrame( ANS_OK );
+        continue;
+
+      }
+
+      // The host went away (or sent something else), so complete
+      // the command by sending 0's
+      while (iRead > 0) {
+        dbg->write(0);
+        iRead--;
+      }
+      dbg->switchRead();
+      bAns = dbg->read();
+      dbg->switchWrite();
+      sendFrame( ANS_ERROR, 4 );
+      return;
+
+    }
+
+    // Start serial loop
     bIdle = 0;
     while (iRead > 0) {
 
       // When we have data, forward them to the debugger
       if (Serial.available() >= 1) {
         inByte = Serial.read();
-        dbg->write(inByte);
+        iRead -= brustFeed(inByte);
         bIdle = 0;
-        iRead--;
       }
 
       // If we don't have any data, check for idle timeout
@@ -265,6 +553,106 @@ void loop() {
     if (handleError()) return;
     sendFrame( ANS_OK, bAns );
     
+  } else if ((inByte == CMD_XDATA_RD) || (inByte == CMD_CODE_RD)) {
+
+    // Calculate the size of the block
+    iLen = (c1 << 8) | c2;
+
+    // Validate length
+    if ((iLen > BLOCK_RD_MAX) || (linkReliable && (iLen > BLOCK_WR_MAX))) {
+      sendFrame( ANS_ERROR, 3 );
+      return;
+    }
+
+    // On the reliable link the block is sent as the payload of the response,
+    // and kept until the next packet in case we have to re-send it
+    if (linkReliable) {
+      bAns = 0;
+      for (iRead = 0; iRead < iLen; iRead++) {
+        if (!dbg->error()) {
+          if (inByte == CMD_CODE_RD) {
+            dbg->exec( 0xE4 );        // CLR A
+            bAns = dbg->exec( 0x93 ); // MOVC A,@A+DPTR
+          } else {
+            bAns = dbg->exec( 0xE0 ); // MOVX A,@DPTR
+          }
+          dbg->exec( 0xA3 );          // INC DPTR
+        }
+        blockBuffer[iRead] = bAns;
+      }
+      if (handleError()) return;
+      sendPacket( ANS_OK, 0, bAns, blockBuffer, iLen );
+      return;
+    }
+
+    // Read the bytes pointed by DPTR, streaming them back as we go. The
+    // status frame that follows tells if they are valid.
+    bAns = 0;
+    for (iRead = 0; iRead < iLen; iRead++) {
+      if (!dbg->error()) {
+        if (inByte == CMD_CODE_RD) {
+          dbg->exec( 0xE4 );        // CLR A
+          bAns = dbg->exec( 0x93 ); // MOVC A,@A+DPTR
+        } else {
+          bAns = dbg->exec( 0xE0 ); // MOVX A,@DPTR
+        }
+        dbg->exec( 0xA3 );          // INC DPTR
+      }
+      Serial.write( bAns );
+    }
+
+    // Handle response
+    if (handleError()) return;
+    sendFrame( ANS_OK, bAns );
+
+  } else if (inByte == CMD_XDATA_WR) {
+
+    // Calculate the size of the block
+    iLen = (c1 << 8) | c2;
+
+    // Validate length
+    if (iLen > BLOCK_WR_MAX) {
+      sendFrame( ANS_ERROR, 3 );
+      return;
+    }
+
+    // On the reliable link the block is the payload of the packet
+    if (linkReliable) {
+      if (iLen != rxLen) {
+        sendFrame( ANS_ERROR, 3 );
+        return;
+      }
+      memcpy( blockBuffer, rxPayload, iLen );
+
+    } else {
+
+      // Confirm transfer
+      sendFrame( ANS_READY );
+
+      // Buffer the entire block before we start the (slower) debug
+      // instructions, so the serial RX buffer can never overflow
+      iRead = 0;
+      while (iRead < iLen) {
+        if (Serial.available() >= 1) {
+          blockBuffer[iRead++] = Serial.read();
+        }
+      }
+
+    }
+
+    // Write the bytes starting at DPTR
+    bAns = 0;
+    for (iRead = 0; iRead < iLen; iRead++) {
+      dbg->exec( 0x74, blockBuffer[iRead] ); // MOV A,#data
+      dbg->exec( 0xF0 );                     // MOVX @DPTR,A
+      bAns = dbg->exec( 0xA3 );              // INC DPTR
+      if (dbg->error()) break;
+    }
+
+    // Handle response
+    if (handleError()) return;
+    sendFrame( ANS_OK, bAns );
+
   } else if (inByte == CMD_RD_CFG) {
     bAns = dbg->getConfig();
     if (handleError()) return;
@@ -295,18 +683,51 @@ void loop() {
     if (handleError()) return;
     sendFrame( ANS_OK, bAns );
 
-  } else if (inByte == CMD_INSTR_UPD) {
+  } else if (inByte == CMD_CAPS) {
+    sendFrame( ANS_OK, CAP_BLOCK_RW | CAP_RELIABLE | CAP_BRUST_RLE );
 
-    // Acknowledge transfer
-    sendFrame( ANS_READY );
+  } else if (inByte == CMD_UPGRADE) {
+
+    // Validate baud rate
+    if (c1 >= sizeof(linkBaudRates) / sizeof(linkBaudRates[0])) {
+      sendFrame( ANS_ERROR, 3 );
+      return;
+    }
+
+    // Confirm with the current settings & switch to the reliable link. If
+    // the host does not reach us there in time, we fall back again.
+    sendFrame( ANS_OK );
+    Serial.begin( linkBaudRates[c1] );
+    linkReliable = true;
+    linkConfirmed = false;
+    linkDeadline = millis() + LINK_CONFIRM_MS;
+    linkBadPackets = 0;
+    lastPayloadLen = 0;
+    expectSeq = 0;
 
-    // Read 16 bytes from the input
+  } else if (inByte == CMD_INSTR_UPD) {
+
+    // Read 16 bytes from the input (or the packet payload)
     byte instrBuffer[16];
-    iRead = 0;
-    while (iRead < 16) {
-      if (Serial.available() >= 1) {
-        instrBuffer[iRead++] = Serial.read();
+    if (linkReliable) {
+      if (rxLen != 16) {
+        sendFrame( ANS_ERROR, 3 );
+        return;
       }
+      memcpy( instrBuffer, rxPayload, 16 );
+
+    } else {
+
+      // Acknowledge transfer
+      sendFrame( ANS_READY );
+
+      iRead = 0;
+      while (iRead < 16) {
+        if (Serial.available() >= 1) {
+          instrBuffer[iRead++] = Serial.read();
+        }
+      }
+
     }
 
     // Update instruction buffer
@@ -0,0 +1,45 @@
+#!/usr/bin/python
+#
+# CCLib_proxy Utilities
+# Copyright (c) 2014 Ioannis Charalampidis
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+from __future__ import print_function
+from cclib import getOptions
+from cclib.ccdaemon import CCDaemon, DAEMON_SOCKET
+import sys
+
+# Get the socket path from the arguments
+opts = getOptions("CCDebugger Session Daemon", port=False,
+	socket=":The unix socket to listen on (default: %s)" % DAEMON_SOCKET)
+
+# Start daemon
+try:
+	daemon = CCDaemon(opts['socket'] or DAEMON_SOCKET)
+except Exception as e:
+	print("ERROR: %s" % str(e))
+	sys.exit(1)
+
+# Serve until interrupted
+print("INFO: Listening on %s (use: export CC_DAEMON=%s)" % (daemon.path, daemon.path))
+try:
+	daemon.serve_forever()
+except KeyboardInterrupt:
+	pass
+finally:
+	daemon.server_close()
+
+# Done
+print("")
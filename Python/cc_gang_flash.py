@@ -0,0 +1,176 @@
+#!/usr/bin/python
+#
+# CCLib_proxy Utilities
+# Copyright (c) 2014 Ioannis Charalampidis
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+from __future__ import print_function
+from cclib import CCHEXFile, getOptions, openCCDebugger
+from cclib.ccproxy import candidatePorts
+from multiprocessing import Process, Queue
+from multiprocessing.sharedctypes import RawArray
+import sys
+import time
+
+try:
+	from queue import Empty
+except ImportError:
+	from Queue import Empty
+
+def flashTarget(port, image, blocks, offset, erase, enterDebug, results):
+	"""
+	Worker process that programs & verifies the chip on the given port, using
+	the memory blocks of the shared image
+	"""
+	started = time.time()
+	written = 0
+	try:
+
+		# Open debugger
+		dbg = openCCDebugger(port, enterDebug=enterDebug, verbose=False)
+
+		# Check for oversize data
+		maxMem = max([ addr + offset + size for (addr, start, size) in blocks ])
+		if maxMem > dbg.flashSize:
+			raise IOError("Data too big to fit in chip's memory!")
+
+		# Send chip erase
+		if erase:
+			dbg.chipErase()
+
+		# Flash & verify memory blocks
+		dbg.pauseDMA(False)
+		for (addr, start, size) in blocks:
+			dbg.writeCODE( addr + offset, bytearray(image[start:start+size]), verify=True )
+			written += size
+
+		# Report success
+		results.put( (port, written, time.time() - started, None) )
+
+	except Exception as e:
+		results.put( (port, written, time.time() - started, str(e)) )
+
+def gangFlash(ports, hexFile, offset=0, erase=False, enterDebug=False):
+	"""
+	Program the memory blocks of the hex file on all the given ports in
+	parallel, printing the progress & the report. Return a dictionary with
+	the bytes written, the time it took and the error (or None) of every port.
+	"""
+
+	# Place the memory blocks in shared memory
+	blocks = []
+	size = 0
+	for mb in hexFile.memBlocks:
+		blocks.append( (mb.addr, size, mb.size) )
+		size += mb.size
+	image = RawArray('B', size)
+	for (mb, (addr, start, size)) in zip(hexFile.memBlocks, blocks):
+		image[start:start+size] = list(mb.bytes)
+
+	# Start one worker for every port
+	print("Flashing %i bytes in %i memory blocks on %i ports:\n" % (len(image), len(blocks), len(ports)))
+	started = time.time()
+	results = Queue()
+	workers = {}
+	for port in ports:
+		workers[port] = Process(target=flashTarget, args=(port, image, blocks, offset, erase, enterDebug, results))
+		workers[port].start()
+
+	# Collect results as they arrive
+	report = {}
+	while len(report) < len(ports):
+		try:
+			(port, written, elapsed, error) = results.get(timeout=1.0)
+			report[port] = (written, elapsed, error)
+			if error:
+				print(" [FAIL] %s : %s" % (port, error))
+			else:
+				print(" [ OK ] %s : %i bytes in %0.1f sec" % (port, written, elapsed))
+			sys.stdout.flush()
+
+		except Empty:
+
+			# Check for workers that died without reporting
+			for (port, worker) in workers.items():
+				if (port not in report) and not worker.is_alive() and results.empty():
+					report[port] = (0, time.time() - started, "Worker exited with code %s" % worker.exitcode)
+					print(" [FAIL] %s : %s" % (port, report[port][2]))
+
+	# Reap workers
+	for worker in workers.values():
+		worker.join()
+	elapsed = time.time() - started
+
+	# Render report
+	failures = 0
+	totalBytes = 0
+	print("\n Port                 Bytes      Time   Throughput  Status")
+	print("-------------------- -------- -------- ------------ --------")
+	for port in ports:
+		(written, portTime, error) = report[port]
+		totalBytes += written
+		if error:
+			failures += 1
+		print(" %-20s %8i %7.1fs %8.0f B/s  %s" % (port, written, portTime,
+			written / max(portTime, 0.001), "FAILED" if error else "OK"))
+	print("")
+	print("Programmed %i of %i targets in %0.1f sec (combined throughput %0.0f B/s)" % (
+		len(ports) - failures, len(ports), elapsed, totalBytes / max(elapsed, 0.001)))
+	print("")
+	return report
+
+def main():
+	"""
+	Program the same image on all the given (or detected) ports in parallel
+	"""
+
+	# Get the ports & the image from the arguments
+	opts = getOptions("Generic CCDebugger Gang Flash Writer Tool", hexIn=True, port=False,
+		ports=":Comma-separated list of serial ports (all USB serial ports if missing)",
+		erase="Full chip erase before write",
+		offset=":Offset the addresses in the .hex file by this value")
+
+	# Get offset
+	offset = 0
+	if opts['offset']:
+		if opts['offset'][0:2] == "0x":
+			offset = int(opts['offset'], 16)
+		else:
+			offset = int(opts['offset'])
+		print("NOTE: The memory addresses are offset by %i bytes!" % offset)
+
+	# Get ports
+	if opts['ports']:
+		ports = []
+		for p in opts['ports'].split(","):
+			if p.strip() and (p.strip() not in ports):
+				ports.append(p.strip())
+	else:
+		ports = [ p[0] for p in candidatePorts() if ('acm' in p[0].lower()) or ('usb' in p[0].lower()) ]
+	if not ports:
+		print("ERROR: No serial ports to program!")
+		sys.exit(1)
+
+	# Parse the HEX file once
+	hexFile = CCHEXFile( opts['in'] )
+	hexFile.load()
+
+	# Program all targets & exit with an error if something failed
+	report = gangFlash(ports, hexFile, offset, opts['erase'], opts['enter'])
+	if [ port for (port, (written, portTime, error)) in report.items() if error ]:
+		sys.exit(3)
+
+if __name__ == '__main__':
+	main()
@@ -17,11 +17,11 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 from __future__ import print_function
-from cclib import hexdump, renderDebugStatus, renderDebugConfig, getOptions, openCCDebugger
+from cclib import hexdump, renderDebugStatus, renderDebugConfig, getOptions, openCCDebugger, renderStats
 import sys
 
 # Get serial port either form environment or from arguments
-opts = getOptions("Generic CCDebugger Information Tool")
+opts = getOptions("Generic CCDebugger Information Tool", stats=True)
 
 # Open debugger
 try:
@@ -40,5 +40,17 @@ renderDebugStatus(dbg.debugStatus)
 print("\nDebug config:")
 renderDebugConfig(dbg.debugConfig)
 
+# Show the durations of the chip operations learned so far
+timings = dbg.getTimings()
+if timings:
+	print("\nLearned timings:")
+	for (name, seconds) in sorted(timings.items()):
+		print(" %12s : %0.2f ms" % (name, seconds * 1000))
+
 # Done
 print("")
+
+# Show protocol statistics
+if opts['stats']:
+	renderStats(dbg.getStats())
+	print("")
@@ -17,42 +17,75 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 from __future__ import print_function
-from cclib import CCHEXFile, getOptions, openCCDebugger
+from cclib import CCHEXWriter, getOptions, openCCDebugger, openDryRun, renderStats, renderEstimate
 import sys
 
 # Get serial port either form environment or from arguments
-opts = getOptions("Generic CCDebugger Flash Reader Tool", hexOut=True)
+opts = getOptions("Generic CCDebugger Flash Reader Tool", stats=True, hexOut=True, dryRun=True,
+	cache="Reuse the pages read in previous sessions if the chip says their CRC didn't change",
+	used="Only read the flash pages that are not blank (found by a scan on the chip)")
 
-# Open debugger
+# Open debugger (or an emulated one for dry runs)
 try:
-	dbg = openCCDebugger(opts['port'], enterDebug=opts['enter'])
+	if opts['dry-run']:
+		dbg = openDryRun(opts['dry-run'], opts['baud'], opts['latency'], enterDebug=opts['enter'])
+	else:
+		dbg = openCCDebugger(opts['port'], enterDebug=opts['enter'])
 except Exception as e:
 	print("ERROR: %s" % str(e))
 	sys.exit(1)
 
-# Get serial number
-print("\nReading %i KBytes to %s..." % (dbg.chipInfo['flash'], opts['out']))
-hexFile = CCHEXFile(opts['out'])
+# Pick the regions to read: the entire flash, or the runs of the pages that
+# are not blank
+flashSize = dbg.chipInfo['flash'] * 1024
+regions = [ (0, flashSize) ]
+if opts['used']:
+	regions = []
+	for page in dbg.getUsedPages( 0, int(flashSize / dbg.flashPageSize) ):
+		if regions and (sum(regions[-1]) == page * dbg.flashPageSize):
+			regions[-1] = (regions[-1][0], regions[-1][1] + dbg.flashPageSize)
+		else:
+			regions.append( (page * dbg.flashPageSize, dbg.flashPageSize) )
+readSize = sum([ size for (addr, size) in regions ])
+print("\nReading %i KBytes to %s..." % (int(readSize / 1024), opts['out']))
 
-# Read in chunks of 4Kb (for UI-update purposes)
-for i in range(0, int(dbg.chipInfo['flash'] / 4)):
+# Write the chunks in the file as they arrive (there is nothing worth saving
+# from a dry run)
+hexFile = None
+if not opts['dry-run']:
+	hexFile = CCHEXWriter(opts['out'], size=flashSize)
+done = 0
+for (addr, size) in regions:
 
-	# Read CODE
-	chunk = dbg.readCODE( i * 0x1000, 0x1000 )
+	# Stream the CODE in chunks of 4Kb (for UI-update purposes), or take the
+	# unchanged pages from the cache
+	if opts['cache']:
+		chunks = ( dbg.readCODECached( ofs, min(0x1000, addr + size - ofs) ) for ofs in range(addr, addr + size, 0x1000) )
+	else:
+		chunks = dbg.iterCODE( addr, size, 0x1000 )
 
-	# Write chunk to file
-	hexFile.stack(chunk)
+	for chunk in chunks:
+		if hexFile:
+			hexFile.write(addr, chunk)
+		addr += len(chunk)
+		done += len(chunk)
 
-	# Log status
-	print("\r    Progress %.0f%%..." % ( ( (i+1)*4 * 100) / dbg.chipInfo['flash'] ), end=' ')
-	sys.stdout.flush()
+		# Log status
+		print("\r    Progress %.0f%%..." % ( done * 100 / max(1, readSize) ), end=' ')
+		sys.stdout.flush()
+if hexFile:
+	hexFile.close()
 
 # Log completion
 print("\r    Progress 100%... OK")
 
-# Save file
-hexFile.save()
-
 # Done
 print("\n\nCompleted")
 print("")
+
+# Show the predicted cost & protocol statistics
+if opts['dry-run']:
+	renderEstimate(dbg.getStats())
+if opts['stats']:
+	renderStats(dbg.getStats())
+	print("")
@@ -17,11 +17,11 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 from __future__ import print_function
-from cclib import hexdump, getOptions, openCCDebugger
+from cclib import hexdump, getOptions, openCCDebugger, renderStats
 import sys
 
 # Get serial port either form environment or from arguments
-opts = getOptions("Generic CCDebugger CPU Resume Tool")
+opts = getOptions("Generic CCDebugger CPU Resume Tool", stats=True)
 
 # Open debugger
 try:
@@ -45,3 +45,8 @@ else:
 
 # Done
 print("")
+
+# Show protocol statistics
+if opts['stats']:
+	renderStats(dbg.getStats())
+	print("")
@@ -17,16 +17,24 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 from __future__ import print_function
-from cclib import CCHEXFile, getOptions, openCCDebugger
+from cclib import CCHEXFile, getOptions, openCCDebugger, openDryRun, renderStats, renderEstimate
+from cclib.ccflash import CCFlashPlan
 import sys
 
 # Get serial port either form environment or from arguments
-opts = getOptions("Generic CCDebugger Flash Writer Tool", hexIn=True,
-	erase="Full chip erase before write", offset=":Offset the addresses in the .hex file by this value")
-
-# Open debugger
+opts = getOptions("Generic CCDebugger Flash Writer Tool", stats=True, hexIn=True, dryRun=True,
+	erase="Full chip erase before write", offset=":Offset the addresses in the .hex file by this value",
+	stub="Program the flash through a double-buffered routine running from the RAM",
+	diff="Only erase & program the flash pages that differ (compared by their CRC)",
+	readback="Verify by reading back the flash instead of comparing CRCs",
+	merge="Erase & program each page once, keeping what the file doesn't overwrite")
+
+# Open debugger (or an emulated one for dry runs)
 try:
-	dbg = openCCDebugger(opts['port'], enterDebug=opts['enter'])
+	if opts['dry-run']:
+		dbg = openDryRun(opts['dry-run'], opts['baud'], opts['latency'], enterDebug=opts['enter'])
+	else:
+		dbg = openCCDebugger(opts['port'], enterDebug=opts['enter'])
 except Exception as e:
 	print("ERROR: %s" % str(e))
 	sys.exit(1)
@@ -68,15 +76,16 @@ if maxMem > (dbg.chipInfo['flash'] * 1024):
 	print("ERROR: Data too bit to fit in chip's memory!")
 	sys.exit(4)
 
-# Confirm
+# Confirm (unless we are just estimating)
 erasePrompt = "OVERWRITE"
 if opts['erase']:
 	erasePrompt = "ERASE and REPROGRAM"
-print("This is going to %s the chip. Are you sure? <y/N>: " % erasePrompt, end=' ')
-ans = sys.stdin.readline()[0:-1]
-if (ans != "y") and (ans != "Y"):
-	print("Aborted")
-	sys.exit(2)
+if not opts['dry-run']:
+	print("This is going to %s the chip. Are you sure? <y/N>: " % erasePrompt, end=' ')
+	ans = sys.stdin.readline()[0:-1]
+	if (ans != "y") and (ans != "Y"):
+		print("Aborted")
+		sys.exit(2)
 
 
 # Flashing messages
@@ -91,19 +100,57 @@ if opts['erase']:
 	 	print("ERROR: %s" % str(e))
 	 	sys.exit(3)
 
-# Flash memory
+# Verify by CRC unless asked to read everything back
+verify = 'read' if opts['readback'] else True
+
+# Plan the page erases, keeping the data the file doesn't overwrite
 dbg.pauseDMA(False)
-print(" - Flashing %i memory blocks..." % len(hexFile.memBlocks))
-for mb in hexFile.memBlocks:
+if opts['merge'] and not opts['erase']:
+	try:
+		plan = CCFlashPlan( dbg, hexFile, offset )
+		if plan.chipErase:
+			print(" - Chip erase, then programming %i pages..." % plan.programmedPages())
+		else:
+			print(" - Erasing %i and programming %i pages..." % (plan.erasedPages(), plan.programmedPages()))
+		if plan.keptBytes:
+			print(" - Keeping %i bytes that are not in the file" % plan.keptBytes)
+		plan.execute( verify=verify, showProgress=True, stub=bool(opts['stub']) )
+	except Exception as e:
+		print("ERROR: %s" % str(e))
+		sys.exit(3)
 
-	# Flash memory block
-	print(" -> 0x%04x : %i bytes " % (mb.addr + offset, mb.size))
+# Flash only the pages that changed (the pages the file falls on are rewritten
+# as a whole, so what is not in the file ends up erased)
+elif opts['diff'] and not opts['erase']:
+	pages = hexFile.pages( dbg.flashPageSize, offset )
+	print(" - Comparing %i flash pages..." % len(pages))
 	try:
-		dbg.writeCODE( mb.addr + offset, mb.bytes, verify=True, showProgress=True )
+		changed = dbg.writeCODEDiff( pages, verify=verify, showProgress=True, stub=bool(opts['stub']) )
 	except Exception as e:
 		print("ERROR: %s" % str(e))
 		sys.exit(3)
+	print(" - %i of %i pages changed" % (len(changed), len(pages)))
+
+# Flash memory
+else:
+	print(" - Flashing %i memory blocks..." % len(hexFile.memBlocks))
+	for mb in hexFile.memBlocks:
+
+		# Flash memory block
+		print(" -> 0x%04x : %i bytes " % (mb.addr + offset, mb.size))
+		try:
+			dbg.writeCODE( mb.addr + offset, mb.bytes, verify=verify, showProgress=True, stub=bool(opts['stub']) )
+		except Exception as e:
+			print("ERROR: %s" % str(e))
+			sys.exit(3)
 
 # Done
 print("\nCompleted")
 print("")
+
+# Show the predicted cost & protocol statistics
+if opts['dry-run']:
+	renderEstimate(dbg.getStats())
+if opts['stats']:
+	renderStats(dbg.getStats())
+	print("")
@@ -20,7 +20,7 @@
 from cclib.ccdebugger import *
 from cclib.cchex import *
 
-def getOptions(shortDesc, argHelp="", hexIn=False, hexOut=False, port=True, **kwargs):
+def getOptions(shortDesc, argHelp="", hexIn=False, hexOut=False, port=True, stats=False, dryRun=False, **kwargs):
 	"""
 	Reusable function to collect command-line options.
 	"""
@@ -50,6 +50,18 @@ def getOptions(shortDesc, argHelp="", hexIn=False, hexOut=False, port=True, **kw
 		values['port'] = os.environ.get("CC_SERIAL", None)
 		arg_help += " [-p|--port=<serial>]"
 		arguments.append( ('p:', 'port=', 'Specify the serial port to use (autodetect if missing)' ) )
+	if stats:
+		values['stats'] = False
+		arg_help += " [-S|--stats]"
+		arguments.append( ('S', 'stats', 'Print protocol statistics when done' ) )
+	if dryRun:
+		values['dry-run'] = None
+		values['baud'] = None
+		values['latency'] = None
+		arg_help += " [-D|--dry-run=<chip>] [-B|--baud=<rate>] [-L|--latency=<ms>]"
+		arguments.append( ('D:', 'dry-run=', 'Estimate the cost on an emulated chip (like CC2540) instead' ) )
+		arguments.append( ('B:', 'baud=', 'Baud rate of the emulated link (default 115200)' ) )
+		arguments.append( ('L:', 'latency=', 'Latency of the emulated link in ms (default 1)' ) )
 
 	# New line
 	if len(kwargs) > 0:
@@ -0,0 +1,749 @@
+#
+# CCLib_proxy Interface Library for High-Level operations
+# Copyright (c) 2014-2016 Ioannis Charalampidis
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# NOTE: This module requires python 3.5 or later and therefore it's not
+#       imported by `cclib` itself. Use `from cclib.ccasync import asyncDriver`
+#
+import asyncio
+from cclib.ccproxy import CMD_EXEC_1, CMD_EXEC_2, CMD_EXEC_3, CMD_BRUSTWR, CMD_BRUSTRLE, \
+	CMD_CHPERASE, CMD_ENTER, CMD_STATUS, CMD_XDATA_RD, CMD_XDATA_WR, CMD_CODE_RD, \
+	CMD_PC, CMD_RESUME, CMD_HALT, \
+	ANS_READY, CAP_BLOCK_RW, CAP_BRUST_RLE, BLOCK_RD_MAX, BLOCK_WR_MAX, rleCompress, \
+	POLL_EARLY, POLL_MIN, POLL_MAX
+from cclib.ccflash import isBlank
+from cclib.chip.cc254x import CC254X, dmaDescriptor
+from cclib.chip.cc2510 import CC2510, FLASH_ROUTINE, FLASH_BUFFER, FLASH_ROUTINE_CODE
+
+class CCAsyncTransport:
+	"""
+	Non-blocking transport on top of the serial port used by a CCLibProxy.
+
+	Incoming data are collected through `loop.add_reader` on the file descriptor
+	of the port. Local stand-ins without a file descriptor (ex. emulators) are
+	expected to never block, so they are read directly.
+	"""
+
+	def __init__(self, ser, loop=None):
+		"""
+		Initialize the transport on the given serial port
+		"""
+		self.ser = ser
+		self.loop = loop or asyncio.get_event_loop()
+		self.buffer = bytearray()
+		self.waiter = None
+
+		# Register the port file descriptor on the loop, if we have one
+		try:
+			self.fd = ser.fileno()
+		except (AttributeError, IOError, ValueError):
+			self.fd = None
+		if self.fd is not None:
+			self.loop.add_reader(self.fd, self._onReadable)
+
+	def close(self):
+		"""
+		Detach from the event loop
+		"""
+		if self.fd is not None:
+			self.loop.remove_reader(self.fd)
+			self.fd = None
+
+	def _onReadable(self):
+		"""
+		Collect the available data when the port becomes readable
+		"""
+		self.buffer += self.ser.read(self.ser.in_waiting or 1)
+
+		# Wake up the pending reader
+		if (self.waiter is not None) and not self.waiter.done():
+			self.waiter.set_result(None)
+
+	def write(self, data):
+		"""
+		Send data to the port
+		"""
+		self.ser.write(data)
+		self.ser.flush()
+
+	async def read(self, size):
+		"""
+		Wait until `size` bytes are available and return them
+		"""
+
+		# Local stand-ins are read directly
+		if self.fd is None:
+			data = bytearray(self.ser.read(size))
+			if len(data) < size:
+				raise IOError("Could not read from the serial port!")
+			return data
+
+		# Wait for the reader callback to collect enough data
+		while len(self.buffer) < size:
+			self.waiter = self.loop.create_future()
+			await self.waiter
+		self.waiter = None
+
+		# Pop data
+		data = self.buffer[0:size]
+		del self.buffer[0:size]
+		return data
+
+class AsyncChipDriver:
+	"""
+	asyncio front-end for a ChipDriver. It drives the same serial port and
+	keeps the debug state of the wrapped driver up to date, so the two can be
+	used interchangeably (but never concurrently).
+
+	Each instance must be driven by a single task at a time, however a single
+	event loop can drive as many instances as needed.
+	"""
+
+	def __init__(self, driver, loop=None):
+		"""
+		Wrap the given (initialized) chip driver
+		"""
+		self.driver = driver
+		self.loop = loop or asyncio.get_event_loop()
+
+		# The frames are exchanged on the raw link
+		if getattr(driver, 'linkReliable', False):
+			raise IOError("The asyncio front-end does not support the upgraded link")
+
+		# Make sure nothing is left in the synchronous queue, & name the cached
+		# flash contents of the device while we can still talk to it directly
+		driver.flushQueue()
+		driver.cacheDevice()
+		self.transport = CCAsyncTransport(driver.ser, self.loop)
+
+	def close(self):
+		"""
+		Detach from the event loop
+		"""
+		self.transport.close()
+
+	###############################################
+	# Low-level functions
+	###############################################
+
+	async def readFrame(self, raiseException=True):
+		"""
+		Read and translate the 3-byte response frame from arduino
+		"""
+		frame = await self.transport.read(3)
+		return self.driver.decodeFrame(frame, raiseException)
+
+	async def sendFrame(self, cmd, c1=0, c2=0, c3=0, raiseException=True):
+		"""
+		Send the specified frame and wait for its response
+		"""
+		# The registers we change bypass the shadow cache of the driver
+		self.driver.shadow.clear()
+		self.transport.write( bytearray([cmd, c1, c2, c3]) )
+		return await self.readFrame(raiseException)
+
+	async def sendFrames(self, frames):
+		"""
+		Send a list of (cmd, c1, c2, c3) frames, keeping as many in flight as
+		the proxy allows, and return the list of their responses
+		"""
+		ans = []
+		depth = self.driver.pipelineDepth
+		self.driver.shadow.clear()
+		for i in range(0, len(frames), depth):
+			batch = frames[i:i+depth]
+
+			# Write the entire window at once
+			data = bytearray()
+			for f in batch:
+				data += bytearray(f)
+			self.transport.write(data)
+
+			# Collect responses
+			data = await self.transport.read(3 * len(batch))
+			for j in range(0, len(batch)):
+				ans.append( self.driver.decodeFrame(data[j*3:j*3+3]) )
+
+		# Return responses
+		return ans
+
+	async def instr(self, c1, c2=None, c3=None):
+		"""
+		Execute a debug instruction
+		"""
+		if (c2 == None):
+			return await self.sendFrame(CMD_EXEC_1, c1)
+		elif (c3 == None):
+			return await self.sendFrame(CMD_EXEC_2, c1, c2)
+		else:
+			return await self.sendFrame(CMD_EXEC_3, c1, c2, c3)
+
+	async def instri(self, c1, i1):
+		"""
+		Execute a debug instruction with 16-bit constant
+		"""
+		return await self.sendFrame(CMD_EXEC_3, c1, (i1 >> 8) & 0xFF, i1 & 0xFF)
+
+	async def getStatus(self):
+		"""
+		Return the debug status
+		"""
+		ans = await self.sendFrame(CMD_STATUS)
+		self.driver.debugStatus = ans
+		return ans
+
+	async def getPC(self):
+		"""
+		Return the program counter position
+		"""
+		return await self.sendFrame(CMD_PC)
+
+	async def setPC(self, address):
+		"""
+		Set the program counter (the CPU must be halted)
+		"""
+		return await self.instri( 0x02, address )	# LJMP addr16
+
+	async def resume(self):
+		"""
+		Resume program execution
+		"""
+		self.driver.erasedPages.clear()
+		self.driver.cpuRunning = True
+		return await self.sendFrame(CMD_RESUME)
+
+	async def halt(self):
+		"""
+		Halt program execution
+		"""
+		self.driver.cpuRunning = False
+		return await self.sendFrame(CMD_HALT)
+
+	async def brustWrite(self, data):
+		"""
+		Perform a brust-write operation which allows us to write
+		up to 2Kb in the DBGDATA register.
+		"""
+
+		# Validate length
+		length = len(data)
+		if length > 2048:
+			return False
+
+		# Compress the data if the proxy can expand them & it pays off
+		cmd = CMD_BRUSTWR
+		if self.driver.capabilities & CAP_BRUST_RLE:
+			packed = rleCompress(data)
+			if len(packed) < length:
+				(cmd, data) = (CMD_BRUSTRLE, packed)
+
+		# Prepare for BRUST frame transmission
+		ans = await self.sendFrame(cmd, (length >> 8) & 0xFF, length & 0xFF)
+		if ans != ANS_READY:
+			raise IOError("Unable to prepare for brust-write! (Unknown response 0x%02x)" % ans)
+
+		# Send data & handle response
+		self.transport.write(bytearray(data))
+		self.driver.debugStatus = await self.readFrame()
+		return self.driver.debugStatus
+
+	async def waitFor(self, operation, done, scale=1.0, timeout=None):
+		"""
+		Await `done()` until it returns True, sleeping until just before the
+		expected completion of the given operation and then polling with a
+		backoff, like CCLibProxy.waitFor (and with the same learned timings)
+
+		Returns False if the operation did not complete within `timeout`.
+		"""
+		driver = self.driver
+		name = driver.timingName()
+		started = driver.clock()
+
+		# Sleep until just before the expected completion
+		expected = driver.timings.expected(name, operation)
+		if expected is not None:
+			await asyncio.sleep(expected * scale * POLL_EARLY)
+
+		# Then poll with backoff
+		interval = POLL_MIN
+		while not await done():
+			if (timeout is not None) and (driver.clock() - started > timeout):
+				return False
+			await asyncio.sleep(interval)
+			interval = min(interval * 2, POLL_MAX)
+
+		driver.timings.learn(name, operation, (driver.clock() - started) / scale)
+		return True
+
+	async def chipErase(self):
+		"""
+		Perform a chip erase
+		"""
+
+		# Re-enter debug mode & send chip erase command
+		await self.sendFrame(CMD_ENTER)
+		self.driver.debugStatus = await self.sendFrame(CMD_CHPERASE)
+
+		# Wait until CHIP_ERASE_BUSY goes down
+		async def erased():
+			return (( await self.getStatus() ) & 0x80 ) == 0
+		await self.waitFor('chipErase', erased)
+
+		# All the flash pages are now blank
+		self.driver.erasedPages.update( range(0, int(self.driver.flashSize / self.driver.flashPageSize)) )
+		self.driver.flashCache.forget( self.driver.cacheDevice() )
+
+		# We are good
+		return self.driver.debugStatus
+
+	###############################################
+	# Data functions
+	###############################################
+
+	async def readXDATA(self, offset, size):
+		"""
+		Read any size of buffer from the XDATA region
+		"""
+		await self.instri( 0x90, offset )	# MOV DPTR,#data16
+		return await self._readLoop(CMD_XDATA_RD, size, [(CMD_EXEC_1, 0xE0, 0, 0)])
+
+	async def writeXDATA(self, offset, bytes):
+		"""
+		Write any size of buffer in the XDATA region
+		"""
+		await self.instri( 0x90, offset )	# MOV DPTR,#data16
+
+		# Let the proxy run the write loop if it can
+		if self.driver.capabilities & CAP_BLOCK_RW:
+			for i in range(0, len(bytes), BLOCK_WR_MAX):
+				chunk = bytearray(bytes[i:i+BLOCK_WR_MAX])
+				ans = await self.sendFrame(CMD_XDATA_WR, (len(chunk) >> 8) & 0xFF, len(chunk) & 0xFF)
+				if ans != ANS_READY:
+					raise IOError("Unable to prepare for block-write! (Unknown response 0x%02x)" % ans)
+				self.transport.write(chunk)
+				await self.readFrame()
+			return len(bytes)
+
+		# Otherwise pipeline the instructions
+		frames = []
+		for b in bytes:
+			frames.append( (CMD_EXEC_2, 0x74, b, 0) )	# MOV A,#data
+			frames.append( (CMD_EXEC_1, 0xF0, 0, 0) )	# MOVX @DPTR,A
+			frames.append( (CMD_EXEC_1, 0xA3, 0, 0) )	# INC DPTR
+		await self.sendFrames(frames)
+		return len(bytes)
+
+	async def _readLoop(self, blockCmd, size, readFrames):
+		"""
+		Read `size` bytes starting at DPTR either with the block command of
+		the proxy or by pipelining `readFrames` followed by INC DPTR
+		"""
+
+		# Let the proxy run the read loop if it can
+		if self.driver.capabilities & CAP_BLOCK_RW:
+			ans = bytearray()
+			while len(ans) < size:
+				iLen = min(size - len(ans), BLOCK_RD_MAX)
+				self.transport.write( bytearray([blockCmd, (iLen >> 8) & 0xFF, iLen & 0xFF, 0]) )
+				ans += await self.transport.read(iLen)
+				await self.readFrame()
+			return ans
+
+		# Otherwise pipeline the instructions and keep the last
+		# response of every read sequence
+		frames = []
+		step = len(readFrames) + 1
+		for i in range(0, size):
+			frames += readFrames
+			frames.append( (CMD_EXEC_1, 0xA3, 0, 0) )	# INC DPTR
+		ans = await self.sendFrames(frames)
+		return bytearray([ ans[i*step + step - 2] for i in range(0, size) ])
+
+class AsyncCC254X(AsyncChipDriver):
+	"""
+	asyncio front-end for the CC254X chip driver
+	"""
+
+	async def selectXDATABank(self, bank):
+		"""
+		Select XDATA bank from the Memory Arbiter Control register
+		"""
+		a = await self.instr( 0xE5, 0xC7 )	# MOV A,direct
+		a = (a & 0xF8) | (bank & 0x07)
+		return await self.instr( 0x75, 0xC7, a )	# MOV direct,#data
+
+	async def readCODE(self, offset, size):
+		"""
+		Read any size of buffer from the XDATA+0x8000 (code-mapped) region
+		"""
+
+		ans = bytearray()
+		while size > 0:
+
+			# Pick the code bank this code chunk belongs to
+			fBank = int(offset / 0x8000 )
+			await self.selectXDATABank( fBank )
+
+			# Read up to the end of the bank from the XDATA-mapped CODE region
+			iLen = min( size, (fBank + 1) * 0x8000 - offset )
+			ans += await self.readXDATA( 0x8000 + offset - fBank * 0x8000, iLen )
+			offset += iLen
+			size -= iLen
+
+		return ans
+
+	async def configDMAChannel(self, index, srcAddr, dstAddr, trigger, memBase=0x1000, **kwargs):
+		"""
+		Create a DMA buffer and place it in memory (see CC254X.configDMAChannel)
+		"""
+
+		# Place configuration in memory
+		memAddr = memBase + index*8
+		await self.writeXDATA( memAddr, dmaDescriptor(srcAddr, dstAddr, trigger, **kwargs) )
+
+		# Update DMA registers
+		if index == 0:
+			await self.instr( 0x75, 0xD4, memAddr & 0xFF )			# MOV direct,#data @ DMA0CFGL
+			await self.instr( 0x75, 0xD5, (memAddr >> 8) & 0xFF )	# MOV direct,#data @ DMA0CFGH
+		else:
+			memAddr = memBase + 8
+			await self.instr( 0x75, 0xD2, memAddr & 0xFF )			# MOV direct,#data @ DMA1CFGL
+			await self.instr( 0x75, 0xD3, (memAddr >> 8) & 0xFF )	# MOV direct,#data @ DMA1CFGH
+
+	async def armDMAChannel(self, index):
+		"""
+		Arm a DMA channel (index in 0-4)
+		"""
+		a = await self.instr( 0xE5, 0xD6 )				# MOV A,direct @ DMAARM
+		await self.instr( 0x75, 0xD6, a | (1 << index) )	# MOV direct,#data @ DMAARM
+
+	async def disarmDMAChannel(self, index):
+		"""
+		Disarm a DMA channel (index in 0-4)
+		"""
+		a = await self.instr( 0xE5, 0xD6 )					# MOV A,direct @ DMAARM
+		await self.instr( 0x75, 0xD6, a & ~(1 << index) & 0xFF )	# MOV direct,#data @ DMAARM
+
+	async def isDMAIRQ(self, index):
+		"""
+		Check if DMA IRQ flag is set (index in 0-4)
+		"""
+		a = await self.instr( 0xE5, 0xD1 )	# MOV A,direct @ DMAIRQ
+		return ((a & (1 << index)) != 0)
+
+	async def clearDMAIRQ(self, index):
+		"""
+		Clear DMA IRQ flag (index in 0-4)
+		"""
+		a = await self.instr( 0xE5, 0xD1 )					# MOV A,direct @ DMAIRQ
+		await self.instr( 0x75, 0xD1, a & ~(1 << index) & 0xFF )	# MOV direct,#data @ DMAIRQ
+
+	async def readFlashControl(self):
+		"""
+		Read the flash control register (FCTL)
+		"""
+		return (await self.readXDATA(0x6270, 1))[0]
+
+	async def erasePage(self, page):
+		"""
+		Erase the given flash page & wait for completion
+		"""
+		driver = self.driver
+		await self.writeXDATA( 0x6271, [0, page << 1] )
+		await self.writeXDATA( 0x6270, [ (await self.readFlashControl()) | 0x01 ] )
+		async def erased():
+			return ((await self.readFlashControl()) & 0x80) == 0
+		await self.waitFor('erasePage', erased)
+
+		# The page is now blank
+		driver.erasedPages.add(page)
+		driver.flashCache.put( driver.cacheDevice(), page, b'\xFF' * driver.flashPageSize )
+
+	async def writeCODE(self, offset, data, erase=False, verify=False, showProgress=False):
+		"""
+		Fully automated function for writing the Flash memory. This follows
+		the same sequence as CC254X.writeCODE, yielding to the event loop
+		while waiting for the device.
+
+		WARNING: This requires DMA operations to be unpaused ( use: self.driver.pauseDMA(False) )
+		"""
+		driver = self.driver
+		bulkBlockSize = self.driver.bulkBlockSize
+		flashPageSize = self.driver.flashPageSize
+
+		# Prepare DMA-0 for DEBUG -> RAM (using DBG_BW trigger) and
+		# DMA-1 for RAM -> FLASH (using the FLASH trigger)
+		async def configDMA(tlen):
+			await self.configDMAChannel( 0, 0x6260, 0x0000, 0x1F, tlen=tlen, srcInc=0, dstInc=1, priority=1, interrupt=True )
+			await self.configDMAChannel( 1, 0x0000, 0x6273, 0x12, tlen=tlen, srcInc=1, dstInc=0, priority=2, interrupt=True )
+		await configDMA(bulkBlockSize)
+
+		# Reset flags
+		await self.writeXDATA(0x6270, [ (await self.readFlashControl()) & 0x1F ])
+		await self.clearDMAIRQ(0)
+		await self.clearDMAIRQ(1)
+		await self.disarmDMAChannel(0)
+		await self.disarmDMAChannel(1)
+
+		# Split in 2048-byte chunks
+		driver.elidedPages = 0
+		iOfs = 0
+		while (iOfs < len(data)):
+
+			# Check if we should show progress
+			if showProgress:
+				print("\r    Progress %0.0f%%... " % (iOfs*100/len(data)), end=' ')
+
+			# Get next page, skipping the blank ones on erased pages (which
+			# we erase here, without blocking the event loop)
+			iLen = min( len(data) - iOfs, bulkBlockSize )
+			if erase and isBlank(data[iOfs:iOfs+iLen]):
+				await self.erasePage( int( (offset + iOfs) / flashPageSize ) )
+			if driver.skipBlankBlock( offset + iOfs, data[iOfs:iOfs+iLen] ):
+				iOfs += iLen
+				continue
+
+			# Update DMA configuration if it's smaller
+			if (iLen < bulkBlockSize):
+				await configDMA(iLen)
+
+			# Upload to RAM through DMA-0
+			await self.armDMAChannel(0)
+			await self.brustWrite( data[iOfs:iOfs+iLen] )
+			await self.waitFor('brustDMA', lambda: self.isDMAIRQ(0))
+			await self.clearDMAIRQ(0)
+
+			# Calculate the page and the word offset this data belong to
+			fAddr = offset + iOfs
+			fPage = int( fAddr / flashPageSize )
+			fWordOffset = int(fAddr / 4)
+			await self.writeXDATA( 0x6271, [fWordOffset & 0xFF, (fWordOffset >> 8) & 0xFF] )
+
+			# Check if we should erase page first
+			if erase:
+				await self.erasePage(fPage)
+				await self.writeXDATA( 0x6271, [fWordOffset & 0xFF, (fWordOffset >> 8) & 0xFF] )
+			driver.markWritten(fAddr, iLen)
+
+			# Upload to FLASH through DMA-1
+			await self.armDMAChannel(1)
+			await self.writeXDATA( 0x6270, [ (await self.readFlashControl()) | 0x02 ] )
+
+			# Wait until DMA-1 raises interrupt, checking for errors
+			async def written():
+				if await self.isDMAIRQ(1):
+					return True
+				if (await self.readFlashControl()) & 0x20:
+					await self.disarmDMAChannel(1)
+					raise IOError("Flash page 0x%02x is locked!" % fPage)
+				return False
+			await self.waitFor('flashWrite', written, scale=float(iLen) / bulkBlockSize)
+			await self.clearDMAIRQ(1)
+
+			# Check if we should verify
+			if verify:
+				verifyBytes = await self.readCODE(fAddr, iLen)
+				if verifyBytes != data[iOfs:iOfs+iLen]:
+					raise IOError("Flash verification error on offset 0x%04x" % fAddr)
+			iOfs += iLen
+		driver.cacheCODE(offset, data)
+
+		if showProgress:
+			if driver.elidedPages:
+				print("\r    Progress 100%%... OK (%i blank pages skipped)" % driver.elidedPages)
+			else:
+				print("\r    Progress 100%... OK")
+
+class AsyncCC2510(AsyncChipDriver):
+	"""
+	asyncio front-end for the CC2510 chip driver
+	"""
+
+	async def getRegister(self, reg):
+		"""
+		Return the value of the given register
+		"""
+		return await self.instr( 0xE5, reg )	# MOV A,direct
+
+	async def setRegister(self, reg, v):
+		"""
+		Update the value of the given register
+		"""
+		return await self.instr( 0x75, reg, v )	# MOV direct,#data
+
+	async def readCODE(self, offset, size):
+		"""
+		Read any size of buffer from the CODE region
+		"""
+
+		# Pick the code bank this code chunk belongs to
+		fBank = int(offset / 0x8000 )
+		await self.setRegister( 0xC7, fBank*16 + 1 )	# MEMCTR
+
+		# Read CODE region
+		await self.instri( 0x90, offset - fBank * 0x8000 )	# MOV DPTR,#data16
+		return await self._readLoop(CMD_CODE_RD, size, [
+				(CMD_EXEC_1, 0xE4, 0, 0),	# CLR A
+				(CMD_EXEC_1, 0x93, 0, 0),	# MOVC A,@A+DPTR
+			])
+
+	async def erasePage(self, page):
+		"""
+		Erase the given flash page & wait for completion
+		"""
+		driver = self.driver
+
+		# Select the page to erase using FADDRH[7:1] & set the erase bit
+		await self.setRegister( 0xAC, 0 )			# FADDRL
+		await self.setRegister( 0xAD, page << 1 )	# FADDRH
+		await self.setRegister( 0xAE, (await self.getRegister( 0xAE )) | 0x01 )	# FCTL
+		async def erased():
+			return ((await self.getRegister( 0xAE )) & 0x80) == 0
+		await self.waitFor('erasePage', erased)
+
+		# The page is now blank
+		driver.erasedPages.add(page)
+		driver.flashCache.put( driver.cacheDevice(), page, b'\xFF' * driver.flashPageSize )
+
+	async def writeFlashPages(self, address, data, erase=True):
+		"""
+		Program the consecutive flash pages at the given address (erasing them
+		first) through the flash routine, like CC2510.writeFlashPages. The
+		routine is uploaded once per call, since the front-end doesn't keep
+		the shadow cache of the driver.
+
+		The CPU registers are overwritten, while the program counter & MEMCTR
+		are restored.
+		"""
+		driver = self.driver
+		if (address % driver.flashPageSize) or (len(data) % driver.flashPageSize):
+			raise IOError("The data must cover entire flash pages!")
+		page = int(address / driver.flashPageSize)
+		pages = int(len(data) / driver.flashPageSize)
+		perRun = driver.getFlashPagesPerRun()
+
+		# Keep what the routine changes (running it forgets the erased pages)
+		pc = await self.getPC()
+		memctr = await self.getRegister( 0xC7 )
+		erasedPages = set(driver.erasedPages)
+
+		await self.writeXDATA( FLASH_ROUTINE, FLASH_ROUTINE_CODE )
+		iOfs = 0
+		while pages > 0:
+			count = min( pages, perRun )
+			await self.writeXDATA( FLASH_BUFFER, data[iOfs:iOfs+count*driver.flashPageSize] )
+
+			# Pass the pages & run the routine
+			await self.setRegister( 0xC7, 0x51 )
+			await self.instri( 0x90, FLASH_BUFFER )				# MOV DPTR,#FLASH_BUFFER
+			await self.instr( 0x7C, count )						# MOV R4,#count
+			await self.instr( 0x7B, (page << 1) & 0xFF )		# MOV R3,#FADDRH
+			await self.instr( 0x7A, 1 if erase else 0 )			# MOV R2,#erase
+			await self.setPC( FLASH_ROUTINE )
+			await self.resume()
+
+			# Wait until it reaches its breakpoint
+			async def stopped():
+				return ((await self.getStatus()) & 0x20) != 0
+			if not await self.waitFor( 'flashRoutine', stopped, scale=count, timeout=2.0 * count ):
+				raise IOError("Flash write timed out!")
+			await self.halt()
+
+			page += count
+			pages -= count
+			iOfs += count * driver.flashPageSize
+
+		# Restore the CPU state & the pages we know are erased
+		await self.setRegister( 0xC7, memctr )
+		await self.setPC( pc )
+		driver.erasedPages.update( erasedPages )
+		driver.markWritten( address, len(data) )
+
+		# Programming pages that were not erased clears the bits of what they
+		# had, so we only know what the erased ones hold
+		if erase:
+			driver.cacheCODE( address, data )
+		else:
+			for p in range(int(address / driver.flashPageSize), page):
+				driver.flashCache.forget( driver.cacheDevice(), p )
+
+	async def writeCODE(self, offset, data, erase=False, verify=False, showProgress=False):
+		"""
+		Fully automated function for writing the Flash memory. This follows
+		the same sequence as CC2510.writeCODE, yielding to the event loop
+		while waiting for the device.
+		"""
+		driver = self.driver
+		flashPageSize = driver.flashPageSize
+
+		# Pad the data to entire pages
+		start = offset - offset % flashPageSize
+		pageData = bytearray([0xFF] * (offset - start)) + bytearray(data)
+		pageData += bytearray([0xFF] * (-len(pageData) % flashPageSize))
+
+		# Pick the pages to program (erasing is all it takes for a blank page,
+		# and nothing at all if it's already erased)
+		pages = []
+		driver.elidedPages = 0
+		for iOfs in range(0, len(pageData), flashPageSize):
+			block = pageData[iOfs:iOfs+flashPageSize]
+			if erase and isBlank(block):
+				await self.erasePage( int( (start + iOfs) / flashPageSize ) )
+			if driver.skipBlankBlock( start + iOfs, block ):
+				continue
+			pages.append( iOfs )
+
+		# Program them in runs of consecutive pages
+		perRun = driver.getFlashPagesPerRun()
+		while pages:
+			iOfs = pages[0]
+			count = 1
+			while (count < min(len(pages), perRun)) and (pages[count] == iOfs + count * flashPageSize):
+				count += 1
+			pages = pages[count:]
+
+			# Check if we should show progress
+			if showProgress:
+				print("\r    Progress %0.0f%%... " % (iOfs*100/len(pageData)), end=' ')
+
+			await self.writeFlashPages( start + iOfs, pageData[iOfs:iOfs+count*flashPageSize], erase )
+
+		# Check if we should verify
+		if verify:
+			verifyBytes = await self.readCODE(offset, len(data))
+			for i in range(0, len(data)):
+				if verifyBytes[i] != data[i]:
+					raise IOError("Flash verification error on offset 0x%04x" % (offset + i))
+
+		if showProgress:
+			if driver.elidedPages:
+				print("\r    Progress 100%%... OK (%i blank pages skipped)" % driver.elidedPages)
+			else:
+				print("\r    Progress 100%... OK")
+
+# asyncio front-ends for every chip driver
+ASYNC_DRIVERS = [ (CC2510, AsyncCC2510), (CC254X, AsyncCC254X) ]
+
+def asyncDriver(driver, loop=None):
+	"""
+	Return the asyncio front-end for the given chip driver instance
+	"""
+	for (cls, asyncCls) in ASYNC_DRIVERS:
+		if isinstance(driver, cls):
+			return asyncCls(driver, loop)
+	raise IOError("No asyncio front-end for %s!" % driver.__class__.__name__)
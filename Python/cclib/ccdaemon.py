@@ -0,0 +1,272 @@
+#
+# CCLib_proxy Interface Library for High-Level operations
+# Copyright (c) 2014-2016 Ioannis Charalampidis
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+from __future__ import print_function
+from importlib import import_module
+import threading
+import socket
+import json
+import os
+
+try:
+	import socketserver
+except ImportError:
+	import SocketServer as socketserver
+
+# The default location of the daemon socket
+DAEMON_SOCKET = os.path.join(os.path.expanduser("~"), ".cclib.sock")
+
+# Driver properties mirrored to the clients after every call
+DRIVER_STATE = [ 'port', 'chipID', 'debugStatus', 'debugConfig', 'instructionTableVersion',
+	'capabilities', 'chipInfo', 'flashSize', 'flashPageSize', 'sramSize', 'bulkBlockSize' ]
+
+def encodeValue(value):
+	"""
+	Convert a value to its JSON-compatible representation
+	"""
+	if isinstance(value, bytearray) or ((bytes is not str) and isinstance(value, bytes)):
+		return { '__bytes__': "".join([ "%02x" % b for b in bytearray(value) ]) }
+	elif isinstance(value, (list, tuple)):
+		return [ encodeValue(v) for v in value ]
+	elif isinstance(value, dict):
+		return dict([ (k, encodeValue(v)) for (k, v) in value.items() ])
+	return value
+
+def decodeValue(value):
+	"""
+	Convert a JSON-compatible representation back to its value
+	"""
+	if isinstance(value, dict):
+		if '__bytes__' in value:
+			return bytearray.fromhex(value['__bytes__'])
+		return dict([ (k, decodeValue(v)) for (k, v) in value.items() ])
+	elif isinstance(value, list):
+		return [ decodeValue(v) for v in value ]
+	return value
+
+class CCDaemonSession:
+	"""
+	An initialized chip driver owned by the daemon, and the lock that
+	serializes the clients using it
+	"""
+
+	def __init__(self, driver):
+		"""
+		Initialize the session
+		"""
+		self.driver = driver
+		self.lock = threading.Lock()
+
+	def state(self):
+		"""
+		Return the properties of the driver the clients mirror
+		"""
+		return dict([ (k, encodeValue(getattr(self.driver, k, None))) for k in DRIVER_STATE ])
+
+class CCDaemonHandler(socketserver.StreamRequestHandler):
+	"""
+	Handle the requests of a single client connection
+	"""
+
+	def handle(self):
+		"""
+		Serve newline-delimited JSON requests until the client disconnects
+		"""
+		port = None
+		while True:
+			line = self.rfile.readline()
+			if not line:
+				break
+
+			# Handle request
+			try:
+				req = json.loads(line.decode('utf-8'))
+				if req['call'] == 'open':
+					(port, ans) = self.server.openSession(req.get('port'), req.get('driver'), req.get('enter', False))
+				else:
+					ans = self.server.callSession(port, req['call'], req.get('args', []), req.get('kwargs', {}))
+			except Exception as e:
+				ans = { 'error': str(e) }
+
+			# Send response
+			self.wfile.write( (json.dumps(ans) + "\n").encode('utf-8') )
+			self.wfile.flush()
+
+class CCDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+	"""
+	Long-running server that owns the serial ports and the initialized chip
+	drivers, so that repeated operations skip the port reset and the driver
+	initialization. Clients are served concurrently, but every call on a port
+	is serialized.
+	"""
+	daemon_threads = True
+
+	def __init__(self, path=DAEMON_SOCKET):
+		"""
+		Start listening on the given unix socket
+		"""
+
+		# Remove stale socket
+		if os.path.exists(path):
+			os.unlink(path)
+
+		# Only the owner can talk to the daemon
+		umask = os.umask(0o077)
+		try:
+			socketserver.UnixStreamServer.__init__(self, path, CCDaemonHandler)
+		finally:
+			os.umask(umask)
+
+		self.path = path
+		self.sessions = {}
+		self.sessionsLock = threading.Lock()
+		self.openLock = threading.Lock()
+
+	def server_close(self):
+		"""
+		Close the socket & remove it from the filesystem
+		"""
+		socketserver.UnixStreamServer.server_close(self)
+		if os.path.exists(self.path):
+			os.unlink(self.path)
+
+	def openSession(self, port, driver=None, enterDebug=False):
+		"""
+		Return the name of the port and the state of the driver for the given
+		port, opening it if there is no session yet
+		"""
+		from cclib.ccdebugger import openCCDebugger
+
+		# Resolve the driver class
+		if driver is not None:
+			(module, name) = driver.rsplit(".", 1)
+			driver = getattr(import_module(module), name)
+
+		# Only one session is opened at a time, but without holding up the
+		# clients of the open ones while the port is probed
+		with self.openLock:
+			with self.sessionsLock:
+
+				# Re-use the session on the same port (or the only one if
+				# auto-detecting, since probing would reset the ports we hold)
+				session = self.sessions.get(port)
+				if (session is None) and (port in (None, 'auto')) and self.sessions:
+					if len(self.sessions) > 1:
+						raise IOError("Several debugger sessions are open, please specify the port")
+					session = list(self.sessions.values())[0]
+					if (driver is not None) and not isinstance(session.driver, driver):
+						raise IOError("The open debugger session on %s uses another driver, please specify the port" % session.driver.port)
+				if (session is not None) and (driver is not None) and not isinstance(session.driver, driver):
+					session = None
+
+			# Open a new session otherwise
+			if session is None:
+				inst = openCCDebugger(port, driver=driver, enterDebug=enterDebug, verbose=False, daemon=False)
+				session = CCDaemonSession(inst)
+				with self.sessionsLock:
+					self.sessions[inst.port] = session
+				print("INFO: Opened a %s chip on %s" % (inst.chipName(), inst.port))
+				enterDebug = False
+
+		# Refresh the debug state of the chip
+		with session.lock:
+			if enterDebug:
+				session.driver.enter()
+			session.driver.getStatus()
+			session.driver.debugConfig = session.driver.readConfig()
+			return (session.driver.port, { 'state': session.state() })
+
+	def callSession(self, port, call, args, kwargs):
+		"""
+		Call a driver method on the session of the given port
+		"""
+		session = self.sessions.get(port)
+		if session is None:
+			raise IOError("No debugger session is open")
+		if call.startswith("_"):
+			raise IOError("Invalid call '%s'" % call)
+
+		# Serialize calls on the same port
+		with session.lock:
+			try:
+				ans = getattr(session.driver, call)( *decodeValue(args), **decodeValue(kwargs) )
+			except (OSError, EnvironmentError) as e:
+
+				# The port is probably gone, so drop the session on serial errors
+				if e.__class__.__module__.startswith("serial"):
+					with self.sessionsLock:
+						self.sessions.pop(port, None)
+				raise
+
+			return { 'result': encodeValue(ans), 'state': session.state() }
+
+class CCDaemonDriver:
+	"""
+	Client-side stand-in for a chip driver owned by the cclib daemon. Every
+	method call is forwarded to the daemon, while the driver properties
+	(chipID, chipInfo, debugStatus, ...) are mirrored locally.
+	"""
+
+	def __init__(self, port=None, driver=None, enterDebug=False, path=DAEMON_SOCKET):
+		"""
+		Connect to the daemon & open a session on the given port
+		"""
+		self.__dict__['sock'] = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		try:
+			self.sock.connect(path)
+		except socket.error:
+			raise IOError("Could not connect to the cclib daemon on %s" % path)
+		self.__dict__['stream'] = self.sock.makefile('rwb')
+
+		# Open a session
+		if driver is not None:
+			driver = "%s.%s" % (driver.__module__, driver.__name__)
+		self._request({ 'call': 'open', 'port': port, 'driver': driver, 'enter': enterDebug })
+
+	def _request(self, req):
+		"""
+		Send a request to the daemon & return the result
+		"""
+		self.stream.write( (json.dumps(req) + "\n").encode('utf-8') )
+		self.stream.flush()
+		line = self.stream.readline()
+		if not line:
+			raise IOError("The cclib daemon closed the connection")
+
+		# Handle response
+		ans = json.loads(line.decode('utf-8'))
+		if 'error' in ans:
+			raise IOError(ans['error'])
+		self.__dict__.update(decodeValue(ans['state']))
+		return decodeValue(ans.get('result'))
+
+	def __getattr__(self, name):
+		"""
+		Forward method calls to the daemon
+		"""
+		if name.startswith("_"):
+			raise AttributeError(name)
+		def call(*args, **kwargs):
+			return self._request({ 'call': name, 'args': encodeValue(args), 'kwargs': encodeValue(kwargs) })
+		return call
+
+	def close(self):
+		"""
+		Disconnect from the daemon (the session stays open)
+		"""
+		self.stream.close()
+		self.sock.close()
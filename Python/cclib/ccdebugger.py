@@ -21,46 +21,74 @@ from cclib.cchex import toHex, fromHex
 import math
 import time
 import sys
+import os
 
 # Chip drivers the CCDebugger will test for
 from cclib.chip.cc254x import CC254X
 from cclib.chip.cc2510 import CC2510
 CHIP_DRIVERS = [ CC254X, CC2510 ]
 
-def openCCDebugger( port, driver=None, enterDebug=False ):
+def openCCDebugger( port, driver=None, enterDebug=False, verbose=True, daemon=None, baudrate=None, trace=None ):
 	"""
 	Factory function that instantiates the appropriate chip and/or extension
-	classes according to the information obtained from the serial port
+	classes according to the information obtained from the serial port.
+	Set `verbose` to False to skip printing the chip information.
+
+	If `daemon` (or the CC_DAEMON environment variable) points to the socket
+	of a cclib daemon, the debugger session is served by the daemon instead.
+
+	If `baudrate` (or the CC_BAUDRATE environment variable) is set, the link
+	to the proxy is upgraded to that baud rate and to CRC-protected packets.
+
+	If `trace` (or the CC_TRACE environment variable) is set, the serial traffic
+	is recorded in that file. Pass "replay:<file>" as `port` to replay it.
 	"""
 
-	# Create a proxy class (this raises IOError on errors)
-	proxy = CCLibProxy( port, enterDebug=enterDebug )
+	# Forward everything to the cclib daemon if we should use one
+	if daemon is None:
+		daemon = os.environ.get("CC_DAEMON", None)
+	if daemon:
+		from cclib.ccdaemon import CCDaemonDriver
+		inst = CCDaemonDriver(port, driver=driver, enterDebug=enterDebug, path=daemon)
+
+	else:
 
-	# Check if no chip is connected
-	if proxy.chipID == 0x0000:
-		raise IOError("No chip found. Check your connection and/or wiring!")
-	if proxy.chipID == 0xffff:
-		raise IOError("Short-circuit or wrong wiring detected. Check your connection and/or wiring!")
+		# Create a proxy class (this raises IOError on errors)
+		if baudrate is None:
+			baudrate = int(os.environ.get("CC_BAUDRATE", 0))
+		if trace is None:
+			trace = os.environ.get("CC_TRACE", None)
+		proxy = CCLibProxy( port, enterDebug=enterDebug, baudrate=baudrate, trace=trace )
 
-	# Locate the appropriate chip driver to instantiate
-	if driver is None:
+		# Check if no chip is connected
+		if proxy.chipID == 0x0000:
+			raise IOError("No chip found. Check your connection and/or wiring!")
+		if proxy.chipID == 0xffff:
+			raise IOError("Short-circuit or wrong wiring detected. Check your connection and/or wiring!")
 
-		# Test known drivers
-		for d in CHIP_DRIVERS:
-			if d.test( proxy.chipID ):
-				driver = d
-				break
+		# Locate the appropriate chip driver to instantiate
+		if driver is None:
 
-		# Raise an exception if no compatible driver was found
-		if not driver:
-			raise IOError("No driver found for your chip (chipID=0x%04x)!" % proxy.chipID)
+			# Test known drivers
+			for d in CHIP_DRIVERS:
+				if d.test( proxy.chipID ):
+					driver = d
+					break
 
-	# Initialize
-	inst = driver(proxy=proxy)
-	inst.initialize()
+			# Raise an exception if no compatible driver was found
+			if not driver:
+				raise IOError("No driver found for your chip (chipID=0x%04x)!" % proxy.chipID)
+
+		# Initialize
+		inst = driver(proxy=proxy)
+		inst.initialize()
+
+	# Return driver if we should stay quiet
+	if not verbose:
+		return inst
 
 	# Log message
-	print("INFO: Found a %s chip on %s" % ( inst.chipName(), proxy.port ))
+	print("INFO: Found a %s chip on %s" % ( inst.chipName(), inst.port ))
 
 	# Get info
 	print("\nChip information:")
@@ -134,3 +162,52 @@ def renderDebugStatus(cfg):
 	else:
 		print(" [ ] STACK_OVERFLOW")
 
+def openDryRun(chip, baudrate=None, latency=None, enterDebug=False, verbose=True):
+	"""
+	Open a debugger on an emulated chip of the given model, over a link with
+	the given baud rate and latency (in ms), for estimating the cost of
+	operations without the hardware
+	"""
+	from cclib.ccemulator import createEmulator
+	port = createEmulator(chip, baudrate=int(baudrate or 115200), latency=float(latency or 1) / 1000.0)
+	return openCCDebugger(port, enterDebug=enterDebug, verbose=verbose)
+
+def renderEstimate(stats):
+	"""
+	Visualize the predicted cost of a dry run (from the getStats of the emulated chip)
+	"""
+	commands = stats['commands'].values()
+	print("\nDry run estimate:")
+	print("       Frames : %i" % sum([ c['frames'] for c in commands ]))
+	print("   Bytes sent : %i" % sum([ c['bytesOut'] for c in commands ]))
+	print("  Brust bytes : %i" % sum([ c['brustBytes'] for c in commands ]))
+	print("  Round trips : %i" % sum([ c['roundTrips'] for c in commands ]))
+	print("        Polls : %i" % stats['polls'])
+	print("    Wall time : %0.2fs" % stats['elapsed'])
+
+def renderStats(stats):
+	"""
+	Visualize the protocol statistics (as returned by getStats)
+	"""
+	print("\nProtocol statistics:")
+	print(" Command        Frames  Bytes out  Bytes in  Brust bytes  Round trips  Wait time  Avg wait")
+	print("------------- -------- ---------- --------- ------------ ------------ ---------- ---------")
+	for (name, c) in sorted(stats['commands'].items(), key=lambda v: -v[1]['readTime']):
+		print(" %-13s %7i %10i %9i %12i %12i %9.3fs %7.2fms" % (name[4:] if name.startswith("CMD_") else name,
+			c['frames'], c['bytesOut'], c['bytesIn'], c['brustBytes'], c['roundTrips'], c['readTime'],
+			1000.0 * c['readTime'] / max(c['roundTrips'], 1)))
+
+	# Render the histogram of all the round trips
+	counts = [ sum(v) for v in zip(*[ c['histogram'] for c in stats['commands'].values() ]) ]
+	if counts:
+		print("\n Round trip time:")
+		bounds = [ "%0.1fms" % (b * 1000) for b in stats['buckets'] ]
+		labels = [ "< %s" % b for b in bounds ] + [ ">= %s" % bounds[-1] ]
+		for (label, count) in zip(labels, counts):
+			print(" %10s : %i" % (label, count))
+
+	# Tell where the time went
+	times = [ ('link', stats['readTime']), ('poll', stats['pollTime']), ('host', stats['hostTime']) ]
+	print("\n Total %0.2fs = %0.2fs waiting for the proxy + %0.2fs in %i polls + %0.2fs on the host (%i re-transmissions)" % (
+		stats['elapsed'], stats['readTime'], stats['pollTime'], stats['polls'], stats['hostTime'], stats['retransmits']))
+	print(" The session was %s-bound" % max(times, key=lambda v: v[1])[0])
@@ -0,0 +1,1884 @@
+#
+# CCLib_proxy Interface Library for High-Level operations
+# Copyright (c) 2014-2016 Ioannis Charalampidis
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+from __future__ import print_function
+from cclib.ccprotocol import CMD_ENTER, CMD_EXIT, CMD_CHIP_ID, CMD_STATUS, \
+	CMD_PC, CMD_STEP, CMD_EXEC_1, CMD_EXEC_2, CMD_EXEC_3, CMD_BRUSTWR, \
+	CMD_RD_CFG, CMD_WR_CFG, CMD_CHPERASE, CMD_RESUME, CMD_HALT, CMD_XDATA_RD, \
+	CMD_XDATA_WR, CMD_CODE_RD, CMD_BRUSTRLE, CMD_PING, CMD_INSTR_VER, \
+	CMD_INSTR_UPD, CMD_CAPS, CMD_UPGRADE, CMD_BRUSTDAT, CAP_BLOCK_RW, CAP_RELIABLE, \
+	CAP_BRUST_RLE, ANS_OK, ANS_ERROR, ANS_READY, LINK_BAUDRATES, PKT_PAYLOAD_MAX, \
+	PKT_CACHE, PKT_BAD_MAX, LINK_CONFIRM, BLOCK_WR_MAX, crc8
+from cclib.ccflash import crc16
+import heapq
+
+# The instruction table the CCLib_proxy sketch boots with (see CCDebugger.cpp)
+DEFAULT_INSTR_TABLE = [ 1, 0x40, 0x48, 0x20, 0x18, 0x51, 0x52, 0x53, 0x68, 0x28, 0x30, 0x58, 0x10, 0, 0, 0 ]
+(I_HALT, I_RESUME, I_RD_CONFIG, I_WR_CONFIG, I_DEBUG_INSTR_1, I_DEBUG_INSTR_2, I_DEBUG_INSTR_3,
+	I_GET_CHIP_ID, I_GET_PC, I_READ_STATUS, I_STEP_INSTR, I_CHIP_ERASE) = range(1, 13)
+
+# Modelled timings (in seconds)
+EMU_INSTR_TIME    = 62.5e-9   # An 8051 instruction (2 cycles at 32 MHz on average)
+EMU_FLASH_WORD    = 20e-6     # Programming a flash word
+EMU_FLASH_TIMEOUT = 40e-6     # A flash write ends if no data arrive for that long
+EMU_PAGE_ERASE    = 20e-3     # Erasing a flash page
+EMU_CHIP_ERASE    = 20e-3     # Erasing the entire flash
+EMU_DEBUG_BYTE    = 100e-6    # A byte on the debug interface (bit-banged by the arduino)
+EMU_DEBUG_ENTER   = 1e-3      # The reset sequence that enters debug mode
+EMU_FRAME_TIME    = 20e-6     # The arduino handling a command frame
+EMU_LATENCY       = 1e-3      # Round-trip latency of the USB-serial adapter
+
+# Instructions the CPU can run between two commands before we give up on
+# emulating it in real time
+EMU_MAX_INSTRUCTIONS = 2000000
+
+# 8051 special function registers of the core
+SFR_SP    = 0x81
+SFR_DPL0  = 0x82
+SFR_DPH0  = 0x83
+SFR_DPL1  = 0x84
+SFR_DPH1  = 0x85
+SFR_DPS   = 0x92
+SFR_MPAGE = 0x93
+SFR_PSW   = 0xD0
+SFR_ACC   = 0xE0
+SFR_B     = 0xF0
+
+# SFRs of the peripherals common to the CC chips
+SFR_FMAP     = 0x9F
+SFR_RNDL     = 0xBC
+SFR_RNDH     = 0xBD
+SFR_MEMCTR   = 0xC7
+SFR_DMAIRQ   = 0xD1
+SFR_DMA1CFGL = 0xD2
+SFR_DMA1CFGH = 0xD3
+SFR_DMA0CFGL = 0xD4
+SFR_DMA0CFGH = 0xD5
+SFR_DMAARM   = 0xD6
+SFR_DMAREQ   = 0xD7
+
+# PSW flags
+PSW_CY = 0x80
+PSW_AC = 0x40
+PSW_OV = 0x04
+
+# DMA triggers
+DMA_TRIG_NONE   = 0
+DMA_TRIG_FLASH  = 18
+DMA_TRIG_DBG_BW = 31
+
+# Bits of the flash control register (FCTL)
+FCTL_BUSY  = 0x80
+FCTL_FULL  = 0x40
+FCTL_ABORT = 0x20
+FCTL_WRITE = 0x02
+FCTL_ERASE = 0x01
+
+# Bits of the debug status
+STATUS_CHIP_ERASE_BUSY = 0x80
+STATUS_CPU_HALTED      = 0x20
+STATUS_HALT_STATUS     = 0x08
+STATUS_OSC_STABLE      = 0x02
+
+# Debug configuration bit that pauses the DMA while the CPU is halted
+CONFIG_DMA_PAUSE = 0x04
+
+class CC8051:
+	"""
+	Instruction-level model of the 8051 core of the CC chips. The memory
+	spaces are reached through the xdataRead/xdataWrite, codeRead and
+	sfrRead/sfrWrite methods, which the chip models override to place their
+	peripherals in the memory map. Every instruction takes `instrTime`.
+
+	A loop that goes around without changing anything (like polling a flag)
+	makes the CPU idle until the next scheduled event.
+	"""
+
+	def __init__(self):
+		"""
+		Initialize the core
+		"""
+		self.iram = bytearray(256)
+		self.sfr = bytearray(256)
+		self.pc = 0
+		self.halted = True
+		self.breakpoint = False
+		self.idle = False
+		self.now = 0.0
+		self.instrTime = EMU_INSTR_TIME
+		self.instructions = 0
+		self.writes = 0
+		self.events = []
+		self.eventSeq = 0
+		self._fetch = self._fetchCode
+		self._debugCode = None
+		self._debugPos = 0
+		self._ops = self._buildTable()
+
+	def reset(self):
+		"""
+		Reset the CPU registers
+		"""
+		self.sfr[:] = bytearray(256)
+		self.sfr[SFR_SP] = 0x07
+		self.pc = 0
+		self.breakpoint = False
+		self.idle = False
+
+	###############################################
+	# Memory spaces
+	###############################################
+
+	def codeRead(self, addr):
+		"""
+		Read a byte from the CODE space
+		"""
+		return 0xFF
+
+	def xdataRead(self, addr):
+		"""
+		Read a byte from the XDATA space
+		"""
+		return 0
+
+	def xdataWrite(self, addr, value):
+		"""
+		Write a byte in the XDATA space
+		"""
+		pass
+
+	def sfrRead(self, addr):
+		"""
+		Read a special function register
+		"""
+		return self.sfr[addr]
+
+	def sfrWrite(self, addr, value):
+		"""
+		Write a special function register
+		"""
+		self.sfr[addr] = value
+
+	###############################################
+	# Time keeping
+	###############################################
+
+	def schedule(self, when, callback):
+		"""
+		Call `callback` when the emulated time reaches `when`
+		"""
+		if when <= self.now:
+			callback()
+			return
+		self.eventSeq += 1
+		heapq.heappush(self.events, (when, self.eventSeq, callback))
+
+	def _runEvents(self):
+		"""
+		Fire the events that are due
+		"""
+		while self.events and (self.events[0][0] <= self.now):
+			heapq.heappop(self.events)[2]()
+
+	def advance(self, seconds):
+		"""
+		Let `seconds` of emulated time pass, running the CPU if it's not halted
+		"""
+		end = self.now + seconds
+		budget = EMU_MAX_INSTRUCTIONS
+		loop = None
+		while (not self.halted) and (self.now < end) and (budget > 0) and not self.idle:
+			pc = self.pc
+			self.step()
+			budget -= 1
+
+			# Skip to the next event if a loop went around without writing
+			# anything & came back to the same state
+			if self.pc <= pc:
+				state = (self.pc, self.writes, bytes(self.sfr), bytes(self.iram))
+				if state == loop:
+					if not self.events or (self.events[0][0] >= end):
+						break
+					self.now = max(self.now, self.events[0][0])
+					self._runEvents()
+				loop = state
+		self.idle = False
+		if self.now < end:
+			self.now = end
+		self._runEvents()
+
+	###############################################
+	# Execution
+	###############################################
+
+	def step(self):
+		"""
+		Execute the instruction at PC
+		"""
+		op = self.codeRead(self.pc)
+		self.pc = (self.pc + 1) & 0xFFFF
+		self._fetch = self._fetchCode
+		self._ops[op](op)
+		self.now += self.instrTime
+		self.instructions += 1
+		if self.events and (self.events[0][0] <= self.now):
+			self._runEvents()
+
+	def execDebug(self, code):
+		"""
+		Execute the given instruction bytes without fetching them from CODE
+		(like a debug instruction does) and return the accumulator
+		"""
+		self._debugCode = bytearray(code)
+		self._debugPos = 1
+		self._fetch = self._fetchDebug
+		self._ops[self._debugCode[0]](self._debugCode[0])
+		self._fetch = self._fetchCode
+		self.instructions += 1
+		return self.sfr[SFR_ACC]
+
+	def _fetchCode(self):
+		b = self.codeRead(self.pc)
+		self.pc = (self.pc + 1) & 0xFFFF
+		return b
+
+	def _fetchDebug(self):
+		pos = self._debugPos
+		self._debugPos += 1
+		if pos < len(self._debugCode):
+			return self._debugCode[pos]
+		return 0
+
+	###############################################
+	# Register & operand helpers
+	###############################################
+
+	def _rd(self, addr):
+		if addr < 0x80:
+			return self.iram[addr]
+		return self.sfrRead(addr)
+
+	def _wr(self, addr, value):
+		if addr < 0x80:
+			self.iram[addr] = value & 0xFF
+		else:
+			self.writes += 1
+			self.sfrWrite(addr, value & 0xFF)
+
+	def _rn(self, op):
+		return (self.sfr[SFR_PSW] & 0x18) | (op & 0x07)
+
+	def _ri(self, op):
+		return self.iram[(self.sfr[SFR_PSW] & 0x18) | (op & 0x01)]
+
+	def _src(self, op):
+		"""
+		Fetch the source operand of the arithmetic/logic groups
+		"""
+		lo = op & 0x0F
+		if lo == 4:
+			return self._fetch()
+		elif lo == 5:
+			return self._rd(self._fetch())
+		elif lo < 8:
+			return self.iram[self._ri(op)]
+		return self.iram[(self.sfr[SFR_PSW] & 0x18) | (op & 0x07)]
+
+	def _getBit(self, bit):
+		if bit < 0x80:
+			return (self.iram[0x20 + (bit >> 3)] >> (bit & 7)) & 1
+		return (self.sfrRead(bit & 0xF8) >> (bit & 7)) & 1
+
+	def _setBit(self, bit, value):
+		mask = 1 << (bit & 7)
+		if bit < 0x80:
+			addr = 0x20 + (bit >> 3)
+			self.iram[addr] = (self.iram[addr] | mask) if value else (self.iram[addr] & ~mask)
+		else:
+			addr = bit & 0xF8
+			v = self.sfrRead(addr)
+			self.writes += 1
+			self.sfrWrite(addr, (v | mask) if value else (v & ~mask & 0xFF))
+
+	def _carry(self):
+		return (self.sfr[SFR_PSW] >> 7) & 1
+
+	def _setCarry(self, value):
+		if value:
+			self.sfr[SFR_PSW] |= PSW_CY
+		else:
+			self.sfr[SFR_PSW] &= ~PSW_CY & 0xFF
+
+	def _dptr(self):
+		if self.sfr[SFR_DPS] & 1:
+			return (self.sfr[SFR_DPH1] << 8) | self.sfr[SFR_DPL1]
+		return (self.sfr[SFR_DPH0] << 8) | self.sfr[SFR_DPL0]
+
+	def _setDptr(self, value):
+		if self.sfr[SFR_DPS] & 1:
+			(self.sfr[SFR_DPH1], self.sfr[SFR_DPL1]) = ((value >> 8) & 0xFF, value & 0xFF)
+		else:
+			(self.sfr[SFR_DPH0], self.sfr[SFR_DPL0]) = ((value >> 8) & 0xFF, value & 0xFF)
+
+	def _push(self, value):
+		sp = (self.sfr[SFR_SP] + 1) & 0xFF
+		self.sfr[SFR_SP] = sp
+		self.iram[sp] = value & 0xFF
+
+	def _pop(self):
+		sp = self.sfr[SFR_SP]
+		self.sfr[SFR_SP] = (sp - 1) & 0xFF
+		return self.iram[sp]
+
+	def _jumpRel(self, rel):
+		self.pc = (self.pc + (rel - 256 if rel & 0x80 else rel)) & 0xFFFF
+
+	def _add(self, value, carry):
+		a = self.sfr[SFR_ACC]
+		r = a + value + carry
+		psw = self.sfr[SFR_PSW] & 0x3B
+		if r > 0xFF:
+			psw |= PSW_CY
+		if (a & 0x0F) + (value & 0x0F) + carry > 0x0F:
+			psw |= PSW_AC
+		if (~(a ^ value) & (a ^ r)) & 0x80:
+			psw |= PSW_OV
+		self.sfr[SFR_PSW] = psw
+		self.sfr[SFR_ACC] = r & 0xFF
+
+	def _subb(self, value):
+		a = self.sfr[SFR_ACC]
+		carry = self._carry()
+		r = a - value - carry
+		psw = self.sfr[SFR_PSW] & 0x3B
+		if r < 0:
+			psw |= PSW_CY
+		if (a & 0x0F) - (value & 0x0F) - carry < 0:
+			psw |= PSW_AC
+		if ((a ^ value) & (a ^ r)) & 0x80:
+			psw |= PSW_OV
+		self.sfr[SFR_PSW] = psw
+		self.sfr[SFR_ACC] = r & 0xFF
+
+	###############################################
+	# Instructions
+	###############################################
+
+	def _buildTable(self):
+		"""
+		Build the opcode dispatch table
+		"""
+		t = [ None ] * 256
+		for op in range(0, 256):
+			lo = op & 0x0F
+			hi = op >> 4
+			if (op & 0x1F) == 0x01:
+				t[op] = self._opAjmp
+			elif (op & 0x1F) == 0x11:
+				t[op] = self._opAcall
+			elif (lo >= 4) and (hi in (0x2, 0x3, 0x9)):
+				t[op] = self._opArith
+			elif (lo >= 4) and (hi in (0x4, 0x5, 0x6)):
+				t[op] = self._opLogicA
+			elif (lo >= 5) and (hi == 0xE):
+				t[op] = self._opMovA
+			elif (lo >= 4) and (hi in (0x0, 0x1)):
+				t[op] = self._opIncDec
+			elif (lo >= 6) and (hi in (0x7, 0x8, 0xA, 0xF)):
+				t[op] = self._opMovReg
+			elif (lo >= 4) and (hi == 0xB):
+				t[op] = self._opCjne
+			elif (lo >= 5) and (hi == 0xC):
+				t[op] = self._opXch
+			elif (lo >= 8) and (hi == 0xD):
+				t[op] = self._opDjnzR
+		for (op, fn) in [
+				(0x00, self._opNop), (0x02, self._opLjmp), (0x03, self._opRr), (0x10, self._opJbc),
+				(0x12, self._opLcall), (0x13, self._opRrc), (0x20, self._opJb), (0x22, self._opRet),
+				(0x23, self._opRl), (0x30, self._opJnb), (0x32, self._opRet), (0x33, self._opRlc),
+				(0x40, self._opJc), (0x42, self._opLogicDir), (0x43, self._opLogicDir), (0x50, self._opJnc),
+				(0x52, self._opLogicDir), (0x53, self._opLogicDir), (0x60, self._opJz), (0x62, self._opLogicDir),
+				(0x63, self._opLogicDir), (0x70, self._opJnz), (0x72, self._opBitC), (0x73, self._opJmpA),
+				(0x74, self._opMovA), (0x75, self._opMovDirImm), (0x80, self._opSjmp), (0x82, self._opBitC),
+				(0x83, self._opMovcPC), (0x84, self._opDiv), (0x85, self._opMovDirDir), (0x90, self._opMovDptr),
+				(0x92, self._opMovBitC), (0x93, self._opMovcDptr), (0xA0, self._opBitC), (0xA2, self._opMovCBit),
+				(0xA3, self._opIncDptr), (0xA4, self._opMul), (0xA5, self._opBreak), (0xB0, self._opBitC),
+				(0xB2, self._opCplBit), (0xB3, self._opCplC), (0xC0, self._opPush), (0xC2, self._opClrBit),
+				(0xC3, self._opClrC), (0xC4, self._opSwap), (0xD0, self._opPop), (0xD2, self._opSetbBit),
+				(0xD3, self._opSetbC), (0xD4, self._opDa), (0xD5, self._opDjnzDir), (0xD6, self._opXchd),
+				(0xD7, self._opXchd), (0xE0, self._opMovx), (0xE2, self._opMovx), (0xE3, self._opMovx),
+				(0xE4, self._opClrA), (0xF0, self._opMovx), (0xF2, self._opMovx), (0xF3, self._opMovx),
+				(0xF4, self._opCplA), (0xF5, self._opMovDirA),
+			]:
+			t[op] = fn
+
+		# MOV direct,src & MOV src,direct
+		for op in range(0x86, 0x90):
+			t[op] = self._opMovDirReg
+		for op in (0x76, 0x77, 0x78, 0x79, 0x7A, 0x7B, 0x7C, 0x7D, 0x7E, 0x7F):
+			t[op] = self._opMovRegImm
+		return t
+
+	def _opNop(self, op):
+		pass
+
+	def _opBreak(self, op):
+		# The CC debugger halts the CPU on this (otherwise reserved) opcode
+		self.halted = True
+		self.breakpoint = True
+
+	def _opAjmp(self, op):
+		addr = ((op >> 5) << 8) | self._fetch()
+		self.pc = (self.pc & 0xF800) | addr
+
+	def _opAcall(self, op):
+		addr = ((op >> 5) << 8) | self._fetch()
+		self._push(self.pc & 0xFF)
+		self._push(self.pc >> 8)
+		self.pc = (self.pc & 0xF800) | addr
+
+	def _opLjmp(self, op):
+		hi = self._fetch()
+		self.pc = (hi << 8) | self._fetch()
+
+	def _opLcall(self, op):
+		hi = self._fetch()
+		addr = (hi << 8) | self._fetch()
+		self._push(self.pc & 0xFF)
+		self._push(self.pc >> 8)
+		self.pc = addr
+
+	def _opRet(self, op):
+		hi = self._pop()
+		self.pc = (hi << 8) | self._pop()
+
+	def _opSjmp(self, op):
+		rel = self._fetch()
+		if (rel == 0xFE) and (self._fetch == self._fetchCode):
+			self.idle = True
+		self._jumpRel(rel)
+
+	def _opJmpA(self, op):
+		self.pc = (self.sfr[SFR_ACC] + self._dptr()) & 0xFFFF
+
+	def _opJc(self, op):
+		rel = self._fetch()
+		if self._carry():
+			self._jumpRel(rel)
+
+	def _opJnc(self, op):
+		rel = self._fetch()
+		if not self._carry():
+			self._jumpRel(rel)
+
+	def _opJz(self, op):
+		rel = self._fetch()
+		if self.sfr[SFR_ACC] == 0:
+			self._jumpRel(rel)
+
+	def _opJnz(self, op):
+		rel = self._fetch()
+		if self.sfr[SFR_ACC] != 0:
+			self._jumpRel(rel)
+
+	def _opJb(self, op):
+		bit = self._fetch()
+		rel = self._fetch()
+		if self._getBit(bit):
+			self._jumpRel(rel)
+
+	def _opJnb(self, op):
+		bit = self._fetch()
+		rel = self._fetch()
+		if not self._getBit(bit):
+			self._jumpRel(rel)
+
+	def _opJbc(self, op):
+		bit = self._fetch()
+		rel = self._fetch()
+		if self._getBit(bit):
+			self._setBit(bit, 0)
+			self._jumpRel(rel)
+
+	def _opCjne(self, op):
+		lo = op & 0x0F
+		if lo == 4:
+			(a, b) = (self.sfr[SFR_ACC], self._fetch())
+		elif lo == 5:
+			(a, b) = (self.sfr[SFR_ACC], self._rd(self._fetch()))
+		elif lo < 8:
+			(a, b) = (self.iram[self._ri(op)], self._fetch())
+		else:
+			(a, b) = (self.iram[self._rn(op)], self._fetch())
+		rel = self._fetch()
+		self._setCarry(a < b)
+		if a != b:
+			self._jumpRel(rel)
+
+	def _opDjnzR(self, op):
+		r = self._rn(op)
+		rel = self._fetch()
+		self.iram[r] = (self.iram[r] - 1) & 0xFF
+		if self.iram[r]:
+			self._jumpRel(rel)
+
+	def _opDjnzDir(self, op):
+		addr = self._fetch()
+		rel = self._fetch()
+		v = (self._rd(addr) - 1) & 0xFF
+		self._wr(addr, v)
+		if v:
+			self._jumpRel(rel)
+
+	def _opArith(self, op):
+		v = self._src(op)
+		hi = op >> 4
+		if hi == 0x2:
+			self._add(v, 0)
+		elif hi == 0x3:
+			self._add(v, self._carry())
+		else:
+			self._subb(v)
+
+	def _opLogicA(self, op):
+		v = self._src(op)
+		hi = op >> 4
+		if hi == 0x4:
+			self.sfr[SFR_ACC] |= v
+		elif hi == 0x5:
+			self.sfr[SFR_ACC] &= v
+		else:
+			self.sfr[SFR_ACC] ^= v
+
+	def _opLogicDir(self, op):
+		addr = self._fetch()
+		v = self._fetch() if (op & 0x0F) == 3 else self.sfr[SFR_ACC]
+		hi = op >> 4
+		if hi == 0x4:
+			self._wr(addr, self._rd(addr) | v)
+		elif hi == 0x5:
+			self._wr(addr, self._rd(addr) & v)
+		else:
+			self._wr(addr, self._rd(addr) ^ v)
+
+	def _opBitC(self, op):
+		bit = self._getBit(self._fetch())
+		if op in (0xA0, 0xB0):
+			bit ^= 1
+		if op in (0x72, 0xA0):
+			self._setCarry(self._carry() | bit)
+		else:
+			self._setCarry(self._carry() & bit)
+
+	def _opMovBitC(self, op):
+		self._setBit(self._fetch(), self._carry())
+
+	def _opMovCBit(self, op):
+		self._setCarry(self._getBit(self._fetch()))
+
+	def _opCplBit(self, op):
+		bit = self._fetch()
+		self._setBit(bit, not self._getBit(bit))
+
+	def _opCplC(self, op):
+		self._setCarry(not self._carry())
+
+	def _opClrBit(self, op):
+		self._setBit(self._fetch(), 0)
+
+	def _opClrC(self, op):
+		self._setCarry(0)
+
+	def _opSetbBit(self, op):
+		self._setBit(self._fetch(), 1)
+
+	def _opSetbC(self, op):
+		self._setCarry(1)
+
+	def _opIncDec(self, op):
+		d = 1 if (op < 0x10) else -1
+		lo = op & 0x0F
+		if lo == 4:
+			self.sfr[SFR_ACC] = (self.sfr[SFR_ACC] + d) & 0xFF
+		elif lo == 5:
+			addr = self._fetch()
+			self._wr(addr, self._rd(addr) + d)
+		else:
+			r = self._ri(op) if (lo < 8) else self._rn(op)
+			self.iram[r] = (self.iram[r] + d) & 0xFF
+
+	def _opIncDptr(self, op):
+		self._setDptr((self._dptr() + 1) & 0xFFFF)
+
+	def _opMovDptr(self, op):
+		hi = self._fetch()
+		self._setDptr((hi << 8) | self._fetch())
+
+	def _opMovA(self, op):
+		self.sfr[SFR_ACC] = self._src(op)
+
+	def _opMovDirA(self, op):
+		self._wr(self._fetch(), self.sfr[SFR_ACC])
+
+	def _opMovDirImm(self, op):
+		addr = self._fetch()
+		self._wr(addr, self._fetch())
+
+	def _opMovDirDir(self, op):
+		src = self._fetch()
+		self._wr(self._fetch(), self._rd(src))
+
+	def _opMovDirReg(self, op):
+		r = self._ri(op) if (op < 0x88) else self._rn(op)
+		self._wr(self._fetch(), self.iram[r])
+
+	def _opMovRegImm(self, op):
+		r = self._ri(op) if (op < 0x78) else self._rn(op)
+		self.iram[r] = self._fetch()
+
+	def _opMovReg(self, op):
+		# MOV @Ri/Rn,src (the source is picked by the high nibble)
+		r = self._ri(op) if ((op & 0x0F) < 8) else self._rn(op)
+		hi = op >> 4
+		if hi == 0x7:
+			self.iram[r] = self._fetch()
+		elif hi == 0xA:
+			self.iram[r] = self._rd(self._fetch())
+		elif hi == 0xF:
+			self.iram[r] = self.sfr[SFR_ACC]
+		else:
+			self._wr(self._fetch(), self.iram[r])
+
+	def _opMovcDptr(self, op):
+		self.sfr[SFR_ACC] = self.codeRead((self.sfr[SFR_ACC] + self._dptr()) & 0xFFFF)
+
+	def _opMovcPC(self, op):
+		self.sfr[SFR_ACC] = self.codeRead((self.sfr[SFR_ACC] + self.pc) & 0xFFFF)
+
+	def _opMovx(self, op):
+		lo = op & 0x0F
+		if lo == 0:
+			addr = self._dptr()
+		else:
+			addr = (self.sfr[SFR_MPAGE] << 8) | self._ri(op)
+		if op < 0xF0:
+			self.sfr[SFR_ACC] = self.xdataRead(addr)
+		else:
+			self.writes += 1
+			self.xdataWrite(addr, self.sfr[SFR_ACC])
+
+	def _opPush(self, op):
+		self._push(self._rd(self._fetch()))
+
+	def _opPop(self, op):
+		self._wr(self._fetch(), self._pop())
+
+	def _opXch(self, op):
+		lo = op & 0x0F
+		a = self.sfr[SFR_ACC]
+		if lo == 5:
+			addr = self._fetch()
+			self.sfr[SFR_ACC] = self._rd(addr)
+			self._wr(addr, a)
+		else:
+			r = self._ri(op) if (lo < 8) else self._rn(op)
+			(self.sfr[SFR_ACC], self.iram[r]) = (self.iram[r], a)
+
+	def _opXchd(self, op):
+		r = self._ri(op)
+		a = self.sfr[SFR_ACC]
+		v = self.iram[r]
+		self.sfr[SFR_ACC] = (a & 0xF0) | (v & 0x0F)
+		self.iram[r] = (v & 0xF0) | (a & 0x0F)
+
+	def _opClrA(self, op):
+		self.sfr[SFR_ACC] = 0
+
+	def _opCplA(self, op):
+		self.sfr[SFR_ACC] ^= 0xFF
+
+	def _opSwap(self, op):
+		a = self.sfr[SFR_ACC]
+		self.sfr[SFR_ACC] = ((a << 4) | (a >> 4)) & 0xFF
+
+	def _opRl(self, op):
+		a = self.sfr[SFR_ACC]
+		self.sfr[SFR_ACC] = ((a << 1) | (a >> 7)) & 0xFF
+
+	def _opRr(self, op):
+		a = self.sfr[SFR_ACC]
+		self.sfr[SFR_ACC] = ((a >> 1) | (a << 7)) & 0xFF
+
+	def _opRlc(self, op):
+		a = self.sfr[SFR_ACC]
+		self.sfr[SFR_ACC] = ((a << 1) | self._carry()) & 0xFF
+		self._setCarry(a & 0x80)
+
+	def _opRrc(self, op):
+		a = self.sfr[SFR_ACC]
+		self.sfr[SFR_ACC] = (a >> 1) | (self._carry() << 7)
+		self._setCarry(a & 0x01)
+
+	def _opMul(self, op):
+		r = self.sfr[SFR_ACC] * self.sfr[SFR_B]
+		(self.sfr[SFR_ACC], self.sfr[SFR_B]) = (r & 0xFF, r >> 8)
+		self.sfr[SFR_PSW] = (self.sfr[SFR_PSW] & ~(PSW_CY | PSW_OV) & 0xFF) | (PSW_OV if r > 0xFF else 0)
+
+	def _opDiv(self, op):
+		(a, b) = (self.sfr[SFR_ACC], self.sfr[SFR_B])
+		psw = self.sfr[SFR_PSW] & ~(PSW_CY | PSW_OV) & 0xFF
+		if b == 0:
+			psw |= PSW_OV
+		else:
+			(self.sfr[SFR_ACC], self.sfr[SFR_B]) = (a // b, a % b)
+		self.sfr[SFR_PSW] = psw
+
+	def _opDa(self, op):
+		a = self.sfr[SFR_ACC]
+		psw = self.sfr[SFR_PSW]
+		if ((a & 0x0F) > 9) or (psw & PSW_AC):
+			a += 0x06
+		if ((a & 0x1F0) > 0x90) or (psw & PSW_CY):
+			a += 0x60
+		if a > 0xFF:
+			psw |= PSW_CY
+		self.sfr[SFR_PSW] = psw
+		self.sfr[SFR_ACC] = a & 0xFF
+
+class CCFlashController:
+	"""
+	Model of the flash controller: the FCTL, FADDRL, FADDRH & FWDATA registers
+	(in this order). Bytes written in FWDATA are collected in words that are
+	programmed at FADDR, which then advances. Programming can only clear bits,
+	like on the real flash.
+	"""
+
+	def __init__(self, chip, wordSize, pageSize):
+		"""
+		Initialize the flash controller of the given chip
+		"""
+		self.chip = chip
+		self.wordSize = wordSize
+		self.pageSize = pageSize
+		self.reset()
+
+	def reset(self):
+		"""
+		Reset the controller state
+		"""
+		self.fctl = 0
+		self.faddr = 0
+		self.word = bytearray()
+		self.writing = False
+		self.writeEnd = 0.0
+		self.wordBusyUntil = 0.0
+		self.eraseUntil = 0.0
+
+	def isWriting(self):
+		"""
+		Check if a flash write is still in progress
+		"""
+		if self.writing and (self.chip.now >= self.writeEnd):
+			self.writing = False
+		return self.writing
+
+	def isErasing(self):
+		"""
+		Check if a page erase is still in progress
+		"""
+		return self.chip.now < self.eraseUntil
+
+	def read(self, reg):
+		"""
+		Read a controller register
+		"""
+		if reg == 0:
+			v = self.fctl & (FCTL_ABORT | 0x1C)
+			if self.isErasing():
+				v |= FCTL_BUSY | FCTL_ERASE
+			if self.isWriting():
+				v |= FCTL_BUSY | FCTL_WRITE
+			if self.chip.now < self.wordBusyUntil:
+				v |= FCTL_FULL
+			return v
+		elif reg == 1:
+			return self.faddr & 0xFF
+		elif reg == 2:
+			return (self.faddr >> 8) & 0xFF
+		return 0
+
+	def write(self, reg, value):
+		"""
+		Write a controller register
+		"""
+		if reg == 0:
+			self.fctl = value & (FCTL_ABORT | 0x1C)
+			if self.isErasing() or self.isWriting():
+				return
+			if value & FCTL_ERASE:
+				page = int(self.faddr * self.wordSize / self.pageSize)
+				self.chip.erasePage(page)
+				self.eraseUntil = self.chip.now + EMU_PAGE_ERASE
+				self.chip.schedule(self.eraseUntil, self.wake)
+			elif value & FCTL_WRITE:
+				self.writing = True
+				self.word = bytearray()
+				self.writeEnd = self.chip.now + EMU_FLASH_TIMEOUT
+				self.chip.flashRequest()
+		elif reg == 1:
+			self.faddr = (self.faddr & 0xFF00) | value
+		elif reg == 2:
+			self.faddr = (self.faddr & 0x00FF) | (value << 8)
+		else:
+			self.feed(value)
+
+	def feed(self, value):
+		"""
+		Collect a byte written in FWDATA, programming the word when complete
+		"""
+		if not self.isWriting():
+			return
+		now = self.chip.now
+
+		# The CPU has to wait for the previous word (the DMA is throttled)
+		if (now < self.wordBusyUntil) and not self.chip.dmaActive:
+			return
+		self.word.append(value)
+		if len(self.word) < self.wordSize:
+			return
+
+		# Program the word
+		self.chip.programFlash(self.faddr * self.wordSize, self.word)
+		self.faddr = (self.faddr + 1) & 0xFFFF
+		self.word = bytearray()
+		self.wordBusyUntil = max(now, self.wordBusyUntil) + EMU_FLASH_WORD
+		self.writeEnd = self.wordBusyUntil + EMU_FLASH_TIMEOUT
+		self.chip.schedule(self.wordBusyUntil, self.wake)
+		self.chip.schedule(self.writeEnd, self.wake)
+
+	def wake(self):
+		"""
+		Nothing to do when an erase, a word or a write ends, apart from letting
+		the CPU notice it (see CC8051.advance)
+		"""
+		pass
+
+class CCDMAController:
+	"""
+	Model of the 5 DMA channels, configured with 8-byte descriptors in XDATA
+	(see dmaDescriptor in cc254x.py). Only fixed-length transfers (VLEN=0) are
+	modelled.
+	"""
+
+	def __init__(self, chip):
+		"""
+		Initialize the DMA controller of the given chip
+		"""
+		self.chip = chip
+		self.reset()
+
+	def reset(self):
+		"""
+		Disarm all the channels
+		"""
+		self.armed = 0
+		self.channels = [ None ] * 5
+
+	def descriptorAddress(self, index):
+		"""
+		Return the XDATA address of the descriptor of the given channel
+		"""
+		sfr = self.chip.sfr
+		if index == 0:
+			return (sfr[SFR_DMA0CFGH] << 8) | sfr[SFR_DMA0CFGL]
+		return ((sfr[SFR_DMA1CFGH] << 8) | sfr[SFR_DMA1CFGL]) + (index - 1) * 8
+
+	def load(self, index):
+		"""
+		Load the descriptor of the given channel
+		"""
+		addr = self.descriptorAddress(index)
+		d = [ self.chip.xdataRead((addr + i) & 0xFFFF) for i in range(0, 8) ]
+		steps = [ 0, 1, 2, -1 ]
+		word = (d[6] >> 7) & 1
+		self.channels[index] = {
+			'src': (d[0] << 8) | d[1],
+			'dst': (d[2] << 8) | d[3],
+			'len': ((d[4] & 0x1F) << 8) | d[5],
+			'count': 0,
+			'word': word,
+			'tmode': (d[6] >> 5) & 0x03,
+			'trigger': d[6] & 0x1F,
+			'srcStep': steps[(d[7] >> 6) & 0x03] * (word + 1),
+			'dstStep': steps[(d[7] >> 4) & 0x03] * (word + 1),
+		}
+
+	def arm(self, value):
+		"""
+		Handle a write in DMAARM
+		"""
+		value &= 0xFF
+		if value & 0x80:
+			self.armed &= ~value & 0x1F
+			return
+		for i in range(0, 5):
+			bit = 1 << i
+			if (value & bit) and not (self.armed & bit):
+				self.load(i)
+				self.armed |= bit
+		self.armed &= value | ~0x1F
+		self.chip.flashRequest()
+
+	def request(self, value):
+		"""
+		Handle a write in DMAREQ (manual trigger)
+		"""
+		for i in range(0, 5):
+			if (value & (1 << i)) and (self.armed & (1 << i)):
+				self.transfer(i, self.channels[i]['tmode'] & 1)
+
+	def trigger(self, trigger):
+		"""
+		Signal a DMA trigger
+		"""
+		if self.chip.dmaPaused():
+			return
+		for i in range(0, 5):
+			if (self.armed & (1 << i)) and (self.channels[i]['trigger'] == trigger):
+				self.transfer(i, self.channels[i]['tmode'] & 1)
+
+	def triggered(self, trigger):
+		"""
+		Return the armed channels that wait for the given trigger
+		"""
+		if self.chip.dmaPaused():
+			return []
+		return [ i for i in range(0, 5) if (self.armed & (1 << i)) and (self.channels[i]['trigger'] == trigger) ]
+
+	def transfer(self, index, block=False):
+		"""
+		Perform one transfer of the given channel (or the rest of the block),
+		raising its IRQ flag when the last one is done
+		"""
+		ch = self.channels[index]
+		chip = self.chip
+		units = (ch['len'] - ch['count']) if block else min(1, ch['len'] - ch['count'])
+		size = ch['word'] + 1
+		chip.dmaActive = True
+		try:
+			for n in range(0, units):
+				for i in range(0, size):
+					chip.xdataWrite((ch['dst'] + i) & 0xFFFF, chip.xdataRead((ch['src'] + i) & 0xFFFF))
+				ch['src'] = (ch['src'] + ch['srcStep']) & 0xFFFF
+				ch['dst'] = (ch['dst'] + ch['dstStep']) & 0xFFFF
+		finally:
+			chip.dmaActive = False
+		ch['count'] += units
+
+		# Complete the transfer
+		if ch['count'] >= ch['len']:
+			self.armed &= ~(1 << index)
+			if ch['tmode'] & 2:
+				self.load(index)
+				self.armed |= 1 << index
+			def complete():
+				chip.sfr[SFR_DMAIRQ] |= 1 << index
+			chip.schedule(chip.dmaDoneTime(ch), complete)
+
+class CCChipEmulator(CC8051):
+	"""
+	Base class of the emulated CC chips: an 8051 core with flash, SRAM, a flash
+	controller, DMA, the CRC of the random number generator and the debug
+	interface the CCLib_proxy talks to. Subclasses define the memory map.
+	"""
+
+	# Chip properties (overridden by the subclasses)
+	name = "CC"
+	chipID = 0x0000
+	flashWordSize = 4
+	flashPageSize = 0x800
+	sramBase = 0x0000
+	dbgData = None
+
+	# Debug commands of the chip: opcode -> (command, argument bytes)
+	debugCommands = {}
+
+	def __init__(self, flash=32, sram=8, ieee=None):
+		"""
+		Initialize a chip with the given flash & SRAM size (in KB)
+		"""
+		CC8051.__init__(self)
+		self.flashSize = flash * 1024
+		self.sramSize = sram * 1024
+		self.flash = bytearray(b'\xFF' * self.flashSize)
+		self.sram = bytearray(self.sramSize)
+		self.xreg = bytearray(0x400)
+		self.flashCtl = CCFlashController(self, self.flashWordSize, self.flashPageSize)
+		self.dma = CCDMAController(self)
+		self.dmaActive = False
+		self.rnd = 0
+		self.config = CONFIG_DMA_PAUSE
+		self.eraseUntil = 0.0
+		self.brustByte = 0
+
+		# IEEE address on the information page (LSB first)
+		if ieee is None:
+			ieee = "00124b%06x" % (self.chipID & 0xFFFF)
+		self.ieee = bytearray(reversed(bytearray.fromhex(ieee)))
+		self.reset()
+
+	def reset(self):
+		"""
+		Reset the chip (the memory contents are retained)
+		"""
+		CC8051.reset(self)
+		self.halted = True
+		self.flashCtl.reset()
+		self.dma.reset()
+		self.config = CONFIG_DMA_PAUSE
+
+	###############################################
+	# Peripherals
+	###############################################
+
+	def dmaPaused(self):
+		"""
+		Check if the DMA is paused by the debug configuration
+		"""
+		return self.halted and (self.config & CONFIG_DMA_PAUSE)
+
+	def flashRequest(self):
+		"""
+		Feed the flash controller from the DMA channels on the FLASH trigger
+		while it's writing
+		"""
+		if not self.flashCtl.isWriting():
+			return
+		for i in self.dma.triggered(DMA_TRIG_FLASH):
+			self.dma.transfer(i, True)
+
+	def dmaDoneTime(self, channel):
+		"""
+		Return the time a DMA channel that just moved its last byte completes
+		(the flash channels complete when the last word is programmed)
+		"""
+		if channel['trigger'] == DMA_TRIG_FLASH:
+			return self.flashCtl.wordBusyUntil
+		return self.now
+
+	def programFlash(self, addr, data):
+		"""
+		Program the given bytes at the given flash address
+		"""
+		for i in range(0, len(data)):
+			if addr + i < self.flashSize:
+				self.flash[addr + i] &= data[i]
+
+	def erasePage(self, page):
+		"""
+		Erase the given flash page
+		"""
+		ofs = page * self.flashPageSize
+		if ofs < self.flashSize:
+			self.flash[ofs:ofs + self.flashPageSize] = b'\xFF' * self.flashPageSize
+
+	def sfrRead(self, addr):
+		if addr == SFR_DMAARM:
+			return self.dma.armed
+		elif addr == SFR_RNDL:
+			return self.rnd & 0xFF
+		elif addr == SFR_RNDH:
+			return self.rnd >> 8
+		return self.sfr[addr]
+
+	def sfrWrite(self, addr, value):
+		if addr == SFR_DMAARM:
+			self.dma.arm(value)
+		elif addr == SFR_DMAREQ:
+			self.dma.request(value)
+		elif addr == SFR_DMAIRQ:
+			# Writing 1 has no effect (R/W0)
+			self.sfr[addr] &= value
+		elif addr == SFR_RNDL:
+			self.rnd = ((self.rnd << 8) | value) & 0xFFFF
+		elif addr == SFR_RNDH:
+			self.rnd = crc16([ value ], self.rnd)
+		else:
+			self.sfr[addr] = value
+
+	###############################################
+	# Debug interface
+	###############################################
+
+	def status(self):
+		"""
+		Return the debug status
+		"""
+		s = STATUS_OSC_STABLE
+		if self.now < self.eraseUntil:
+			s |= STATUS_CHIP_ERASE_BUSY
+		if self.halted:
+			s |= STATUS_CPU_HALTED
+		if self.breakpoint:
+			s |= STATUS_HALT_STATUS
+		return s
+
+	def enterDebug(self):
+		"""
+		Reset the chip in debug mode, halted
+		"""
+		self.reset()
+
+	def brustWrite(self, value):
+		"""
+		Handle a byte of a debug brust-write
+		"""
+		self.brustByte = value
+		self.dma.trigger(DMA_TRIG_DBG_BW)
+
+	def debug(self, opcode, args=()):
+		"""
+		Execute a debug command with the given arguments, returning its
+		response (or 0 if the chip does not know the command)
+		"""
+		cmd = self.debugCommands.get(opcode)
+		if cmd is None:
+			return 0
+		(cmd, n) = cmd
+
+		if cmd == 'instr':
+			if not self.halted:
+				return self.sfr[SFR_ACC]
+			return self.execDebug(args[0:n])
+		elif cmd == 'status':
+			return self.status()
+		elif cmd == 'halt':
+			self.halted = True
+			return self.status()
+		elif cmd == 'resume':
+			self.halted = False
+			self.breakpoint = False
+			return self.status()
+		elif cmd == 'step':
+			self.step()
+			return self.sfr[SFR_ACC]
+		elif cmd == 'pc':
+			return self.pc
+		elif cmd == 'chipID':
+			return self.chipID
+		elif cmd == 'rdConfig':
+			return self.config
+		elif cmd == 'wrConfig':
+			self.config = args[0]
+			return self.status()
+		elif cmd == 'erase':
+			self.flash[:] = b'\xFF' * self.flashSize
+			self.eraseUntil = self.now + EMU_CHIP_ERASE
+			return self.status()
+		return 0
+
+class CC254XEmulator(CCChipEmulator):
+	"""
+	Emulated CC253x/CC254x chip. The XDATA space holds the SRAM, the XREG
+	registers (flash controller at 0x6270-0x6273, CHIPINFO at 0x6276, DBGDATA
+	at 0x6260), a mirror of the SFRs at 0x7080, the information page at
+	0x7800 and the flash bank selected by MEMCTR at 0x8000. The CODE space
+	above 0x8000 shows the bank selected by FMAP (or the SRAM if MEMCTR.XMAP
+	is set).
+	"""
+
+	# The high byte of the chip ID of the known chips
+	CHIP_IDS = { 'CC2530': 0xA5, 'CC2531': 0xB5, 'CC2533': 0x95, 'CC2540': 0x8D, 'CC2541': 0x41 }
+
+	flashWordSize = 4
+	flashPageSize = 0x800
+	dbgData = 0x6260
+
+	# The don't-care bits of the debug commands are masked out (see debug())
+	debugCommands = dict(
+		[ (0x10 | i, ('erase', 0)) for i in range(0, 8) ] +
+		[ (0x18 | i, ('wrConfig', 1)) for i in range(0, 8) ] +
+		[ (0x20 | i, ('rdConfig', 0)) for i in range(0, 8) ] +
+		[ (0x28 | i, ('pc', 0)) for i in range(0, 8) ] +
+		[ (0x30 | i, ('status', 0)) for i in range(0, 8) ] +
+		[ (0x40 | i, ('halt', 0)) for i in range(0, 8) ] +
+		[ (0x48 | i, ('resume', 0)) for i in range(0, 8) ] +
+		[ (0x50 | i, ('instr', i & 3)) for i in range(0, 8) if i & 3 ] +
+		[ (0x58 | i, ('step', 0)) for i in range(0, 8) ] +
+		[ (0x68 | i, ('chipID', 0)) for i in range(0, 8) ]
+	)
+
+	def __init__(self, chip='CC2540', flash=256, sram=8, revision=0x03, ieee=None):
+		"""
+		Initialize an emulated chip of the given model, with the given flash
+		and SRAM size (in KB)
+		"""
+		self.name = chip
+		self.chipID = (self.CHIP_IDS[chip] << 8) | revision
+		self.usb = (chip == 'CC2531')
+		CCChipEmulator.__init__(self, flash=flash, sram=sram, ieee=ieee)
+
+		# Information page
+		self.infoPage = bytearray(b'\xFF' * 0x800)
+		self.infoPage[0x0E:0x14] = self.ieee
+
+		# Chip information registers
+		flashBits = { 32: 1, 64: 2, 128: 3, 256: 4 }.get(flash, 4)
+		self.xreg[0x276] = (flashBits << 4) | (0x08 if self.usb else 0)
+		self.xreg[0x277] = (sram - 1) & 0x07
+
+	def reset(self):
+		CCChipEmulator.reset(self)
+		self.sfr[SFR_FMAP] = 0x01
+
+	def codeRead(self, addr):
+		if addr < 0x8000:
+			return self.flash[addr]
+		if self.sfr[SFR_MEMCTR] & 0x08:
+			addr -= 0x8000
+			return self.sram[addr] if addr < self.sramSize else 0
+		addr = ((self.sfr[SFR_FMAP] & 0x07) << 15) | (addr & 0x7FFF)
+		return self.flash[addr] if addr < self.flashSize else 0xFF
+
+	def xdataRead(self, addr):
+		if addr < 0x2000:
+			if addr >= 0x1F00:
+				return self.iram[addr & 0xFF]
+			return self.sram[addr % self.sramSize]
+		elif addr >= 0x8000:
+			addr = ((self.sfr[SFR_MEMCTR] & 0x07) << 15) | (addr & 0x7FFF)
+			return self.flash[addr] if addr < self.flashSize else 0xFF
+		elif 0x6270 <= addr <= 0x6273:
+			return self.flashCtl.read(addr - 0x6270)
+		elif addr == 0x6260:
+			return self.brustByte
+		elif 0x6000 <= addr < 0x6400:
+			return self.xreg[addr - 0x6000]
+		elif 0x7080 <= addr < 0x7100:
+			return self.sfrRead(addr - 0x7000)
+		elif addr >= 0x7800:
+			return self.infoPage[addr - 0x7800]
+		return 0
+
+	def xdataWrite(self, addr, value):
+		if addr < 0x2000:
+			if addr >= 0x1F00:
+				self.iram[addr & 0xFF] = value
+			else:
+				self.sram[addr % self.sramSize] = value
+		elif 0x6270 <= addr <= 0x6273:
+			self.flashCtl.write(addr - 0x6270, value)
+		elif (0x6000 <= addr < 0x6400) and not (0x6276 <= addr <= 0x6277):
+			self.xreg[addr - 0x6000] = value
+		elif 0x7080 <= addr < 0x7100:
+			self.sfrWrite(addr - 0x7000, value)
+
+class CC2510Emulator(CCChipEmulator):
+	"""
+	Emulated CC2510/CC1110 chip. The flash is mapped at 0x0000 in both the
+	CODE and XDATA spaces, the SRAM at 0xF000 (with the internal RAM in its
+	last 256 bytes) and the SFRs at 0xDF80. The flash controller is reached
+	through the FCTL/FADDRL/FADDRH/FWDATA SFRs and there is no debug brust
+	trigger for the DMA.
+	"""
+
+	name = "CC2510"
+	chipID = 0x8104
+	flashWordSize = 2
+	flashPageSize = 0x400
+
+	# CC251x chips need the exact opcodes of their debug commands
+	debugCommands = {
+		0x14: ('erase', 0), 0x1D: ('wrConfig', 1), 0x24: ('rdConfig', 0), 0x28: ('pc', 0),
+		0x34: ('status', 0), 0x44: ('halt', 0), 0x4C: ('resume', 0), 0x55: ('instr', 1),
+		0x56: ('instr', 2), 0x57: ('instr', 3), 0x5C: ('step', 0), 0x68: ('chipID', 0),
+	}
+
+	# Flash controller registers (FCTL, FADDRL, FADDRH, FWDATA)
+	FLASH_SFRS = { 0xAE: 0, 0xAC: 1, 0xAD: 2, 0xAF: 3 }
+
+	def __init__(self, flash=16, ieee=None):
+		"""
+		Initialize an emulated chip with the given flash size (in KB)
+		"""
+		CCChipEmulator.__init__(self, flash=flash, sram=4, ieee=ieee)
+		self.radio = bytearray(0x80)
+
+	def brustWrite(self, value):
+		self.brustByte = value
+
+	def codeRead(self, addr):
+		if addr < 0x8000:
+			return self.flash[addr] if addr < self.flashSize else 0xFF
+		elif addr >= 0xF000:
+			return self.xdataRead(addr)
+		return 0xFF
+
+	def sfrRead(self, addr):
+		reg = self.FLASH_SFRS.get(addr)
+		if reg is not None:
+			return self.flashCtl.read(reg)
+		return CCChipEmulator.sfrRead(self, addr)
+
+	def sfrWrite(self, addr, value):
+		reg = self.FLASH_SFRS.get(addr)
+		if reg is not None:
+			return self.flashCtl.write(reg, value)
+		return CCChipEmulator.sfrWrite(self, addr, value)
+
+	def xdataRead(self, addr):
+		if addr >= 0xF000:
+			if addr >= 0xFF00:
+				return self.iram[addr & 0xFF]
+			return self.sram[addr - 0xF000]
+		elif addr < 0x8000:
+			return self.flash[addr] if addr < self.flashSize else 0xFF
+		elif 0xDF80 <= addr < 0xE000:
+			return self.sfrRead(addr - 0xDF00)
+		elif 0xDF00 <= addr < 0xDF80:
+			return self.radio[addr - 0xDF00]
+		return 0
+
+	def xdataWrite(self, addr, value):
+		if addr >= 0xF000:
+			if addr >= 0xFF00:
+				self.iram[addr & 0xFF] = value
+			else:
+				self.sram[addr - 0xF000] = value
+		elif 0xDF80 <= addr < 0xE000:
+			self.sfrWrite(addr - 0xDF00, value)
+		elif 0xDF00 <= addr < 0xDF80:
+			self.radio[addr - 0xDF00] = value
+
+class CCProxyEmulator:
+	"""
+	Serial port stand-in that behaves like an arduino running the CCLib_proxy
+	sketch, wired to an emulated chip. It can be passed to CCLibProxy (or
+	openCCDebugger) in place of a port.
+
+	The time is emulated too: the bytes travel at `baudrate`, the responses
+	reach the host `latency` after they are sent, and the arduino spends
+	time on every command frame and every byte on the debug interface.
+	`clock()` returns the emulated time of the host and `sleep()` advances
+	it, so sessions run as fast as python can emulate them.
+
+	With CAP_RELIABLE, the link can be upgraded to the CRC-protected packets
+	of the sketch, which drops the corrupted ones & re-sends the responses
+	it still has for the packets it receives again.
+	"""
+
+	def __init__(self, chip=None, baudrate=115200, latency=EMU_LATENCY, capabilities=CAP_BLOCK_RW | CAP_BRUST_RLE):
+		"""
+		Initialize the proxy with the given chip (a CC2540 by default)
+		"""
+		self.chip = chip if chip is not None else CC254XEmulator()
+		self.port = "emulator:%s" % self.chip.name
+		self.baudrate = baudrate
+		self.timeout = None
+		self.latency = latency
+		self.capabilities = capabilities
+		self.instrTable = list(DEFAULT_INSTR_TABLE)
+
+		# The sketch enters debug mode on boot
+		self.inDebug = True
+		self.chip.enterDebug()
+
+		# Host time, data in transit & the time they arrive
+		self.now = 0.0
+		self.rx = bytearray()
+		self.rxChunks = []
+		self.rxWireFree = 0.0
+		self.tx = bytearray()
+		self.txChunks = []
+		self.txWireFree = 0.0
+
+		# The command waiting for more data
+		self.pending = None
+
+		# The state of the upgraded (reliable) link
+		self.linkReliable = False
+		self.linkConfirmed = False
+		self.linkDeadline = 0.0
+		self.badPackets = 0
+		self.expectSeq = 0
+		self.rxSeq = 0
+		self.replyCache = [ (0, 0, 0) ] * PKT_CACHE
+		self.lastPayload = None
+
+	###############################################
+	# Serial port interface
+	###############################################
+
+	def clock(self):
+		"""
+		Return the emulated time of the host
+		"""
+		return self.now
+
+	def sleep(self, seconds):
+		"""
+		Let the host sleep for the given (emulated) time
+		"""
+		self.now += seconds
+
+	def write(self, data):
+		"""
+		Send the given bytes to the proxy
+		"""
+		data = bytearray(data)
+		start = max(self.now, self.rxWireFree)
+		self.rxWireFree = start + len(data) * self.byteTime()
+		self.rxChunks.append( [len(data), start + self.latency / 2] )
+		self.rx += data
+		return len(data)
+
+	def read(self, size=1):
+		"""
+		Read up to `size` bytes of the responses of the proxy
+		"""
+		self._process()
+
+		# Waiting for more than we have takes the whole timeout
+		if (size > len(self.tx)) and self.timeout:
+			self.now += self.timeout
+
+		size = min(size, len(self.tx))
+		data = bytes(self.tx[0:size])
+		del self.tx[0:size]
+
+		# Wait until the last of them arrives
+		while size > 0:
+			chunk = self.txChunks[0]
+			n = min(size, chunk[0])
+			chunk[0] -= n
+			size -= n
+			if chunk[0] == 0:
+				self.txChunks.pop(0)
+			self.now = max(self.now, chunk[1])
+		return data
+
+	def flush(self):
+		pass
+
+	def reset_input_buffer(self):
+		"""
+		Discard the responses that were not read
+		"""
+		self._process()
+		self.tx = bytearray()
+		self.txChunks = []
+
+	def close(self):
+		pass
+
+	def byteTime(self):
+		"""
+		Return the time a byte takes on the serial link
+		"""
+		return 10.0 / self.baudrate
+
+	###############################################
+	# Proxy model
+	###############################################
+
+	def _consume(self, size):
+		"""
+		Take `size` received bytes & advance the chip to the time the last
+		of them arrived
+		"""
+		data = self.rx[0:size]
+		del self.rx[0:size]
+		arrival = 0.0
+		while size > 0:
+			chunk = self.rxChunks[0]
+			n = min(size, chunk[0])
+			chunk[0] -= n
+			chunk[1] += n * self.byteTime()
+			size -= n
+			arrival = chunk[1]
+			if chunk[0] == 0:
+				self.rxChunks.pop(0)
+		if self.chip.now < arrival:
+			self.chip.advance(arrival - self.chip.now)
+		return data
+
+	def _busy(self, seconds):
+		"""
+		Keep the arduino busy for the given time
+		"""
+		self.chip.advance(seconds)
+
+	def _send(self, data):
+		"""
+		Send response bytes to the host
+		"""
+		data = bytearray(data)
+		start = max(self.chip.now, self.txWireFree)
+		self.txWireFree = start + len(data) * self.byteTime()
+		self.txChunks.append( [len(data), self.txWireFree + self.latency / 2] )
+		self.tx += data
+
+	def _frame(self, ans, value=0, payload=None):
+		"""
+		Send a response frame (or packet, with the given payload, on the
+		reliable link)
+		"""
+		if self.linkReliable:
+			self.replyCache[self.rxSeq % PKT_CACHE] = (ans, (value >> 8) & 0xFF, value & 0xFF)
+			if payload:
+				self.lastPayload = (self.rxSeq, bytearray(payload))
+			return self._packet(self.rxSeq, payload)
+		self._send([ ans, (value >> 8) & 0xFF, value & 0xFF ])
+
+	def _packet(self, seq, payload=None):
+		"""
+		Send the cached response of the given packet
+		"""
+		payload = payload or bytearray()
+		data = bytearray(self.replyCache[seq % PKT_CACHE]) + bytearray([ seq, len(payload) ]) + bytearray(payload)
+		data.append(crc8(data))
+		self._send(data)
+
+	def _debug(self, index, *args):
+		"""
+		Run a debug command through the instruction table
+		"""
+		self._busy(EMU_DEBUG_BYTE * (2 + len(args) + (1 if index in (I_GET_CHIP_ID, I_GET_PC) else 0)))
+		return self.chip.debug(self.instrTable[index], args)
+
+	def _instr(self, *code):
+		"""
+		Run a debug instruction
+		"""
+		return self._debug(I_DEBUG_INSTR_1 + len(code) - 1, *code) & 0xFF
+
+	def _process(self):
+		"""
+		Handle all the frames (and data) received so far
+		"""
+		while True:
+			if self.pending is not None:
+				if not self.pending():
+					return
+			elif self.linkReliable:
+
+				# Fall back if the host never confirmed the upgrade
+				if not self.linkConfirmed and (self.chip.now > self.linkDeadline):
+					self.linkReliable = False
+					continue
+				packet = self._readPacket()
+				if packet is None:
+					return
+				if packet:
+					self._busy(EMU_FRAME_TIME)
+					self._command(*packet)
+			elif len(self.rx) >= 4:
+				frame = self._consume(4)
+				self._busy(EMU_FRAME_TIME)
+				self._command(*frame)
+			else:
+				return
+
+	def _readPacket(self):
+		"""
+		Read a packet from the reliable link like the sketch does. Returns None
+		until it has arrived, False if it was dropped or handled already, or
+		the (cmd, c1, c2, c3, payload) of the next packet in sequence.
+		"""
+		if len(self.rx) < 6:
+			return None
+		if self.rx[5] > PKT_PAYLOAD_MAX:
+			return self._dropPacket()
+		if len(self.rx) < self.rx[5] + 7:
+			return None
+		data = self._consume(self.rx[5] + 7)
+		if crc8(data[:-1]) != data[-1]:
+			return self._dropPacket()
+		self.badPackets = 0
+
+		# Re-send the responses of the packets we have already handled
+		seq = data[4]
+		if seq != self.expectSeq:
+			if 1 <= ((self.expectSeq - seq) & 0xFF) <= PKT_CACHE:
+				if (self.lastPayload is not None) and (self.lastPayload[0] == seq) and (((self.expectSeq - 1) & 0xFF) == seq):
+					self._packet(seq, self.lastPayload[1])
+				else:
+					self._packet(seq)
+			return False
+
+		# Accept packet
+		self.rxSeq = seq
+		self.expectSeq = (seq + 1) & 0xFF
+		self.linkConfirmed = True
+		return (data[0], data[1], data[2], data[3], data[6:-1])
+
+	def _dropPacket(self):
+		"""
+		Discard a bad packet together with everything that arrived after it,
+		falling back to the default link after too many of them
+		"""
+		self._consume(len(self.rx))
+		self.badPackets += 1
+		if self.badPackets >= PKT_BAD_MAX:
+			self.linkReliable = False
+		return False
+
+	def _command(self, cmd, c1, c2, c3, payload=None):
+		"""
+		Handle a command frame (or packet) like the CCLib_proxy sketch does
+		"""
+
+		# Commands that work without debug mode
+		if cmd == CMD_PING:
+			return self._frame(ANS_OK)
+		elif cmd == CMD_ENTER:
+			self._busy(EMU_DEBUG_ENTER)
+			self.chip.enterDebug()
+			self.inDebug = True
+			return self._frame(ANS_OK)
+		elif cmd == CMD_INSTR_VER:
+			return self._frame(ANS_OK, self.instrTable[0])
+		elif cmd == CMD_CAPS:
+			return self._frame(ANS_OK, self.capabilities)
+		elif cmd == CMD_INSTR_UPD:
+			if self.linkReliable:
+				if len(payload) != 16:
+					return self._frame(ANS_ERROR, 3)
+				return self._updateTable(payload)
+			self._frame(ANS_READY)
+			self._expect(16, self._updateTable)
+			return
+		elif (cmd == CMD_UPGRADE) and (self.capabilities & CAP_RELIABLE):
+			if c1 >= len(LINK_BAUDRATES):
+				return self._frame(ANS_ERROR, 3)
+
+			# Confirm on the current link & switch to packets, until the host
+			# fails to confirm in time
+			self._frame(ANS_OK)
+			self.linkReliable = True
+			self.linkConfirmed = False
+			self.linkDeadline = self.chip.now + LINK_CONFIRM
+			self.badPackets = 0
+			self.lastPayload = None
+			self.expectSeq = 0
+			return
+
+		# Commands with data
+		if cmd in (CMD_BRUSTWR, CMD_BRUSTRLE):
+			length = (c1 << 8) | c2
+			if length > 2048:
+				return self._frame(ANS_ERROR, 3)
+			if (cmd == CMD_BRUSTRLE) and not (self.capabilities & CAP_BRUST_RLE):
+				return self._frame(ANS_ERROR, 0xFF)
+			self._frame(ANS_READY)
+			self._busy(2 * EMU_DEBUG_BYTE)
+			self._brust(length, cmd == CMD_BRUSTRLE)
+			return
+		elif (cmd == CMD_XDATA_WR) and (self.capabilities & CAP_BLOCK_RW):
+			length = (c1 << 8) | c2
+			if length > 128:
+				return self._frame(ANS_ERROR, 3)
+			if self.linkReliable:
+				if len(payload) != length:
+					return self._frame(ANS_ERROR, 3)
+				return self._writeBlock(payload)
+			self._frame(ANS_READY)
+			self._expect(length, self._writeBlock)
+			return
+		elif (cmd in (CMD_XDATA_RD, CMD_CODE_RD)) and (self.capabilities & CAP_BLOCK_RW):
+			length = (c1 << 8) | c2
+			if (length > 2048) or (self.linkReliable and (length > BLOCK_WR_MAX)):
+				return self._frame(ANS_ERROR, 3)
+			return self._readBlock(length, cmd == CMD_CODE_RD)
+
+		# The rest need debug mode
+		if cmd in (CMD_EXIT, CMD_CHIP_ID, CMD_PC, CMD_STATUS, CMD_HALT, CMD_EXEC_1, CMD_EXEC_2,
+				CMD_EXEC_3, CMD_RD_CFG, CMD_WR_CFG, CMD_CHPERASE, CMD_STEP, CMD_RESUME) and not self.inDebug:
+			return self._frame(ANS_ERROR, 2)
+		if cmd == CMD_EXIT:
+			self._debug(I_RESUME)
+			self.inDebug = False
+			self._frame(ANS_OK)
+		elif cmd == CMD_CHIP_ID:
+			self._frame(ANS_OK, self._debug(I_GET_CHIP_ID))
+		elif cmd == CMD_PC:
+			self._frame(ANS_OK, self._debug(I_GET_PC))
+		elif cmd == CMD_STATUS:
+			self._frame(ANS_OK, self._debug(I_READ_STATUS))
+		elif cmd == CMD_HALT:
+			self._frame(ANS_OK, self._debug(I_HALT))
+		elif cmd == CMD_RESUME:
+			self._frame(ANS_OK, self._debug(I_RESUME))
+		elif cmd == CMD_STEP:
+			self._frame(ANS_OK, self._debug(I_STEP_INSTR))
+		elif cmd == CMD_EXEC_1:
+			self._frame(ANS_OK, self._instr(c1))
+		elif cmd == CMD_EXEC_2:
+			self._frame(ANS_OK, self._instr(c1, c2))
+		elif cmd == CMD_EXEC_3:
+			self._frame(ANS_OK, self._instr(c1, c2, c3))
+		elif cmd == CMD_RD_CFG:
+			self._frame(ANS_OK, self._debug(I_RD_CONFIG))
+		elif cmd == CMD_WR_CFG:
+			self._frame(ANS_OK, self._debug(I_WR_CONFIG, c1))
+		elif cmd == CMD_CHPERASE:
+			self._frame(ANS_OK, self._debug(I_CHIP_ERASE))
+		else:
+			self._frame(ANS_ERROR, 0xFF)
+
+	def _expect(self, size, callback):
+		"""
+		Call `callback` with the next `size` bytes when they arrive
+		"""
+		def pending():
+			if len(self.rx) < size:
+				return False
+			self.pending = None
+			callback(self._consume(size))
+			return True
+		self.pending = pending
+
+	def _updateTable(self, data):
+		"""
+		Replace the instruction table
+		"""
+		self.instrTable = list(bytearray(data))
+		self._frame(ANS_OK, self.instrTable[0])
+
+	def _writeBlock(self, data):
+		"""
+		Write the given bytes at DPTR
+		"""
+		if not self.inDebug:
+			return self._frame(ANS_ERROR, 2)
+		a = 0
+		for b in bytearray(data):
+			self._instr(0x74, b)
+			self._instr(0xF0)
+			a = self._instr(0xA3)
+		self._frame(ANS_OK, a)
+
+	def _readBlock(self, length, code):
+		"""
+		Stream the bytes at DPTR back, followed by the status frame
+		"""
+		if not self.inDebug:
+			if not self.linkReliable:
+				self._send(bytearray(length))
+			return self._frame(ANS_ERROR, 2)
+
+		# The arduino executes the same debug instructions we skip here
+		chip = self.chip
+		self._busy(length * EMU_DEBUG_BYTE * (9 if code else 6))
+		dptr = chip._dptr()
+		data = bytearray(length)
+		for i in range(0, length):
+			data[i] = chip.codeRead(dptr) if code else chip.xdataRead(dptr)
+			dptr = (dptr + 1) & 0xFFFF
+		chip._setDptr(dptr)
+		if length:
+			chip.sfr[SFR_ACC] = data[-1]
+
+		# On the reliable link the data are the payload of the response
+		if self.linkReliable:
+			return self._frame(ANS_OK, data[-1] if length else 0, data)
+		self._send(data)
+		self._frame(ANS_OK, data[-1] if length else 0)
+
+	def _brust(self, length, rle):
+		"""
+		Forward `length` bytes of brust data (expanding them if RLE-compressed)
+		to the debug interface, as they arrive (in CMD_BRUSTDAT packets on the
+		reliable link, each acknowledged but the last)
+		"""
+		state = { 'left': length, 'ctrl': None }
+		def feed(b):
+			if not rle:
+				self._brustByte(b)
+				state['left'] -= 1
+			elif state['ctrl'] is None:
+				state['ctrl'] = b
+			elif state['ctrl'] & 0x80:
+				for i in range(0, min((state['ctrl'] & 0x7F) + 2, state['left'])):
+					self._brustByte(b)
+					state['left'] -= 1
+				state['ctrl'] = None
+			else:
+				self._brustByte(b)
+				state['left'] -= 1
+				if state['ctrl'] == 0:
+					state['ctrl'] = None
+				else:
+					state['ctrl'] -= 1
+		def pending():
+			while self.linkReliable and (state['left'] > 0):
+				packet = self._readPacket()
+				if packet is None:
+					return False
+				elif not packet:
+					continue
+				(cmd, c1, c2, c3, payload) = packet
+				if (cmd == CMD_BRUSTDAT) and (rle or (len(payload) <= state['left'])):
+					for b in payload:
+						if state['left'] > 0:
+							feed(b)
+					if state['left'] > 0:
+						self._frame(ANS_OK)
+					continue
+
+				# Anything else aborts the brust, which is completed with 0's
+				while state['left'] > 0:
+					self._brustByte(0)
+					state['left'] -= 1
+				self.pending = None
+				self._busy(EMU_DEBUG_BYTE)
+				self._frame(ANS_ERROR, 4)
+				return True
+			while self.rx and (state['left'] > 0):
+				feed(self._consume(1)[0])
+			if state['left'] > 0:
+				return False
+			self.pending = None
+			self._busy(EMU_DEBUG_BYTE)
+			if not self.inDebug:
+				self._frame(ANS_ERROR, 2)
+			else:
+				self._frame(ANS_OK, self.chip.status())
+			return True
+		self.pending = pending
+		if length == 0:
+			pending()
+
+	def _brustByte(self, b):
+		"""
+		Write a brust byte on the debug interface
+		"""
+		self.chip.advance(EMU_DEBUG_BYTE)
+		self.chip.brustWrite(b)
+
+def createEmulator(name="CC2540", flash=None, **kwargs):
+	"""
+	Create a CCProxyEmulator wired to an emulated chip of the given model (and
+	flash size in KB, if given)
+	"""
+	chipArgs = { 'flash': flash } if flash else {}
+	if name in ("CC2510", "CC251x", "CC1110"):
+		return CCProxyEmulator(CC2510Emulator(**chipArgs), **kwargs)
+	if not name in CC254XEmulator.CHIP_IDS:
+		raise IOError("Unknown emulated chip %s (use one of %s)" % (name,
+			", ".join(sorted(list(CC254XEmulator.CHIP_IDS.keys()) + ["CC2510", "CC1110"]))))
+	return CCProxyEmulator(CC254XEmulator(name, **chipArgs), **kwargs)
@@ -0,0 +1,343 @@
+#
+# CCLib_proxy Interface Library for High-Level operations
+# Copyright (c) 2014-2016 Ioannis Charalampidis
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from __future__ import print_function
+import binascii
+import atexit
+import json
+import os
+
+# The directory the last known flash contents of the devices are kept in
+# (set CC_CACHE to an empty string to keep them only in memory)
+CACHE_DIR = os.environ.get("CC_CACHE", os.path.join(os.path.expanduser("~"), ".cclib_cache"))
+
+# The caches opened on every directory (see sharedFlashCache)
+sharedCaches = {}
+
+# How long the operations the planner weighs take (in seconds) until the
+# driver has learned them (see CCTimings)
+DEFAULT_TIMINGS = { 'erasePage': 20e-3, 'chipErase': 20e-3, 'blankScan': 1e-3 }
+
+def crc16(data, crc=0xFFFF):
+	"""
+	Calculate the CRC-16 (polynomial x^16 + x^15 + x^2 + 1, MSB first) that
+	the random number generator of the CC chips computes over the bytes
+	written in RNDH
+	"""
+	for b in bytearray(data):
+		crc ^= b << 8
+		for i in range(0, 8):
+			crc = ((crc << 1) ^ 0x8005) & 0xFFFF if (crc & 0x8000) else (crc << 1) & 0xFFFF
+	return crc
+
+def isBlank(data):
+	"""
+	Check if the given data are all 0xFF, like an erased flash
+	"""
+	return bytearray(data) == bytearray(b'\xFF') * len(data)
+
+class CCFlashCache:
+	"""
+	The last known contents of the flash pages of every device (named after
+	its chip ID & serial, see ChipDriver.cacheDevice) with their CRC-16. They
+	are kept in `directory` (a JSON file per device) if given. A cached page
+	is only to be used once the chip confirms it still has the same CRC.
+	"""
+
+	def __init__(self, directory=None):
+		"""
+		Initialize the cache (the devices are loaded when first used)
+		"""
+		self.directory = directory
+		self.devices = {}
+		self.changed = set()
+		if directory:
+			atexit.register(self.save)
+
+	def pages(self, device):
+		"""
+		Return the cached pages of the given device, as a dictionary of the
+		page number to its CRC & bytes
+		"""
+		if not device in self.devices:
+			pages = {}
+			if self.directory:
+				try:
+					with open(os.path.join(self.directory, device + ".json"), "r") as f:
+						for (page, (crc, data)) in json.load(f).items():
+							data = bytearray(binascii.unhexlify(data))
+							if crc16(data) == crc:
+								pages[int(page)] = (crc, data)
+				except (IOError, OSError, ValueError, TypeError):
+					pass
+			self.devices[device] = pages
+		return self.devices[device]
+
+	def get(self, device, page, crc):
+		"""
+		Return the cached bytes of the given page if they have the given CRC,
+		or None
+		"""
+		entry = self.pages(device).get(page)
+		if (entry is None) or (entry[0] != crc):
+			return None
+		return bytearray(entry[1])
+
+	def put(self, device, page, data):
+		"""
+		Cache the bytes of the given page
+		"""
+		data = bytearray(data)
+		self.pages(device)[page] = (crc16(data), data)
+		self.changed.add(device)
+
+	def forget(self, device, page=None):
+		"""
+		Forget the given page of the device (or all of them)
+		"""
+		if page is None:
+			self.devices[device] = {}
+		else:
+			self.pages(device).pop(page, None)
+		self.changed.add(device)
+
+	def save(self):
+		"""
+		Write the changed devices back in their files
+		"""
+		if not self.directory:
+			return
+		for device in list(self.changed):
+			pages = dict([ (str(page), [ crc, binascii.hexlify(data).decode('ascii') ])
+				for (page, (crc, data)) in self.devices[device].items() ])
+			try:
+				if not os.path.isdir(self.directory):
+					os.makedirs(self.directory)
+				with open(os.path.join(self.directory, device + ".json"), "w") as f:
+					json.dump(pages, f, sort_keys=True)
+				self.changed.discard(device)
+			except (IOError, OSError):
+				pass
+
+def sharedFlashCache(directory):
+	"""
+	Return the flash cache kept in the given directory, which is opened only
+	once (and saved only once, at exit) however many sessions use it. Without
+	a directory, the cache is only kept in memory and not shared.
+	"""
+	if not directory:
+		return CCFlashCache()
+	if not directory in sharedCaches:
+		sharedCaches[directory] = CCFlashCache(directory)
+	return sharedCaches[directory]
+
+class CCFlashPage:
+	"""
+	A flash page of a CCFlashPlan: the bytes it should end up with, and which
+	of them the image covers (the rest keep what the chip had)
+	"""
+
+	def __init__(self, page, size):
+		"""
+		Initialize a page with no image bytes on it
+		"""
+		self.page = page
+		self.data = bytearray(b'\xFF' * size)
+		self.covered = bytearray(size)
+		self.crc = None
+		self.blank = False
+		self.erase = False
+		self.program = False
+
+	def set(self, offset, bytes):
+		"""
+		Place image bytes on the page
+		"""
+		self.data[offset:offset+len(bytes)] = bytes
+		self.covered[offset:offset+len(bytes)] = b'\x01' * len(bytes)
+
+	def uncovered(self):
+		"""
+		Return the (offset, size) ranges of the page the image doesn't cover
+		"""
+		ranges = []
+		start = None
+		for i in range(0, len(self.covered) + 1):
+			if (i < len(self.covered)) and not self.covered[i]:
+				if start is None:
+					start = i
+			elif start is not None:
+				ranges.append( (start, i - start) )
+				start = None
+		return ranges
+
+class CCFlashPlan:
+	"""
+	Plan for writing an image in the flash so that every page is erased and
+	programmed at most once, in one sequential pass. The pages the image falls
+	on are compared with the chip by their CRC: the blank ones are not erased,
+	the ones that already hold the result are left alone, and only the bytes
+	of the partially covered pages that the image doesn't overwrite are read
+	back (unless the page is cached), to be programmed again. Then either
+	these pages or the entire chip are erased, whichever is cheaper.
+	"""
+
+	def __init__(self, dbg, hexFile, offset=0):
+		"""
+		Plan writing the memory blocks of the given CCHEXFile (with their
+		addresses moved by `offset`) on the chip of the given driver
+		"""
+		self.dbg = dbg
+		self.pageSize = dbg.flashPageSize
+		self.pages = {}
+		self.chipErase = False
+		self.keptBytes = 0
+
+		# Place the memory blocks on the pages
+		for (page, pOfs, bytes) in hexFile.pageParts(self.pageSize, offset):
+			if not page in self.pages:
+				self.pages[page] = CCFlashPage(page, self.pageSize)
+			self.pages[page].set( pOfs, bytes )
+
+		self.plan()
+
+	def timing(self, operation):
+		"""
+		Return how long the given operation is expected to take
+		"""
+		expected = self.dbg.timings.expected( self.dbg.timingName(), operation )
+		if expected is None:
+			return DEFAULT_TIMINGS[operation]
+		return expected
+
+	def runs(self, pages):
+		"""
+		Return the (first page, count) of the runs of consecutive pages in the
+		given sorted list
+		"""
+		runs = []
+		for page in pages:
+			if runs and (page == runs[-1][0] + runs[-1][1]):
+				runs[-1] = (runs[-1][0], runs[-1][1] + 1)
+			else:
+				runs.append( (page, 1) )
+		return runs
+
+	def pageCRCs(self, pages):
+		"""
+		Return the CRCs of the given pages on the chip
+		"""
+		crcs = []
+		for (page, count) in self.runs(pages):
+			crcs += self.dbg.getPageCRCs( page, count )
+		return crcs
+
+	def usedPages(self, pages):
+		"""
+		Return the set of the given pages that are not blank on the chip
+		"""
+		used = set()
+		for (page, count) in self.runs(pages):
+			used.update( self.dbg.getUsedPages( page, count ) )
+		return used
+
+	def plan(self):
+		"""
+		Pick which pages to erase & program
+		"""
+		pages = [ self.pages[page] for page in sorted(self.pages.keys()) ]
+
+		# Find the blank pages exactly (a CRC could match by chance, and
+		# programming a used page without erasing it would corrupt it)
+		used = self.usedPages([ p.page for p in pages ])
+		for p in pages:
+			p.blank = not p.page in used
+		crcs = dict(zip(sorted(used), self.pageCRCs(sorted(used))))
+
+		# Read back the bytes to keep from the pages that are not blank
+		for p in pages:
+			p.crc = crcs.get(p.page)
+			if not p.blank:
+				cached = self.dbg.getCachedPage( p.page, p.crc )
+				for (pOfs, iLen) in p.uncovered():
+					if cached is None:
+						p.data[pOfs:pOfs+iLen] = self.dbg.readCODE( p.page * self.pageSize + pOfs, iLen )
+					else:
+						p.data[pOfs:pOfs+iLen] = cached[pOfs:pOfs+iLen]
+					self.keptBytes += iLen
+
+			# Leave alone the pages that already hold the result
+			if p.blank:
+				p.program = not isBlank(p.data)
+			elif crc16(p.data) != p.crc:
+				p.erase = True
+				p.program = not isBlank(p.data)
+
+		# A chip erase is cheaper if there are enough pages to erase, but only
+		# if it wouldn't erase anything else
+		erase = [ p for p in pages if p.erase ]
+		unchanged = [ p for p in pages if not p.blank and not p.erase ]
+		others = [ page for page in range(0, int(self.dbg.flashSize / self.pageSize)) if not page in self.pages ]
+		if (len(erase) > 1) and not unchanged and \
+			(len(erase) * self.timing('erasePage') > self.timing('chipErase') + len(others) * self.timing('blankScan')):
+			if not self.usedPages(others):
+				self.chipErase = True
+
+	def erasedPages(self):
+		"""
+		Return the number of the pages that will be erased (one by one)
+		"""
+		if self.chipErase:
+			return 0
+		return len([ p for p in self.pages.values() if p.erase ])
+
+	def programmedPages(self):
+		"""
+		Return the number of the pages that will be programmed
+		"""
+		return len([ p for p in self.pages.values() if p.program ])
+
+	def execute(self, verify=False, showProgress=False, stub=False):
+		"""
+		Erase & program the pages (see writeCODE for the arguments)
+
+		WARNING: This requires DMA operations to be unpaused ( use: dbg.pauseDMA(False) )
+		"""
+		if self.chipErase:
+			self.dbg.chipErase()
+			self.dbg.pauseDMA(False)
+
+		# Erase the pages in order, programming each run of consecutive pages
+		# once its pages are erased
+		run = []
+		for page in sorted(self.pages.keys()) + [ None ]:
+			p = self.pages.get(page)
+			if run and ((p is None) or not p.program or (page != run[-1].page + 1)):
+				data = bytearray()
+				for r in run:
+					data += r.data
+				if showProgress:
+					print(" -> 0x%04x : %i pages " % (run[0].page * self.pageSize, len(run)))
+				self.dbg.writeCODE( run[0].page * self.pageSize, data, verify=verify, showProgress=showProgress, stub=stub )
+				run = []
+			if p is None:
+				break
+			if p.erase and not self.chipErase:
+				self.dbg.erasePage(page)
+			if p.program:
+				run.append(p)
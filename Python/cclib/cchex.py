@@ -94,6 +94,96 @@ class CCMemBlock:
 	def __repr__(self):
 		return "<MemBlock @ 0x%04x (%i Bytes)>" % (self.addr, self.size)
 
+class CCHEXWriter:
+	"""
+	Writes memory blocks in an IntelHEX or a binary file as they arrive,
+	without keeping them in memory (use it in a `with` block, or close() it).
+	Binary files are images of the flash: the gaps between the blocks, and
+	the rest up to `size` if given, are filled with 0xFF.
+	"""
+
+	def __init__(self, filename, ftype=None, size=None):
+		"""
+		Open the file to write
+		"""
+
+		# Guess format if not specified
+		if ftype == None:
+			if filename[-4:].lower() == ".hex":
+				ftype = "hex"
+			elif filename[-4:].lower() == ".bin":
+				ftype = "bin"
+			else:
+				raise IOError("Could not detect file format. Please specify!")
+		if not ftype in ("hex", "bin"):
+			raise IOError("Unknown format '%s' specified!" % ftype)
+
+		self.ftype = ftype
+		self.f = open(filename, "w" if ftype == "hex" else "wb")
+		self.upper = None
+		self.size = size
+		self.end = 0
+
+	def _record(self, addr, cmd, bytes):
+		"""
+		Write an IntelHEX record
+		"""
+		bytes = bytearray([ len(bytes), (addr >> 8) & 0xFF, addr & 0xFF, cmd ]) + bytearray(bytes)
+		csum = (0x100 - (sum(bytes) & 0xFF)) & 0xFF
+		self.f.write(":%s%02x\n" % (toHex(bytes), csum))
+
+	def write(self, addr, bytes):
+		"""
+		Write the given bytes at the given address
+		"""
+
+		# The binary files are images of the memory
+		if self.ftype == "bin":
+			self._pad(addr)
+			self.f.seek(addr, 0)
+			self.f.write(bytearray(bytes))
+			self.end = max(self.end, addr + len(bytes))
+			return
+
+		# Write 0x10-sized records (which don't cross the 64Kb segments)
+		iOfs = 0
+		while iOfs < len(bytes):
+			fAddr = addr + iOfs
+			iLen = min( len(bytes) - iOfs, 0x10, 0x10000 - (fAddr & 0xFFFF) )
+
+			# Specify the upper address when it changes
+			if self.upper != (fAddr >> 16):
+				self.upper = fAddr >> 16
+				self._record(0x0000, 0x04, [ (self.upper >> 8) & 0xFF, self.upper & 0xFF ])
+
+			self._record(fAddr & 0xFFFF, 0x00, bytes[iOfs:iOfs+iLen])
+			iOfs += iLen
+
+	def _pad(self, addr):
+		"""
+		Fill the binary file with 0xFF up to the given address
+		"""
+		if addr > self.end:
+			self.f.seek(self.end, 0)
+			self.f.write(bytearray(b'\xFF' * (addr - self.end)))
+			self.end = addr
+
+	def close(self):
+		"""
+		Write the end-of-file record (or the padding) & close the file
+		"""
+		if self.ftype == "hex":
+			self._record(0x0000, 0x01, [])
+		elif self.size:
+			self._pad(self.size)
+		self.f.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
 class CCHEXFile:
 	"""
 	Utility class for reading/writing Intel HEX files
@@ -172,6 +262,37 @@ class CCHEXFile:
 		targetBlock = CCMemBlock(addr)
 		targetBlock.stack(bytes)
 
+	def pageParts(self, pageSize, offset=0):
+		"""
+		Yield the parts of the memory blocks (with their addresses moved by
+		`offset`) that fall on each flash page, as tuples of the page number,
+		the offset in the page and the bytes
+		"""
+		for mb in self.memBlocks:
+			iOfs = 0
+			while iOfs < mb.size:
+
+				# Up to the end of the page
+				addr = mb.addr + offset + iOfs
+				page = int(addr / pageSize)
+				pOfs = addr - page * pageSize
+				iLen = min( mb.size - iOfs, pageSize - pOfs )
+				yield (page, pOfs, mb.bytes[iOfs:iOfs+iLen])
+				iOfs += iLen
+
+	def pages(self, pageSize, offset=0):
+		"""
+		Return the contents of the flash pages the memory blocks fall on (with
+		their addresses moved by `offset`), as a dictionary of the page number
+		to the page bytes, padded with 0xFF
+		"""
+		pages = {}
+		for (page, pOfs, bytes) in self.pageParts(pageSize, offset):
+			if not page in pages:
+				pages[page] = bytearray(b'\xFF' * pageSize)
+			pages[page][pOfs:pOfs+len(bytes)] = bytes
+		return pages
+
 	def stack(self, bytes):
 		"""
 		Append bytes on the last memory block
@@ -199,18 +320,9 @@ class CCHEXFile:
 		"""
 		Save memory blocks in a binary file
 		"""
-
-		# Open target file
-		with open(self.filename, "wb") as f:
-
-			# Write memory blocks (assuming they are ordered)
+		with CCHEXWriter(self.filename, "bin") as f:
 			for mb in self.memBlocks:
-
-				# Seek to the specified addres
-				f.seek(mb.addr, 0)
-
-				# Dump buffer in file
-				f.write(mb.bytes)
+				f.write(mb.addr, mb.bytes)
 
 	def _loadBin(self):
 		"""
@@ -235,63 +347,9 @@ class CCHEXFile:
 		"""
 		Save memory blocks in an IntelHEX format
 		"""
-
-		# Open target file
-		with open(self.filename, "w") as f:
-
-			def _write(addr, cmd, bytes):
-
-				# Build field bytes
-				dlen = len(bytes)
-				header = [
-						dlen,				#  0: Data field lenght
-						(addr >> 8) & 0xFF, #  1: Address High
-						addr & 0xFF,		#  2: Address Low
-						cmd 				#  3: Field type
-						]
-
-				# Extend bytes
-				bytes = bytearray(header) + bytearray(bytes)
-
-				# Calculate checksum
-				csum = self._checksum(bytes)
-
-				# Write to file
-				f.write((":%s%02x\n" % (toHex(bytes), csum)).encode(encoding='UTF-8'))
-
-			# Handle memory blocks
-			hexBlockOfs = 0
+		with CCHEXWriter(self.filename, "hex") as f:
 			for mb in self.memBlocks:
-
-				# Specify offset address
-				addr = (mb.addr >> 16) & 0xFFFF
-				_write(0x0000, 0x04, [(addr >> 8) & 0xFF, addr & 0xFF ])
-
-				# Start reading 0x10-sized blocks
-				iOfs = 0
-				iLen = 0x10
-				while iOfs < mb.size:
-
-					# Clip length when we are about to overflow
-					if iOfs+iLen > mb.size:
-						iLen = mb.size - iOfs
-
-					# If we are overflowing the 2-byte buffer of the hext
-					# file, inser a new offset address
-					if (iOfs-hexBlockOfs > 0xFFFF):
-						hexBlockOfs += 0x10000
-						addr = ((mb.addr + hexBlockOfs) >> 16) & 0xFF
-						_write(0x0000, 0x04, [(addr >> 8) & 0xFF, addr & 0xFF ])
-
-					# Write data
-					_write(iOfs-hexBlockOfs, 0x00, mb.bytes[iOfs:iOfs+iLen])
-
-					# Move forward
-					iOfs += iLen
-
-			# Write end-of-file
-			_write(0x00, 0x01, [])
-
+				f.write(mb.addr, mb.bytes)
 
 	def _loadHex(self):
 		"""
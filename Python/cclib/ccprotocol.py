@@ -0,0 +1,90 @@
+#
+# CCLib_proxy protocol constants
+# Copyright (c) 2014-2016 Ioannis Charalampidis
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+# Command constants
+CMD_ENTER     = 0x01
+CMD_EXIT      = 0x02
+CMD_CHIP_ID   = 0x03
+CMD_STATUS    = 0x04
+CMD_PC        = 0x05
+CMD_STEP      = 0x06
+CMD_EXEC_1    = 0x07
+CMD_EXEC_2    = 0x08
+CMD_EXEC_3    = 0x09
+CMD_BRUSTWR   = 0x0A
+CMD_RD_CFG    = 0x0B
+CMD_WR_CFG    = 0x0C
+CMD_CHPERASE  = 0x0D
+CMD_RESUME    = 0x0E
+CMD_HALT      = 0x0F
+CMD_XDATA_RD  = 0x10
+CMD_XDATA_WR  = 0x11
+CMD_CODE_RD   = 0x12
+CMD_BRUSTDAT  = 0x13
+CMD_BRUSTRLE  = 0x14
+CMD_PING      = 0xF0
+CMD_INSTR_VER = 0xF1
+CMD_INSTR_UPD = 0xF2
+CMD_CAPS      = 0xF3
+CMD_UPGRADE   = 0xF4
+
+# Command names by opcode
+CMD_NAMES = dict([ (v, k) for (k, v) in list(globals().items()) if k.startswith("CMD_") ])
+
+# Capability flags reported by CMD_CAPS
+CAP_BLOCK_RW  = 0x01
+CAP_RELIABLE  = 0x02
+CAP_BRUST_RLE = 0x04
+
+# Maximum size of a block read/write command
+BLOCK_RD_MAX  = 2048
+BLOCK_WR_MAX  = 128
+
+# Response constants
+ANS_OK       = 0x01
+ANS_ERROR    = 0x02
+ANS_READY    = 0x03
+
+# Baud rates the link can be upgraded to with CMD_UPGRADE (in this order)
+LINK_BAUDRATES = [ 115200, 250000, 500000, 1000000, 2000000 ]
+
+# On the upgraded link every transmission is a CRC-protected, sequenced packet:
+#
+#  Request  : [cmd] [c1] [c2] [c3] [seq] [len] [payload ...] [crc8]
+#  Response : [status] [H] [L] [seq] [len] [payload ...] [crc8]
+#
+PKT_PAYLOAD_MAX = 128  # Largest packet payload the proxy accepts
+PKT_CACHE = 16         # Responses the proxy keeps for re-transmission
+PKT_BAD_MAX = 8        # Bad packets in a row before the proxy falls back
+LINK_CONFIRM = 2.0     # Time the proxy waits for us on the new link
+
+# Lookup table for the CRC-8 (polynomial 0x07) that protects the packets
+CRC8_TABLE = []
+for i in range(0, 256):
+	crc = i
+	for j in range(0, 8):
+		crc = ((crc << 1) ^ 0x07) & 0xFF if (crc & 0x80) else (crc << 1) & 0xFF
+	CRC8_TABLE.append(crc)
+
+def crc8(data, crc=0):
+	"""
+	Calculate the CRC-8 of the given bytes
+	"""
+	for b in bytearray(data):
+		crc = CRC8_TABLE[crc ^ b]
+	return crc
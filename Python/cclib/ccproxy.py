@@ -16,36 +16,417 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 from __future__ import print_function
+from contextlib import contextmanager
+from collections import deque
+from bisect import bisect
+from cclib.ccflash import CCFlashCache, CACHE_DIR, sharedFlashCache
+from cclib.ccprotocol import *
+import threading
+import atexit
+import json
 import sys
+import os
 import time
 import glob
 import serial
 import serial.tools.list_ports
 
-# Command constants
-CMD_ENTER     = 0x01
-CMD_EXIT      = 0x02
-CMD_CHIP_ID   = 0x03
-CMD_STATUS    = 0x04
-CMD_PC        = 0x05
-CMD_STEP      = 0x06
-CMD_EXEC_1    = 0x07
-CMD_EXEC_2    = 0x08
-CMD_EXEC_3    = 0x09
-CMD_BRUSTWR   = 0x0A
-CMD_RD_CFG    = 0x0B
-CMD_WR_CFG    = 0x0C
-CMD_CHPERASE  = 0x0D
-CMD_RESUME    = 0x0E
-CMD_HALT      = 0x0F
-CMD_PING      = 0xF0
-CMD_INSTR_VER = 0xF1
-CMD_INSTR_UPD = 0xF2
-
-# Response constants
-ANS_OK       = 0x01
-ANS_ERROR    = 0x02
-ANS_READY    = 0x03
+# The CCLib_proxy sketch only consumes a frame when all of its 4 bytes are
+# available, so we can keep as many frames in flight as the serial RX buffer
+# of the arduino can hold (64 bytes on the AVR-based boards)
+PROXY_RX_BUFFER = 64
+
+# How long to wait for a CCLib_proxy to respond while probing a port. This must
+# cover the auto-reset that most arduino boards perform when the port is opened
+PROBE_TIMEOUT = 3.0
+
+# How we use the upgraded link (see ccprotocol.py for the packets)
+PKT_WINDOW = 8         # Empty packets in flight (7 bytes each, must fit in the RX buffer)
+PKT_BRUST_CHUNK = 56   # Burst data per packet, so the next one fits in the RX buffer
+PKT_BRUST_WINDOW = 2   # Burst packets in flight
+PKT_TIMEOUT = 0.25     # Time to wait for a response before re-transmitting
+PKT_RETRIES = 5        # Re-transmissions before giving up
+
+# Upper bounds (in seconds) of the buckets of the response time histograms
+STATS_BUCKETS = [ 0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.5 ]
+
+# The file where the last port a CCLib_proxy responded on is remembered
+PORT_CACHE = os.environ.get("CC_PORT_CACHE", os.path.join(os.path.expanduser("~"), ".cclib_port"))
+
+# The file where the learned durations of the chip operations are kept (set
+# CC_TIMINGS to an empty string to keep them only in memory)
+TIMINGS_FILE = os.environ.get("CC_TIMINGS", os.path.join(os.path.expanduser("~"), ".cclib_timings"))
+
+# Waiting for an operation on the chip: sleep until this fraction of its
+# expected duration, then poll with a backoff from POLL_MIN to POLL_MAX. The
+# expected duration moves by POLL_LEARN towards every new measurement.
+POLL_EARLY = 0.9
+POLL_MIN = 0.001
+POLL_MAX = 0.010
+POLL_LEARN = 0.25
+
+def rleCompress(data):
+	"""
+	Compress the given bytes for CMD_BRUSTRLE: a control byte below 0x80 is
+	followed by that many + 1 literal bytes, and a control byte from 0x80 on
+	by a single byte repeated (control & 0x7F) + 2 times
+	"""
+	data = bytearray(data)
+	ans = bytearray()
+	literal = bytearray()
+	i = 0
+	while i < len(data):
+
+		# Measure the run starting here
+		run = 1
+		while (i + run < len(data)) and (run < 129) and (data[i + run] == data[i]):
+			run += 1
+
+		# Runs shorter than 3 bytes are cheaper as literals
+		if run < 3:
+			literal.append(data[i])
+			i += 1
+			if len(literal) < 128:
+				continue
+		else:
+			i += run
+
+		# Flush literals
+		if literal:
+			ans.append(len(literal) - 1)
+			ans += literal
+			literal = bytearray()
+
+		# Append run
+		if run >= 3:
+			ans += bytearray([0x80 | (run - 2), data[i - run]])
+
+	# Flush trailing literals
+	if literal:
+		ans.append(len(literal) - 1)
+		ans += literal
+	return ans
+
+class CCDeferredFrame:
+	"""
+	Future-like placeholder for the response of a queued frame. The value
+	becomes available when the response arrives from the proxy.
+	"""
+
+	def __init__(self, proxy, raiseException=True, cmd=None):
+		"""
+		Initialize the deferred response
+		"""
+		self.proxy = proxy
+		self.raiseException = raiseException
+		self.cmd = cmd
+		self.done = False
+		self.value = None
+		self.error = None
+
+	def result(self):
+		"""
+		Return the response of the frame, flushing the queue if it's not
+		yet available
+		"""
+
+		# Collect the responses up to ours if we are still pending (the
+		# errors of the other frames are left for the next flushQueue)
+		if not self.done:
+			self.proxy._pumpQueue(drain=True)
+
+		# Re-raise the exception this frame caused, which is now reported
+		if self.error is not None:
+			if self.error in self.proxy.queueErrors:
+				self.proxy.queueErrors.remove(self.error)
+			raise self.error
+		return self.value
+
+class CCProxyStats:
+	"""
+	Protocol-level counters of a CCLibProxy, broken down by command: the frames
+	and the bytes sent & received, the round trips (every time we had to wait
+	for the proxy), the brust bytes (before compression) and the time spent
+	waiting for responses, together with a histogram of it.
+	"""
+
+	def __init__(self, clock=time.time):
+		"""
+		Initialize the counters, timing with the given clock
+		"""
+		self.clock = clock
+		self.reset()
+
+	def reset(self):
+		"""
+		Reset all the counters
+		"""
+		self.started = self.clock()
+		self.commands = {}
+		self.polls = 0
+		self.pollTime = 0.0
+		self.retransmits = 0
+
+	def record(self, cmd, frames=0, bytesOut=0, bytesIn=0, roundTrips=0, brustBytes=0, readTime=None):
+		"""
+		Add to the counters of the given command
+		"""
+		c = self.commands.get(cmd)
+		if c is None:
+			c = self.commands[cmd] = { 'frames': 0, 'bytesOut': 0, 'bytesIn': 0, 'roundTrips': 0,
+				'brustBytes': 0, 'readTime': 0.0, 'histogram': [0] * (len(STATS_BUCKETS) + 1) }
+		c['frames'] += frames
+		c['bytesOut'] += bytesOut
+		c['bytesIn'] += bytesIn
+		c['roundTrips'] += roundTrips
+		c['brustBytes'] += brustBytes
+		if readTime is not None:
+			c['readTime'] += readTime
+			if roundTrips:
+				c['histogram'][bisect(STATS_BUCKETS, readTime)] += 1
+
+	def snapshot(self):
+		"""
+		Return a copy of the counters, with the commands by name. The time elapsed
+		since the last reset is split in the time spent waiting for the proxy
+		(`readTime`), sleeping between polls (`pollTime`) and the rest (`hostTime`).
+		"""
+		elapsed = self.clock() - self.started
+		readTime = sum([ c['readTime'] for c in self.commands.values() ])
+		commands = {}
+		for (cmd, c) in self.commands.items():
+			commands[CMD_NAMES.get(cmd, "0x%02x" % cmd)] = dict(c, histogram=list(c['histogram']))
+		return {
+			'elapsed': elapsed,
+			'readTime': readTime,
+			'pollTime': self.pollTime,
+			'hostTime': max(0.0, elapsed - readTime - self.pollTime),
+			'polls': self.polls,
+			'retransmits': self.retransmits,
+			'buckets': list(STATS_BUCKETS),
+			'commands': commands
+		}
+
+class CCTimings:
+	"""
+	The expected durations (in seconds) of the operations we have to poll the
+	chip for (like 'erasePage' or 'flashWrite'), per chip, as learned from
+	the previous waits. They are kept in `filename` (a JSON file) if given.
+	"""
+
+	def __init__(self, filename=None):
+		"""
+		Load the timings learned in the previous sessions
+		"""
+		self.filename = filename
+		self.chips = {}
+		self.changed = False
+		if filename:
+			try:
+				with open(filename, "r") as f:
+					self.chips = json.load(f)
+			except (IOError, OSError, ValueError):
+				pass
+			atexit.register(self.save)
+
+	def expected(self, chip, operation):
+		"""
+		Return the expected duration of the given operation, or None if we
+		haven't seen it yet
+		"""
+		return self.chips.get(chip, {}).get(operation)
+
+	def learn(self, chip, operation, seconds):
+		"""
+		Update the expected duration of the given operation with a new
+		measurement
+		"""
+		timings = self.chips.setdefault(chip, {})
+		last = timings.get(operation)
+		if last is not None:
+			seconds = last + (seconds - last) * POLL_LEARN
+		timings[operation] = seconds
+		self.changed = True
+
+	def snapshot(self, chip):
+		"""
+		Return a copy of the timings of the given chip
+		"""
+		return dict(self.chips.get(chip, {}))
+
+	def save(self):
+		"""
+		Write the timings back in their file (merged with the ones other
+		sessions saved in the meantime)
+		"""
+		if not self.filename or not self.changed:
+			return
+		chips = {}
+		try:
+			with open(self.filename, "r") as f:
+				chips = json.load(f)
+		except (IOError, OSError, ValueError):
+			pass
+		for (chip, timings) in self.chips.items():
+			chips.setdefault(chip, {}).update(timings)
+		try:
+			with open(self.filename, "w") as f:
+				json.dump(chips, f, indent=2, sort_keys=True)
+			self.changed = False
+		except (IOError, OSError):
+			pass
+
+# The timings loaded from every file (see sharedTimings)
+sharedTimingFiles = {}
+
+def sharedTimings(filename):
+	"""
+	Return the timings kept in the given file, which are loaded only once
+	(and saved only once, at exit) however many sessions use them. Without a
+	file, the timings are only kept in memory and not shared.
+	"""
+	if not filename:
+		return CCTimings()
+	if not filename in sharedTimingFiles:
+		sharedTimingFiles[filename] = CCTimings(filename)
+	return sharedTimingFiles[filename]
+
+def candidatePorts():
+	"""
+	Return the list of system COM ports, prioritizing the ones that are
+	more likely to be a CCLib_proxy
+	"""
+
+	# Prioritize known ports, since on linux and osx scanning
+	# weird ports will cost more
+	ports = []
+	priority_names =  ['acm', 'usb', 'ttys']
+	all_ports = list(serial.tools.list_ports.comports())
+	for name in priority_names:
+		for port in list(all_ports):
+			if name.lower() in port[0].lower():
+				ports.append(port)
+				all_ports.remove(port)
+	ports += all_ports
+
+	# Return ports
+	return ports
+
+def portKey(port):
+	"""
+	Return the key that identifies the given port: its USB VID/PID/serial
+	number if available, otherwise its name
+	"""
+	vid = getattr(port, 'vid', None)
+	if vid is None:
+		return port[0]
+	return "%04x:%04x:%s" % (vid, port.pid, port.serial_number or "")
+
+def loadPortCache():
+	"""
+	Return the key of the last port a CCLib_proxy responded on, or None
+	"""
+	try:
+		with open(PORT_CACHE, "r") as f:
+			return json.load(f).get('key', None)
+	except (IOError, OSError, ValueError, AttributeError):
+		return None
+
+def savePortCache(port):
+	"""
+	Remember the given port info as the last one a CCLib_proxy responded on
+	"""
+	try:
+		with open(PORT_CACHE, "w") as f:
+			json.dump({ 'key': portKey(port), 'port': port[0] }, f)
+	except (IOError, OSError):
+		pass
+
+def probePort(name, timeout=None, cancel=None):
+	"""
+	Open the given port and ping the CCLib_proxy on it until it responds,
+	`timeout` (PROBE_TIMEOUT by default) expires or the `cancel` event is set.
+	Return the open serial port or None if nothing responded.
+	"""
+	if timeout is None:
+		timeout = PROBE_TIMEOUT
+	deadline = time.time() + timeout
+
+	# Open the port with a short read timeout
+	try:
+		ser = serial.Serial(name, timeout=0.2, write_timeout=timeout)
+	except Exception:
+		return None
+
+	try:
+		while (time.time() < deadline) and not (cancel and cancel.is_set()):
+
+			# Frames sent while the arduino is resetting are lost, so keep
+			# pinging until it responds
+			ser.reset_input_buffer()
+			ser.write( bytearray([CMD_PING, 0, 0, 0]) )
+			ser.flush()
+			ans = bytearray(ser.read(3))
+			if (len(ans) == 3) and (ans[0] == ANS_OK):
+
+				# Drop any late response to a previous ping
+				time.sleep(0.05)
+				ser.reset_input_buffer()
+
+				# Switch to blocking mode
+				ser.timeout = None
+				return ser
+
+	except Exception:
+		pass
+
+	# Nothing responded
+	ser.close()
+	return None
+
+def probePorts(names, timeout=None):
+	"""
+	Probe the given ports concurrently and return a tuple with the name and
+	the open serial port of the first one that responded, or (None, None)
+	"""
+	if timeout is None:
+		timeout = PROBE_TIMEOUT
+	found = []
+	lock = threading.Lock()
+	done = threading.Event()
+
+	def probe(name):
+		ser = probePort(name, timeout, done)
+		if ser is None:
+			return
+		with lock:
+			if not found:
+				found.append( (name, ser) )
+				done.set()
+				return
+		ser.close()
+
+	# Start a probe for every port
+	threads = []
+	for name in names:
+		t = threading.Thread(target=probe, args=(name,))
+		t.daemon = True
+		t.start()
+		threads.append(t)
+
+	# Wait until a port responds or all of them give up
+	while not done.is_set() and any([ t.is_alive() for t in threads ]):
+		done.wait(0.01)
+
+	# Stop the other probes, so their ports are closed by the time we return
+	done.set()
+	for t in threads:
+		t.join(timeout + 1)
+
+	# Return the port that responded
+	if found:
+		return found[0]
+	return (None, None)
 
 class CCLibProxy:
 	"""
@@ -57,11 +438,45 @@ class CCLibProxy:
 	performance issues, a binary serial protocol was used.
 	"""
 
-	def __init__(self, port=None, parent=None, enterDebug=False):
+	def __init__(self, port=None, parent=None, enterDebug=False, baudrate=None, trace=None):
 		"""
 		Initialize the CCLibProxy class
+
+		Instead of a port name, `port` can also be an object that behaves like
+		an open serial port (for example a CCTraceReplay), "replay:<file>" to
+		replay a trace or "emulator:<chip>" to talk to an emulated chip. If
+		`trace` is set, all the traffic is recorded there.
+
+		Stand-ins with their own notion of time (like CCProxyEmulator) provide
+		`clock()` and `sleep()`, which are then used instead of the real time.
+		The durations of the chip operations learned on real ports are kept in
+		TIMINGS_FILE, while the ones of stand-ins are only kept in memory. The
+		same goes for the flash contents the chip drivers cache in CACHE_DIR.
+		All the sessions on real ports share the same timings & cache.
 		"""
 
+		# The state of the upgraded (reliable) link
+		self.linkReliable = False
+		self.linkSeq = 0
+
+		# Flash pages known to be erased (until the CPU runs again)
+		self.erasedPages = set()
+
+		# Registers as the chip driver last read or wrote them (while the CPU
+		# is halted, see ChipDriver.getShadow)
+		self.shadow = {}
+		self.cpuRunning = False
+
+		# Protocol counters & the command whose response we are waiting for
+		self.stats = CCProxyStats()
+		self.lastCommand = None
+
+		# Frames queued for pipelined transmission & frames awaiting response
+		self.frameQueue = []
+		self.framesInFlight = deque()
+		self.queueErrors = []
+		self.pipelineDepth = int(PROXY_RX_BUFFER / 4)
+
 		# If we are subclassing, just adopt properties
 		if not parent is None:
 
@@ -72,33 +487,75 @@ class CCLibProxy:
 			self.debugStatus = parent.debugStatus
 			self.debugConfig = parent.debugConfig
 			self.instructionTableVersion = parent.instructionTableVersion
+			self.capabilities = parent.capabilities
+			self.linkReliable = parent.linkReliable
+			self.linkSeq = parent.linkSeq
+			self.erasedPages = parent.erasedPages
+			self.shadow = parent.shadow
+			self.cpuRunning = parent.cpuRunning
+			self.stats = parent.stats
+			self.clock = parent.clock
+			self.sleep = parent.sleep
+			self.timings = parent.timings
+			self.flashCache = parent.flashCache
 
 		else:
+			self.timings = None
+			self.flashCache = None
+
+			# Replay traces instead of talking to a port
+			if (port is not None) and str(port).startswith("replay:"):
+				from cclib.cctrace import CCTraceReplay
+				port = CCTraceReplay(port[7:])
+
+			# Emulate the proxy & the chip
+			elif (port is not None) and str(port).startswith("emulator:"):
+				from cclib.ccemulator import createEmulator
+				port = createEmulator(port[9:])
 
 			# If we don't have a port specified perform autodetect
 			if port is None or port == 'auto':
 				self.detectPort()
 
+			# Use serial port stand-ins as they are
+			elif hasattr(port, 'read'):
+				self.ser = port
+				self.port = getattr(port, 'port', None) or repr(port)
+				self.timings = CCTimings()
+				self.flashCache = CCFlashCache()
+
 			else:
-				# Open port
-				try:
-					self.ser = serial.Serial(port)
-					self.port = port
-				except:
-					raise IOError("Could not open port %s" % port)
-
-				# Ping
-				try:
-					self.ping()
-				except IOError:
-					raise IOError("Could not find CCLib_proxy device on port %s" % self.ser.name)
+				# Open port & ping
+				self.ser = probePort(port)
+				self.port = port
+				if self.ser is None:
+					raise IOError("Could not find CCLib_proxy device on port %s" % port)
+
+			# Keep the time of the port & the durations learned on it
+			if self.timings is None:
+				self.timings = sharedTimings(TIMINGS_FILE)
+				self.flashCache = sharedFlashCache(CACHE_DIR)
+			self.clock = getattr(self.ser, 'clock', time.time)
+			self.sleep = getattr(self.ser, 'sleep', time.sleep)
+			self.stats = CCProxyStats(self.clock)
+
+			# Record the traffic if requested
+			if trace:
+				from cclib.cctrace import CCTraceRecorder
+				self.ser = CCTraceRecorder(self.ser, trace)
 
 			# Check if we should enter debug mode
 			if enterDebug:
 				self.enter()
 
-			# Get instruction table version
+			# Get instruction table version & proxy capabilities
 			self.instructionTableVersion = self.getInstructionTableVersion()
+			self.capabilities = self.getCapabilities()
+
+			# Switch to a faster link if requested
+			if baudrate:
+				if not self.upgradeLink(baudrate):
+					print("WARNING: The CCLib_proxy firmware does not support link upgrades, staying at 115200 baud")
 
 			# Get chip info & ID
 			self.chipID = self.getChipID()
@@ -112,35 +569,30 @@ class CCLibProxy:
 		"""
 		print("NOTE: Performing auto-detection (use -p to specify port manually)")
 
-		# Prioritize known ports, since on linux and osx scanning
-		# weird ports will cost more
-		ports = []
-		priority_names =  ['acm', 'usb', 'ttys']
-		all_ports = list(serial.tools.list_ports.comports())
-		for name in priority_names:
-			for i in range(0, len(all_ports)):
-				if name.lower() in all_ports[i][0]:
-					ports.append(all_ports[i])
-					all_ports.pop(i)
-		ports += all_ports
-
-		# Try to ping each one
-		for port in ports:
-			try:
-				print("INFO: Checking %s" % port[0])
-				self.ser = serial.Serial(port[0])
-
-				# If ping fails, we will get an exception
-				self.sendFrame(CMD_PING)
-				self.port = port[0]
-				return
+		# Get the ports to scan
+		ports = candidatePorts()
 
-			except:
-				try:
-					self.ser.close()
-				except:
-					pass
-				self.ser = None
+		# Try the port that responded last time on its own, since opening
+		# the rest would reset every arduino connected
+		lastKey = loadPortCache()
+		for port in ports:
+			if portKey(port) == lastKey:
+				print("INFO: Checking %s (last used)" % port[0])
+				ports.remove(port)
+				self.ser = probePort(port[0])
+				if self.ser is not None:
+					self.port = port[0]
+					return
+				break
+
+		# Probe all the remaining ports in parallel
+		print("INFO: Checking %s" % ", ".join([ p[0] for p in ports ]))
+		(self.port, self.ser) = probePorts([ p[0] for p in ports ])
+		if self.ser is not None:
+			for port in ports:
+				if port[0] == self.port:
+					savePortCache(port)
+			return
 
 		# No port defined? Raise an exception
 		raise IOError("Could not detect a CCLib_proxy connected on any serial port")
@@ -155,18 +607,18 @@ class CCLibProxy:
 		"""
 
 		# Read response frame
-		b = self.ser.read()
-		if len(b) == 0:
-			raise IOError("Could not read from the serial port!")
-		status = ord(b)
-		b = self.ser.read()
-		if len(b) == 0:
+		frame = self._read(self.lastCommand, 3)
+		if len(frame) < 3:
 			raise IOError("Could not read from the serial port!")
-		bH = ord(b)
-		b = self.ser.read()
-		if len(b) == 0:
-			raise IOError("Could not read from the serial port!")
-		bL = ord(b)
+
+		# Translate response
+		return self.decodeFrame(frame, raiseException)
+
+	def decodeFrame(self, frame, raiseException=True):
+		"""
+		Translate a 3-byte response frame to a value or an exception
+		"""
+		(status, bH, bL) = frame[0:3]
 
 		# Handle error responses
 		if status == ANS_ERROR:
@@ -199,13 +651,359 @@ class CCLibProxy:
 		Send the specified frame to the output queue
 		"""
 
+		# On the upgraded link, exchange a packet instead
+		if self.linkReliable:
+			(status, bH, bL, payload) = self.exchangePackets([ (cmd, c1, c2, c3) ])[0]
+			return self.decodeFrame(bytearray([status, bH, bL]), raiseException)
+
 		# Send the 4-byte command frame
-		self.ser.write( chr(cmd)+chr(c1)+chr(c2)+chr(c3) )
-		self.ser.flush()
+		self.writeFrame(cmd, c1, c2, c3)
 
 		# Read frame
 		return self.readFrame(raiseException)
 
+	def writeFrame(self, cmd, c1=0, c2=0, c3=0):
+		"""
+		Send the specified frame without waiting for a response
+		"""
+
+		# Responses must arrive in order, so complete any pipelined frames first
+		if self.frameQueue or self.framesInFlight:
+			self.flushQueue()
+
+		# Send the 4-byte command frame
+		self._write(cmd, bytearray([cmd, c1, c2, c3]), frames=1)
+
+	def _write(self, cmd, data, frames=0):
+		"""
+		Write the given bytes on behalf of the given command
+		"""
+		self.lastCommand = cmd
+		self.ser.write(data)
+		self.ser.flush()
+		self.stats.record(cmd, frames=frames, bytesOut=len(data))
+
+	def _read(self, cmd, size, roundTrip=True):
+		"""
+		Read up to `size` bytes on behalf of the given command, timing how long
+		we had to wait for them
+		"""
+		started = self.clock()
+		data = bytearray(self.ser.read(size))
+		self.stats.record(cmd, bytesIn=len(data), roundTrips=1 if roundTrip else 0, readTime=self.clock() - started)
+		return data
+
+	def delay(self, seconds):
+		"""
+		Sleep between the polls of a device status
+		"""
+		self.stats.polls += 1
+		self.stats.pollTime += seconds
+		self.sleep(seconds)
+
+	def timingName(self):
+		"""
+		Return the name the learned timings of this chip are kept under
+		"""
+		return "0x%04x" % (self.chipID & 0xFF00)
+
+	def getTimings(self):
+		"""
+		Return the expected durations (in seconds) of the chip operations, as
+		learned so far
+		"""
+		return self.timings.snapshot(self.timingName())
+
+	def waitFor(self, operation, done, started=None, scale=1.0, timeout=None):
+		"""
+		Poll `done()` until it returns True, for the given operation that was
+		started at `started` (or now). We sleep until just before the time the
+		operation is expected to take (times `scale`, for operations on less
+		data) and then poll with a backoff, learning from how long it took.
+
+		Returns False if the operation did not complete within `timeout`.
+		"""
+		name = self.timingName()
+		if started is None:
+			started = self.clock()
+
+		# Sleep until just before the expected completion
+		expected = self.timings.expected(name, operation)
+		if expected is not None:
+			remaining = started + expected * scale * POLL_EARLY - self.clock()
+			if remaining > 0:
+				self.delay(remaining)
+
+		# Then poll with backoff
+		interval = POLL_MIN
+		while not done():
+			if (timeout is not None) and (self.clock() - started > timeout):
+				return False
+			self.delay(interval)
+			interval = min(interval * 2, POLL_MAX)
+
+		self.timings.learn(name, operation, (self.clock() - started) / scale)
+		return True
+
+	def getStats(self):
+		"""
+		Return a snapshot of the protocol counters (see CCProxyStats.snapshot)
+		"""
+		return self.stats.snapshot()
+
+	def resetStats(self):
+		"""
+		Reset the protocol counters
+		"""
+		self.stats.reset()
+
+	###############################################
+	# Reliable link functions
+	###############################################
+
+	def upgradeLink(self, baudrate=1000000):
+		"""
+		Switch the link to the given baud rate, using CRC-protected & sequenced
+		packets from now on. Returns False if the proxy does not support it.
+		"""
+		if not (self.capabilities & CAP_RELIABLE):
+			return False
+		if not baudrate in LINK_BAUDRATES:
+			raise IOError("Unsupported link baud rate %i (use one of %s)" % (baudrate, ", ".join(map(str, LINK_BAUDRATES))))
+
+		# Ask the proxy to switch & follow it
+		self.sendFrame(CMD_UPGRADE, LINK_BAUDRATES.index(baudrate))
+		self.ser.baudrate = baudrate
+		self.ser.timeout = PKT_TIMEOUT
+		self.linkReliable = True
+		self.linkSeq = 0
+
+		# Confirm we can talk over the new link
+		try:
+			self.ping()
+		except IOError:
+
+			# The proxy falls back to 115200 when we don't confirm in time
+			self.linkReliable = False
+			self.sleep(LINK_CONFIRM)
+			self.ser.baudrate = 115200
+			self.ser.timeout = None
+			self.ser.reset_input_buffer()
+			raise IOError("Could not upgrade the link to %i baud" % baudrate)
+
+		return True
+
+	def encodePacket(self, seq, cmd, c1=0, c2=0, c3=0, payload=b''):
+		"""
+		Encode a request packet for the reliable link
+		"""
+		data = bytearray([cmd, c1, c2, c3, seq, len(payload)]) + bytearray(payload)
+		data.append(crc8(data))
+		return data
+
+	def readPacket(self, cmd=None):
+		"""
+		Read a response packet from the reliable link and return a tuple with
+		(status, bH, bL, seq, payload), or None if it was lost or corrupted
+		"""
+		header = self._read(cmd, 5)
+		if len(header) < 5:
+			return None
+		data = self._read(cmd, header[4] + 1, roundTrip=False)
+		if (len(data) < header[4] + 1) or (crc8(header + data[:-1]) != data[-1]):
+			return None
+		return (header[0], header[1], header[2], header[3], data[:-1])
+
+	def exchangePackets(self, packets, window=PKT_WINDOW):
+		"""
+		Send the given (cmd, c1, c2, c3[, payload]) packets over the reliable
+		link, keeping up to `window` of them in flight, and return the list of
+		their (status, bH, bL, payload) responses.
+
+		When a response is missing or corrupted, everything from that packet on
+		is re-transmitted. The proxy re-sends the responses of the packets it has
+		already handled, so none of them is executed twice.
+		"""
+
+		# Responses must arrive in order, so complete the queued frames first
+		if self.frameQueue:
+			self.flushQueue()
+
+		# Assign sequence numbers & encode packets
+		encoded = []
+		seqs = []
+		for p in packets:
+			seqs.append(self.linkSeq)
+			encoded.append(self.encodePacket(self.linkSeq, *p))
+			self.linkSeq = (self.linkSeq + 1) & 0xFF
+
+		ans = []
+		sent = 0
+		retries = 0
+		while len(ans) < len(packets):
+
+			# Fill the window
+			last = min(len(ans) + window, len(packets))
+			if sent < last:
+				self.ser.write( b''.join([ bytes(p) for p in encoded[sent:last] ]) )
+				self.ser.flush()
+				for i in range(sent, last):
+					self.stats.record(packets[i][0], frames=1, bytesOut=len(encoded[i]))
+				sent = last
+
+			# Wait for the response of the oldest packet
+			reply = self.readPacket(packets[len(ans)][0])
+			if (reply is not None) and (reply[3] == seqs[len(ans)]):
+				ans.append( (reply[0], reply[1], reply[2], reply[4]) )
+				retries = 0
+				continue
+
+			# Ignore late duplicates of responses we already have
+			if (reply is not None) and (reply[3] in seqs[0:len(ans)]):
+				continue
+
+			# Otherwise drop whatever is still arriving & go back
+			retries += 1
+			if retries > PKT_RETRIES:
+				raise IOError("The CCLib_proxy is not responding on the upgraded link!")
+			self.sleep(PKT_TIMEOUT / 4)
+			self.ser.reset_input_buffer()
+			self.stats.retransmits += sent - len(ans)
+			sent = len(ans)
+
+		return ans
+
+	###############################################
+	# Pipelined functions
+	###############################################
+
+	def queueFrame(self, cmd, c1=0, c2=0, c3=0, raiseException=True ):
+		"""
+		Queue the specified frame for pipelined transmission and return a
+		CCDeferredFrame that resolves when its response arrives
+		"""
+
+		# Enqueue frame
+		ans = CCDeferredFrame(self, raiseException, cmd)
+		self.frameQueue.append( (bytearray([cmd, c1, c2, c3]), ans) )
+
+		# Start transmitting when we have enough frames to fill the window
+		if len(self.frameQueue) >= self.pipelineDepth:
+			self._pumpQueue()
+
+		# Return the deferred response
+		return ans
+
+	def flushQueue(self):
+		"""
+		Transmit all queued frames and wait for all of their responses
+		"""
+
+		# Send everything & collect all responses
+		self._pumpQueue(drain=True)
+
+		# Raise the first error not yet reported by its deferred frame
+		errors = self.queueErrors
+		self.queueErrors = []
+		if errors:
+			raise errors[0]
+
+	@contextmanager
+	def pipeline(self):
+		"""
+		Context manager that flushes the frames queued in its body on exit
+		"""
+		try:
+			yield self
+		finally:
+			self.flushQueue()
+
+	def _pumpQueue(self, drain=False):
+		"""
+		Keep up to `pipelineDepth` frames in flight, collecting responses
+		as needed to make room for the queued frames
+		"""
+		# The reliable link does its own windowing
+		if self.linkReliable:
+			if self.frameQueue and (drain or (len(self.frameQueue) >= self.pipelineDepth)):
+				batch = self.frameQueue
+				self.frameQueue = []
+				replies = self.exchangePackets([ tuple(frame) for (frame, ans) in batch ])
+				for ((frame, ans), (status, bH, bL, payload)) in zip(batch, replies):
+					self._resolveFrame(ans, bytearray([status, bH, bL]))
+			return
+
+		while self.frameQueue or (drain and self.framesInFlight):
+
+			# Send as many frames as the window allows in a single write
+			room = self.pipelineDepth - len(self.framesInFlight)
+			if (room > 0) and self.frameQueue:
+				batch = self.frameQueue[0:room]
+				del self.frameQueue[0:room]
+				data = bytearray()
+				for (frame, ans) in batch:
+					data += frame
+					self.framesInFlight.append(ans)
+					self.stats.record(ans.cmd, frames=1, bytesOut=len(frame))
+				self.ser.write(data)
+				self.ser.flush()
+
+			# Collect half of the window while the rest keeps the proxy busy,
+			# or everything if there is nothing else to send
+			if self.frameQueue:
+				count = max(1, int(self.pipelineDepth / 2))
+			elif drain:
+				count = len(self.framesInFlight)
+			else:
+				break
+			self._collectFrames(min(count, len(self.framesInFlight)))
+
+	def _collectFrames(self, count):
+		"""
+		Read the responses of the `count` oldest frames in flight
+		"""
+
+		# Read all the response frames at once (the wait is accounted to the oldest)
+		started = self.clock()
+		data = bytearray(self.ser.read(3 * count))
+		self.stats.record(self.framesInFlight[0].cmd, roundTrips=1, readTime=self.clock() - started)
+		if len(data) < 3 * count:
+			raise IOError("Could not read from the serial port!")
+
+		# Resolve deferred responses
+		for i in range(0, count):
+			ans = self.framesInFlight.popleft()
+			self.stats.record(ans.cmd, bytesIn=3)
+			self._resolveFrame(ans, data[i*3:i*3+3])
+
+	def _resolveFrame(self, ans, frame):
+		"""
+		Resolve a deferred response with the given response frame
+		"""
+		try:
+			ans.value = self.decodeFrame(frame, ans.raiseException)
+		except IOError as e:
+			ans.error = e
+			self.queueErrors.append(e)
+		ans.done = True
+
+	def queueInstr(self, c1, c2=None, c3=None):
+		"""
+		Queue a debug instruction (see `instr`)
+		"""
+		if (c2 == None):
+			return self.queueFrame(CMD_EXEC_1, c1)
+		elif (c3 == None):
+			return self.queueFrame(CMD_EXEC_2, c1, c2)
+		else:
+			return self.queueFrame(CMD_EXEC_3, c1, c2, c3)
+
+	def queueInstri(self, c1, i1):
+		"""
+		Queue a debug instruction with 16-bit constant (see `instri`)
+		"""
+		return self.queueFrame(CMD_EXEC_3, c1, (i1 >> 8) & 0xFF, i1 & 0xFF)
+
 	###############################################
 	# Debug-level functions
 	###############################################
@@ -223,6 +1021,8 @@ class CCLibProxy:
 		"""
 		Enter in debug mode
 		"""
+		self.shadow.clear()
+		self.cpuRunning = False
 		return self.sendFrame(CMD_ENTER)
 
 	def exit(self):
@@ -230,6 +1030,9 @@ class CCLibProxy:
 		Exit from debug mode by resuming the CPU
 		"""
 		status = self.sendFrame(CMD_EXIT)
+		self.erasedPages.clear()
+		self.shadow.clear()
+		self.cpuRunning = True
 
 		# Update debug status
 		self.debugStatus = status
@@ -256,18 +1059,25 @@ class CCLibProxy:
 		"""
 		Step a single instruction
 		"""
+		self.erasedPages.clear()
+		self.shadow.clear()
 		return self.sendFrame(CMD_STEP)
 
 	def resume(self):
 		"""
 		resume program exec
 		"""
+		self.erasedPages.clear()
+		self.shadow.clear()
+		self.cpuRunning = True
 		return self.sendFrame(CMD_RESUME)
 
 	def halt(self):
 		"""
 		halt program exec
 		"""
+		self.shadow.clear()
+		self.cpuRunning = False
 		return self.sendFrame(CMD_HALT)
 
 	def getChipID(self):
@@ -329,23 +1139,122 @@ class CCLibProxy:
 		if length > 2048:
 			return False
 
+		# An empty brust only returns the debug status
+		if self.linkReliable and not length:
+			return self.getStatus()
+
 		# Split length in high/low order bytes
 		cHigh = (length >> 8) & 0xFF
 		cLow = (length & 0xFF)
 
+		# Compress the data if the proxy can expand them & it pays off
+		cmd = CMD_BRUSTWR
+		if self.capabilities & CAP_BRUST_RLE:
+			packed = rleCompress(data)
+			if len(packed) < length:
+				(cmd, data) = (CMD_BRUSTRLE, packed)
+
 		# Prepare for BRUST frame transmission
-		ans = self.sendFrame(CMD_BRUSTWR, cHigh, cLow)
+		self.stats.record(cmd, brustBytes=length)
+		ans = self.sendFrame(cmd, cHigh, cLow)
 		if ans != ANS_READY:
 			raise IOError("Unable to prepare for brust-write! (Unknown response 0x%02x)" % ans)
 
+		# On the upgraded link, send the data in acknowledged packets (the
+		# response of the last one carries the debug status)
+		if self.linkReliable:
+			data = bytearray(data)
+			replies = self.exchangePackets([ (CMD_BRUSTDAT, 0, 0, 0, data[i:i+PKT_BRUST_CHUNK])
+				for i in range(0, len(data), PKT_BRUST_CHUNK) ], PKT_BRUST_WINDOW)
+			for (status, bH, bL, payload) in replies:
+				self.debugStatus = self.decodeFrame(bytearray([status, bH, bL]))
+			return self.debugStatus
+
 		# Start sending data
-		self.ser.write(data)
-		self.ser.flush()
+		self._write(cmd, data)
 
 		# Handle response & update debug status
 		self.debugStatus = self.readFrame()
 		return self.debugStatus
 
+	def readBlockXDATA(self, size):
+		"""
+		Read `size` bytes from the XDATA region starting at DPTR, using the
+		block-read command of the proxy (requires CAP_BLOCK_RW)
+		"""
+		return self._readBlock(CMD_XDATA_RD, size)
+
+	def readBlockCODE(self, size):
+		"""
+		Read `size` bytes from the CODE region starting at DPTR, using the
+		block-read command of the proxy (requires CAP_BLOCK_RW)
+		"""
+		return self._readBlock(CMD_CODE_RD, size)
+
+	def writeBlockXDATA(self, data):
+		"""
+		Write the given bytes in the XDATA region starting at DPTR, using the
+		block-write command of the proxy (requires CAP_BLOCK_RW)
+		"""
+
+		# Split in chunks the proxy can buffer
+		iOfs = 0
+		while iOfs < len(data):
+			iLen = min(len(data) - iOfs, BLOCK_WR_MAX)
+
+			# On the upgraded link the data are the payload of the packet
+			if self.linkReliable:
+				(status, bH, bL, payload) = self.exchangePackets([ (CMD_XDATA_WR, (iLen >> 8) & 0xFF, iLen & 0xFF, 0,
+					bytearray(data[iOfs:iOfs+iLen])) ])[0]
+				self.decodeFrame(bytearray([status, bH, bL]))
+				iOfs += iLen
+				continue
+
+			# Prepare for block transmission
+			ans = self.sendFrame(CMD_XDATA_WR, (iLen >> 8) & 0xFF, iLen & 0xFF)
+			if ans != ANS_READY:
+				raise IOError("Unable to prepare for block-write! (Unknown response 0x%02x)" % ans)
+
+			# Send data & wait for completion
+			self._write(CMD_XDATA_WR, bytearray(data[iOfs:iOfs+iLen]))
+			self.readFrame()
+			iOfs += iLen
+
+		# Return bytes written
+		return len(data)
+
+	def _readBlock(self, cmd, size):
+		"""
+		Issue block-read commands until `size` bytes are collected
+		"""
+		ans = bytearray()
+		while len(ans) < size:
+			iLen = min(size - len(ans), BLOCK_RD_MAX)
+
+			# On the upgraded link the data are the payload of the response
+			if self.linkReliable:
+				iLen = min(iLen, PKT_PAYLOAD_MAX)
+				(status, bH, bL, payload) = self.exchangePackets([ (cmd, (iLen >> 8) & 0xFF, iLen & 0xFF, 0) ])[0]
+				self.decodeFrame(bytearray([status, bH, bL]))
+				ans += payload
+				continue
+
+			# The data bytes are streamed before the status frame
+			self.writeFrame(cmd, (iLen >> 8) & 0xFF, iLen & 0xFF)
+			data = self._read(cmd, iLen)
+			if len(data) < iLen:
+				raise IOError("Could not read from the serial port!")
+			frame = self._read(cmd, 3, roundTrip=False)
+			if len(frame) < 3:
+				raise IOError("Could not read from the serial port!")
+			self.decodeFrame(frame)
+
+			# Collect data
+			ans += data
+
+		# Return data
+		return ans
+
 	def chipErase(self):
 		"""
 		Perform a chip erase
@@ -358,13 +1267,12 @@ class CCLibProxy:
 		self.debugStatus = self.sendFrame(CMD_CHPERASE)
 
 		# Wait until CHIP_ERASE_BUSY goes down
-		s = self.getStatus()
-		while (( s & 0x80 ) != 0):
-			time.sleep(0.01)
-			s = self.getStatus()
+		def erased():
+			self.debugStatus = self.getStatus()
+			return ( self.debugStatus & 0x80 ) == 0
+		self.waitFor( 'chipErase', erased )
 
 		# We are good
-		self.debugStatus = s
 		return self.debugStatus
 
 	def getInstructionTableVersion(self):
@@ -373,6 +1281,17 @@ class CCLibProxy:
 		"""
 		return self.sendFrame(CMD_INSTR_VER)
 
+	def getCapabilities(self):
+		"""
+		Get the capability flags (CAP_*) of the CCLib_proxy firmware
+		"""
+
+		# Older firmware does not know this command and responds with an error
+		ans = self.sendFrame(CMD_CAPS, raiseException=False)
+		if ans < 0:
+			return 0
+		return ans
+
 	def updateInstructionTable(self, version, instr):
 		"""
 		Update CC.Debugger instruction table
@@ -389,20 +1308,26 @@ class CCLibProxy:
 		if len(table) < 16:
 			table += [0] * (16 - len(table))
 
-		# Express our interest to update the instruction table
-		ans = self.sendFrame(CMD_INSTR_UPD)
-		if ans != ANS_READY:
-			raise IOError("Unable to prepare for instruction table update! (Unknown response 0x%02x)" % ans)
+		# On the upgraded link the table is the payload of the packet
+		if self.linkReliable:
+			(status, bH, bL, payload) = self.exchangePackets([ (CMD_INSTR_UPD, 0, 0, 0,
+				bytearray([ b & 0xFF for b in table ])) ])[0]
+			newVersion = self.decodeFrame(bytearray([status, bH, bL]))
 
-		# Start sending data
-		for b in table:
-			self.ser.write(chr(b & 0xFF))
-		self.ser.flush()
+		else:
+
+			# Express our interest to update the instruction table
+			ans = self.sendFrame(CMD_INSTR_UPD)
+			if ans != ANS_READY:
+				raise IOError("Unable to prepare for instruction table update! (Unknown response 0x%02x)" % ans)
+
+			# Start sending data
+			self._write(CMD_INSTR_UPD, bytearray([ b & 0xFF for b in table ]))
 
-		# Get confirmation
-		newVersion = self.readFrame()
+			# Get confirmation
+			newVersion = self.readFrame()
 		if newVersion != version:
-			raise IOError("Unable to update the instruction table! (Unknown response 0x%02x)" % ans)
+			raise IOError("Unable to update the instruction table! (Unknown response 0x%02x)" % newVersion)
 
 		# Return new version
 		self.instructionTableVersion = newVersion
@@ -0,0 +1,317 @@
+#
+# CCLib_proxy Interface Library for High-Level operations
+# Copyright (c) 2014-2016 Ioannis Charalampidis
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+from __future__ import print_function
+import atexit
+import json
+import time
+
+# Trace files start with this magic, followed by the length of a JSON header
+TRACE_MAGIC = b"CCTRACE1"
+
+# Trace record types
+REC_WRITE = ord('W')   # Bytes written to the proxy
+REC_READ  = ord('R')   # Bytes read from the proxy
+REC_SHORT = ord('T')   # The previous read timed out before all bytes arrived
+REC_RESET = ord('X')   # Input buffer discarded
+REC_BAUD  = ord('B')   # Baud rate changed (the payload is the new rate as text)
+
+def encodeVarint(value):
+	"""
+	Encode an unsigned integer in the 7-bits-per-byte format of the trace
+	"""
+	ans = bytearray()
+	while value >= 0x80:
+		ans.append((value & 0x7F) | 0x80)
+		value >>= 7
+	ans.append(value)
+	return ans
+
+def decodeVarint(data, ofs):
+	"""
+	Decode an unsigned integer at the given offset & return it together with
+	the offset that follows it
+	"""
+	value = 0
+	shift = 0
+	while True:
+		if ofs >= len(data):
+			raise IOError("Truncated trace file")
+		b = data[ofs]
+		ofs += 1
+		value |= (b & 0x7F) << shift
+		shift += 7
+		if not (b & 0x80):
+			return (value, ofs)
+
+def readTrace(filename):
+	"""
+	Load a trace file & return a tuple with its header and the list of its
+	(type, timestamp, data) records, the timestamps being in seconds since
+	the start of the trace
+	"""
+	with open(filename, "rb") as f:
+		data = bytearray(f.read())
+	if bytes(data[0:len(TRACE_MAGIC)]) != TRACE_MAGIC:
+		raise IOError("%s is not a CCLib trace file" % filename)
+
+	# Read header
+	(size, ofs) = decodeVarint(data, len(TRACE_MAGIC))
+	header = json.loads(data[ofs:ofs+size].decode('utf-8'))
+	ofs += size
+
+	# Read records
+	records = []
+	timestamp = 0
+	while ofs < len(data):
+		recType = data[ofs]
+		(delta, ofs) = decodeVarint(data, ofs + 1)
+		(size, ofs) = decodeVarint(data, ofs)
+		if ofs + size > len(data):
+			raise IOError("Truncated trace file")
+		timestamp += delta
+		records.append( (recType, timestamp / 1000000.0, data[ofs:ofs+size]) )
+		ofs += size
+
+	return (header, records)
+
+class CCTraceRecorder:
+	"""
+	Stand-in for the serial port of a CCLibProxy that forwards everything to
+	the real port, logging all the traffic with microsecond timestamps in a
+	compact binary trace file.
+
+	Every record is a type byte, the time since the previous record and the
+	size of the data (both as varints), followed by the data.
+	"""
+
+	def __init__(self, ser, filename, **meta):
+		"""
+		Start recording the traffic of the given (open) serial port
+		"""
+		self.ser = ser
+		self.filename = filename
+		self.file = open(filename, "wb")
+		self.started = time.time()
+		self.lastTimestamp = 0
+
+		# Write header
+		meta = dict(meta, created=time.strftime("%Y-%m-%dT%H:%M:%S"), port=getattr(ser, 'port', None),
+			baudrate=getattr(ser, 'baudrate', None))
+		header = json.dumps(meta).encode('utf-8')
+		self.file.write(TRACE_MAGIC + bytes(encodeVarint(len(header))) + header)
+
+		# Make sure everything ends up on disk
+		atexit.register(self.close)
+
+	def __getattr__(self, name):
+		"""
+		Forward everything else to the serial port
+		"""
+		return getattr(self.ser, name)
+
+	def _record(self, recType, data):
+		"""
+		Append a record to the trace
+		"""
+		if self.file is None:
+			return
+		timestamp = int((time.time() - self.started) * 1000000)
+		self.file.write( bytes(bytearray([recType]) + encodeVarint(max(0, timestamp - self.lastTimestamp))
+			+ encodeVarint(len(data)) + bytearray(data)) )
+		self.lastTimestamp = max(timestamp, self.lastTimestamp)
+
+	@property
+	def baudrate(self):
+		return self.ser.baudrate
+
+	@baudrate.setter
+	def baudrate(self, value):
+		self.ser.baudrate = value
+		self._record(REC_BAUD, str(value).encode('ascii'))
+
+	@property
+	def timeout(self):
+		return self.ser.timeout
+
+	@timeout.setter
+	def timeout(self, value):
+		self.ser.timeout = value
+
+	def write(self, data):
+		"""
+		Write & log the given bytes
+		"""
+		self._record(REC_WRITE, data)
+		return self.ser.write(data)
+
+	def read(self, size=1):
+		"""
+		Read & log up to `size` bytes
+		"""
+		data = self.ser.read(size)
+		self._record(REC_READ, data)
+		if len(data) < size:
+			self._record(REC_SHORT, b'')
+		return data
+
+	def reset_input_buffer(self):
+		"""
+		Discard the pending input
+		"""
+		self.ser.reset_input_buffer()
+		self._record(REC_RESET, b'')
+
+	def close(self):
+		"""
+		Stop recording (the serial port stays open)
+		"""
+		if self.file is not None:
+			self.file.close()
+			self.file = None
+
+class CCTraceReplay:
+	"""
+	Serial port stand-in that serves the responses of a recorded trace back,
+	without any hardware. The bytes written are checked against the recording
+	(as a stream, so they may be split differently), raising an IOError on the
+	first difference.
+
+	Unless `realtime` is set, the responses are served immediately, so the
+	time a session takes is the time spent on the host. Otherwise every
+	response is delayed as much as it was during the recording, and the time
+	spent waiting is accumulated in `deviceTime`.
+	"""
+
+	def __init__(self, filename, realtime=False):
+		"""
+		Load the trace to replay
+		"""
+		(self.header, self.records) = readTrace(filename)
+		self.port = "replay:%s" % filename
+		self.realtime = realtime
+		self.baudrate = self.header.get('baudrate', 115200)
+		self.timeout = None
+		self.deviceTime = 0.0
+
+		# Position in the trace
+		self.index = 0
+		self.offset = 0
+		self.lastWrite = (0.0, time.time())
+
+	def _next(self):
+		"""
+		Skip the consumed records & the ones that don't affect the stream, and
+		return the current one (or None at the end of the trace)
+		"""
+		while self.index < len(self.records):
+			rec = self.records[self.index]
+			if (rec[0] == REC_BAUD) or ((rec[0] in (REC_WRITE, REC_READ)) and (self.offset >= len(rec[2]))):
+				self.index += 1
+				self.offset = 0
+				continue
+			return rec
+		return None
+
+	def write(self, data):
+		"""
+		Compare the given bytes with the recorded ones
+		"""
+		data = bytearray(data)
+		ofs = 0
+		while ofs < len(data):
+			rec = self._next()
+
+			# A read that timed out during the recording is not an error here
+			if (rec is not None) and (rec[0] == REC_SHORT):
+				self.index += 1
+				continue
+			if (rec is None) or (rec[0] != REC_WRITE):
+				raise IOError("Trace mismatch at record %i: unexpected write of %i bytes" % (self.index, len(data) - ofs))
+
+			# Compare data
+			size = min(len(data) - ofs, len(rec[2]) - self.offset)
+			if data[ofs:ofs+size] != rec[2][self.offset:self.offset+size]:
+				raise IOError("Trace mismatch at record %i: wrote %s instead of %s" % (self.index,
+					"".join([ "%02x" % b for b in data[ofs:ofs+size] ]),
+					"".join([ "%02x" % b for b in rec[2][self.offset:self.offset+size] ])))
+			self.offset += size
+			ofs += size
+			self.lastWrite = (rec[1], time.time())
+		return len(data)
+
+	def read(self, size=1):
+		"""
+		Return up to `size` of the recorded response bytes, stopping short
+		(like a timeout) where the recording did
+		"""
+		ans = bytearray()
+		while len(ans) < size:
+			rec = self._next()
+			if (rec is not None) and (rec[0] == REC_SHORT):
+				self.index += 1
+				break
+			if (rec is None) or (rec[0] != REC_READ):
+				break
+
+			# Wait as long as the proxy took to respond
+			if self.realtime and (self.offset == 0):
+				delay = (rec[1] - self.lastWrite[0]) - (time.time() - self.lastWrite[1])
+				if delay > 0:
+					time.sleep(delay)
+					self.deviceTime += delay
+
+			# Collect data
+			chunk = rec[2][self.offset:self.offset + size - len(ans)]
+			ans += chunk
+			self.offset += len(chunk)
+
+		return bytes(ans)
+
+	def reset_input_buffer(self):
+		"""
+		Discard the rest of the recorded input up to the matching reset
+		"""
+		rec = self._next()
+		while (rec is not None) and (rec[0] in (REC_READ, REC_SHORT)):
+			self.index += 1
+			self.offset = 0
+			rec = self._next()
+		if (rec is not None) and (rec[0] == REC_RESET):
+			self.index += 1
+
+	def flush(self):
+		"""
+		Nothing to flush
+		"""
+		pass
+
+	def close(self):
+		"""
+		Nothing to close
+		"""
+		pass
+
+	def finished(self):
+		"""
+		Check if the whole trace was replayed
+		"""
+		rec = self._next()
+		while (rec is not None) and (rec[0] in (REC_SHORT, REC_RESET)):
+			self.index += 1
+			rec = self._next()
+		return rec is None
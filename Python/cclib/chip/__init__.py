@@ -16,7 +16,8 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
-from cclib.ccproxy import CCLibProxy
+from cclib.ccproxy import CCLibProxy, CAP_BLOCK_RW, CAP_BRUST_RLE
+from cclib.ccflash import crc16, isBlank
 
 class ChipDriver(CCLibProxy):
 	"""
@@ -24,6 +25,12 @@ class ChipDriver(CCLibProxy):
 	in order to have a simple API all the way to the serial port.
 	"""
 
+	# The XDATA address where the SFRs are mapped
+	sfrXDATA = 0x7000
+
+	# If the CRCs of the flash are computed on the chip (see getCODECRCs)
+	onChipCRC = False
+
 	def __init__(self, proxy):
 		"""
 		Construct a new chip driver
@@ -31,6 +38,9 @@ class ChipDriver(CCLibProxy):
 		# Initialize proxy subclass
 		CCLibProxy.__init__(self, parent=proxy)
 
+		# The name the flash contents are cached under (see cacheDevice)
+		self.flashDevice = None
+
 	@staticmethod
 	def test(cls, chipID):
 		"""
@@ -50,6 +60,32 @@ class ChipDriver(CCLibProxy):
 		"""
 		raise NotImplementedError("This function is not implemented!")
 
+	def timingName(self):
+		"""
+		The learned timings are kept by chip name
+		"""
+		return self.chipName()
+
+	def dryRun(self, baudrate=115200, latency=None):
+		"""
+		Return a driver for an emulated copy of this chip (blank, apart from the
+		pages we know are erased), on a proxy link with the given baud rate and
+		latency. Running an operation on it issues exactly the commands it would
+		issue here without touching the hardware, and its getStats() predict
+		the frames, brust bytes, polls and time it would take (the latency
+		defaults to EMU_LATENCY).
+		"""
+		from cclib.ccemulator import createEmulator, EMU_LATENCY
+		if latency is None:
+			latency = EMU_LATENCY
+		emulator = createEmulator(self.chipName(), flash=int(self.flashSize / 1024), baudrate=baudrate,
+			latency=latency, capabilities=self.capabilities & (CAP_BLOCK_RW | CAP_BRUST_RLE))
+		inst = self.__class__(proxy=CCLibProxy(emulator))
+		inst.initialize()
+		inst.erasedPages.update(self.erasedPages)
+		inst.resetStats()
+		return inst
+
 	###############################################
 	# Interface Functions
 	###############################################
@@ -66,11 +102,25 @@ class ChipDriver(CCLibProxy):
 		"""
 		raise NotImplementedError("This function is not implemented!")
 
+	def setPC(self, address):
+		"""
+		Set the program counter (the CPU must be halted)
+		"""
+		return self.instr( 0x02, (address >> 8) & 0xFF, address & 0xFF )	# LJMP addr16
+
 	def pauseDMA(self, pause):
 		"""
 		Pause/Unpause DMA in debug mode
 		"""
-		raise NotImplementedError("This function is not implemented!")
+		# Get current debug config
+		a = self.readConfig()
+		# Update
+		if pause:
+			a |= 0x4
+		else:
+			a &= ~0x4
+		# Commit
+		self.writeConfig(a)
 
 	def readCODE( self, offset, size ):
 		"""
@@ -78,12 +128,270 @@ class ChipDriver(CCLibProxy):
 		"""
 		raise NotImplementedError("This function is not implemented!")
 
-	def writeCODE(self, offset, data, erase=False, verify=False, showProgress=False):
+	def iterCODE( self, offset, size, chunkSize=0x1000 ):
+		"""
+		Read the CODE region in chunks of `chunkSize` bytes (the last one can be
+		shorter), yielding them as they arrive
+		"""
+		while size > 0:
+			iLen = min( size, chunkSize )
+			yield self.readCODE( offset, iLen )
+			offset += iLen
+			size -= iLen
+
+	def writeCODE(self, offset, data, erase=False, verify=False, showProgress=False, stub=False):
 		"""
-		Fully automated function for writing the Flash memory.
+		Fully automated function for writing the Flash memory (through a
+		RAM-resident programming routine if `stub` is set and the chip has one).
+		The written data are verified by their CRC if `verify` is True, or by
+		reading them back if it is 'read' (see verifyCODE).
 		"""
 		raise NotImplementedError("This function is not implemented!")
 
+	def getCODECRCs(self, offset, size, count=1):
+		"""
+		Return the CRC-16 (see crc16 in ccflash.py) of `count` consecutive
+		blocks of `size` bytes from the given CODE offset. Here they are computed
+		on the data read back, the chip drivers that can compute them on the
+		chip override this.
+		"""
+		return [ crc16(self.readCODE(offset + i * size, size)) for i in range(0, count) ]
+
+	def getPageCRCs(self, page, count):
+		"""
+		Return the CRC-16 of the given flash pages
+		"""
+		return self.getCODECRCs( page * self.flashPageSize, self.flashPageSize, count )
+
+	def getUsedPages(self, page, count):
+		"""
+		Return the numbers of the given flash pages that are not blank. Here the
+		pages are read back, the chip drivers that can scan them on the chip
+		override this.
+		"""
+		blank = bytearray(b'\xFF' * self.flashPageSize)
+		return [ p for p in range(page, page + count) if self.readCODE(p * self.flashPageSize, self.flashPageSize) != blank ]
+
+	def verifyCODE(self, offset, data, verify=True):
+		"""
+		Check that the flash at the given offset holds the given data, or raise
+		an IOError with the offset of the first wrong byte. Unless `verify` is
+		'read', the CRC of the data in each flash bank is compared first and
+		only the banks where it differs are read back.
+		"""
+		iOfs = 0
+		while iOfs < len(data):
+
+			# Up to the end of the bank
+			fAddr = offset + iOfs
+			iLen = min( len(data) - iOfs, (int(fAddr / 0x8000) + 1) * 0x8000 - fAddr )
+			block = bytearray(data[iOfs:iOfs+iLen])
+
+			# Locate the first wrong byte
+			if (verify == 'read') or (self.getCODECRCs(fAddr, iLen)[0] != crc16(block)):
+				verifyBytes = self.readCODE(fAddr, iLen)
+				for i in range(0, iLen):
+					if verifyBytes[i] != block[i]:
+						raise IOError("Flash verification error on offset 0x%04x" % (fAddr + i))
+			iOfs += iLen
+
+	def writeCODEDiff(self, pages, verify=False, showProgress=False, stub=False):
+		"""
+		Erase & program only the flash pages whose CRC differs from the CRC of
+		the given contents (a dictionary of the page number to the page bytes,
+		see CCHEXFile.pages), and return the list of the pages written.
+		"""
+
+		# Split the pages in runs of consecutive ones
+		runs = []
+		for page in sorted(pages.keys()):
+			if runs and (runs[-1][-1] == page - 1):
+				runs[-1].append(page)
+			else:
+				runs.append([ page ])
+
+		# Pick the pages that changed, comparing only their CRCs
+		changed = []
+		for run in runs:
+			crcs = self.getPageCRCs( run[0], len(run) )
+			for (page, crc) in zip(run, crcs):
+				if crc16(pages[page]) != crc:
+					changed.append(page)
+
+		# Erase & program them (again in runs, for fewer writeCODE calls)
+		runs = []
+		for page in changed:
+			self.erasePage(page)
+			if runs and (runs[-1][-1] == page - 1):
+				runs[-1].append(page)
+			else:
+				runs.append([ page ])
+		for run in runs:
+			if showProgress:
+				print(" -> 0x%04x : %i changed pages " % (run[0] * self.flashPageSize, len(run)))
+			data = bytearray()
+			for page in run:
+				data += pages[page]
+			self.writeCODE( run[0] * self.flashPageSize, data, verify=verify, showProgress=showProgress, stub=stub )
+
+		return changed
+
+	def chipErase(self):
+		"""
+		Perform a chip erase & remember that all the flash pages are blank
+		"""
+		ans = CCLibProxy.chipErase(self)
+		self.erasedPages.update( range(0, int(self.flashSize / self.flashPageSize)) )
+		self.flashCache.forget( self.cacheDevice() )
+		return ans
+
+	###############################################
+	# Flash content cache
+	###############################################
+
+	def cacheDevice(self):
+		"""
+		Return the name the flash contents of this device are cached under
+		"""
+		if self.flashDevice is None:
+			self.flashDevice = "%04x-%s" % (self.chipID, self.getSerial())
+		return self.flashDevice
+
+	def getCachedPage(self, page, crc):
+		"""
+		Return the cached contents of the given flash page if they have the
+		given CRC (as computed on the chip), or None
+		"""
+		return self.flashCache.get( self.cacheDevice(), page, crc )
+
+	def cacheCODE(self, offset, data):
+		"""
+		Update the cached flash pages with data just written (the partially
+		written pages only if they are cached)
+		"""
+		device = self.cacheDevice()
+		pages = self.flashCache.pages( device )
+		iOfs = 0
+		while iOfs < len(data):
+			fAddr = offset + iOfs
+			page = int(fAddr / self.flashPageSize)
+			pOfs = fAddr - page * self.flashPageSize
+			iLen = min( len(data) - iOfs, self.flashPageSize - pOfs )
+			if iLen == self.flashPageSize:
+				self.flashCache.put( device, page, data[iOfs:iOfs+iLen] )
+			elif page in pages:
+				pageData = bytearray(pages[page][1])
+				pageData[pOfs:pOfs+iLen] = data[iOfs:iOfs+iLen]
+				self.flashCache.put( device, page, pageData )
+			iOfs += iLen
+
+	def readCODECached(self, offset, size):
+		"""
+		Like readCODE, but the flash pages whose CRC (computed on the chip) is
+		the CRC of their cached copy are not read again. The pages read are
+		cached.
+		"""
+		if not self.onChipCRC or (size <= 0):
+			return self.readCODE( offset, size )
+		device = self.cacheDevice()
+		first = int(offset / self.flashPageSize)
+		last = int((offset + size - 1) / self.flashPageSize)
+		crcs = self.getPageCRCs( first, last - first + 1 )
+
+		ans = bytearray()
+		page = first
+		while page <= last:
+
+			# Read the run of the pages that are not cached at once
+			end = page
+			while (end <= last) and (self.flashCache.get( device, end, crcs[end - first] ) is None):
+				end += 1
+			if end > page:
+				data = self.readCODE( page * self.flashPageSize, (end - page) * self.flashPageSize )
+				for p in range(page, end):
+					self.flashCache.put( device, p, data[(p - page) * self.flashPageSize:(p - page + 1) * self.flashPageSize] )
+				ans += data
+				page = end
+			else:
+				ans += self.flashCache.get( device, page, crcs[page - first] )
+				page += 1
+
+		offset -= first * self.flashPageSize
+		return ans[offset:offset + size]
+
+	###############################################
+	# Register shadow cache
+	###############################################
+
+	def getShadow(self, key):
+		"""
+		Return the value of a register or DMA descriptor as we last read or
+		wrote it, or None if we don't know it (or the CPU is running). The keys
+		are ('sfr', address), ('xdata', address) and ('dma', address), plus
+		('routine', address) for routines kept resident in the SRAM (with
+		their size as the value).
+		"""
+		if self.cpuRunning:
+			return None
+		return self.shadow.get(key)
+
+	def setShadow(self, key, value):
+		"""
+		Remember the value of a register or DMA descriptor (only while the CPU
+		is halted, since it could change them otherwise)
+		"""
+		if not self.cpuRunning:
+			self.shadow[key] = value
+
+	def forgetShadowXDATA(self, offset, size):
+		"""
+		Forget the shadowed registers, DMA descriptors & routines in the given
+		XDATA range (including the SFRs mapped there at `sfrXDATA`)
+		"""
+		for key in list(self.shadow.keys()):
+			(space, addr) = key
+			if space == 'sfr':
+				addr += self.sfrXDATA
+			if space == 'routine':
+				end = addr + self.shadow[key]
+			else:
+				end = addr + (8 if space == 'dma' else 1)
+			if (addr < offset + size) and (end > offset):
+				del self.shadow[key]
+
+	def isErasedBlock(self, offset, data):
+		"""
+		Check if the given data are all 0xFF and they fall on flash pages known
+		to be erased, in which case there is no need to program them
+		"""
+		if not data or not isBlank(data):
+			return False
+		for page in range(int(offset / self.flashPageSize), int((offset + len(data) - 1) / self.flashPageSize) + 1):
+			if not page in self.erasedPages:
+				return False
+		return True
+
+	def skipBlankBlock(self, offset, block, erase=False):
+		"""
+		Check if the given block can be skipped while writing the flash, and
+		count it in `elidedPages` if so. Erasing is all it takes for a blank
+		block (its page is erased here if `erase` is set), and nothing at all
+		if it falls on erased pages.
+		"""
+		if erase and block and isBlank(block):
+			self.erasePage( int(offset / self.flashPageSize) )
+		if self.isErasedBlock( offset, block ):
+			self.elidedPages += 1
+			return True
+		return False
+
+	def markWritten(self, offset, size):
+		"""
+		Forget that the flash pages in the given range are erased
+		"""
+		for page in range(int(offset / self.flashPageSize), int((offset + size - 1) / self.flashPageSize) + 1):
+			self.erasedPages.discard(page)
+
 	def readXDATA( self, offset, size ):
 		"""
 		Read any size of buffer from the XDATA region
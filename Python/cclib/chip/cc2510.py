@@ -19,14 +19,57 @@
 #
 from __future__ import print_function
 from cclib.chip import ChipDriver
+from cclib.ccproxy import CAP_BLOCK_RW
 import sys
-import time
+
+# The registers only the debugger changes while the CPU is halted (MEMCTR,
+# DMA1CFG, DMA0CFG & DMAARM), which are kept in the shadow cache
+SHADOW_SFRS = ( 0xC7, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6 )
+
+# The flash routine is kept resident at the start of the SRAM (it runs from
+# the same address in CODE), followed by the data of the pages it programs
+FLASH_ROUTINE = 0xF000
+FLASH_BUFFER = 0xF040
+
+# The flash routine (see http://www.ti.com/lit/ug/swra124/swra124.pdf page 11).
+# It programs R4 consecutive 1KB pages (erasing them first if R2 is not zero)
+# from the data at DPTR, starting with the page at FADDRH = R3, & stops.
+FLASH_ROUTINE_CODE = [
+	0x8B, 0xAD,							# 00: pageLoop:	MOV FADDRH,R3
+	0x75, 0xAC, 0x00,					# 02:		MOV FADDRL,#00H
+	0xEA,								# 05:		MOV A,R2
+	0x60, 0x08,							# 06:		JZ write
+	0x75, 0xAE, 0x01,					# 08:		MOV FCTL,#01H ; ERASE
+	0xE5, 0xAE,							# 0B: eraseWait:	MOV A,FCTL
+	0x20, 0xE7, 0xFB,					# 0D:		JB ACC.7,eraseWait ; BUSY
+	0x7F, 0x02,							# 10: write:	MOV R7,#HIGH(0x400 / 2)
+	0x7E, 0x00,							# 12:		MOV R6,#LOW(0x400 / 2)
+	0x75, 0xAE, 0x02,					# 14:		MOV FCTL,#02H ; WRITE
+	0x7D, 0x02,							# 17: writeLoop:	MOV R5,#2
+	0xE0,								# 19: writeWordLoop:	MOVX A,@DPTR
+	0xA3,								# 1A:		INC DPTR
+	0xF5, 0xAF,							# 1B:		MOV FWDATA,A
+	0xDD, 0xFA,							# 1D:		DJNZ R5,writeWordLoop
+	0xE5, 0xAE,							# 1F: writeWait:	MOV A,FCTL
+	0x20, 0xE6, 0xFB,					# 21:		JB ACC.6,writeWait ; SWBSY
+	0xDE, 0xF1,							# 24:		DJNZ R6,writeLoop
+	0xDF, 0xEF,							# 26:		DJNZ R7,writeLoop
+	0xE5, 0xAE,							# 28: busyWait:	MOV A,FCTL
+	0x20, 0xE7, 0xFB,					# 2A:		JB ACC.7,busyWait ; BUSY
+	0x0B,								# 2D:		INC R3
+	0x0B,								# 2E:		INC R3
+	0xDC, 0xCF,							# 2F:		DJNZ R4,pageLoop
+	0xA5,								# 31:		DB 0xA5 ; (breakpoint)
+]
 
 class CC2510(ChipDriver):
 	"""
 	Chip-specific code for CC2510 SOC
 	"""
 
+	# The XDATA address where the SFRs are mapped
+	sfrXDATA = 0xDF00
+
 	@staticmethod
 	def test(chipID):
 		"""
@@ -88,35 +131,43 @@ class CC2510(ChipDriver):
 		"""
 
 		# Setup DPTR
-		a = self.instri( 0x90, offset )		# MOV DPTR,#data16
+		self.queueInstri( 0x90, offset )	# MOV DPTR,#data16
 
-		# Prepare ans array
-		ans = bytearray()
+		# Let the proxy run the read loop if it can
+		if self.capabilities & CAP_BLOCK_RW:
+			return self.readBlockXDATA(size)
 
-		# Read bytes
+		# Queue byte reads
+		ans = []
 		for i in range(0, size):
-			a = self.instr ( 0xE0 )			# MOVX A,@DPTR
-			ans.append(a)
-			a = self.instr ( 0xA3 )			# INC DPTR
+			ans.append( self.queueInstr( 0xE0 ) )	# MOVX A,@DPTR
+			self.queueInstr( 0xA3 )			# INC DPTR
 
-		# Return ans
-		return ans
+		# Collect responses
+		self.flushQueue()
+		return bytearray([ a.result() for a in ans ])
 
 	def writeXDATA( self, offset, bytes ):
 		"""
 		Write any size of buffer in the XDATA region
 		"""
+		self.forgetShadowXDATA( offset, len(bytes) )
 
 		# Setup DPTR
-		a = self.instri( 0x90, offset )		# MOV DPTR,#data16
+		self.queueInstri( 0x90, offset )	# MOV DPTR,#data16
+
+		# Let the proxy run the write loop if it can
+		if self.capabilities & CAP_BLOCK_RW:
+			return self.writeBlockXDATA(bytes)
 
-		# Read bytes
+		# Queue byte writes
 		for b in bytes:
-			a = self.instr ( 0x74, b )		# MOV A,#data
-			a = self.instr ( 0xF0 )			# MOVX @DPTR,A
-			a = self.instr ( 0xA3 )			# INC DPTR
+			self.queueInstr( 0x74, b )		# MOV A,#data
+			self.queueInstr( 0xF0 )			# MOVX @DPTR,A
+			self.queueInstr( 0xA3 )			# INC DPTR
 
-		# Return bytes written
+		# Wait for completion
+		self.flushQueue()
 		return len(bytes)
 
 	def readCODE( self, offset, size ):
@@ -132,34 +183,47 @@ class CC2510(ChipDriver):
 		offset -= fBank * 0x8000
 
 		# Setup DPTR
-		a = self.instri( 0x90, offset )		# MOV DPTR,#data16
+		self.queueInstri( 0x90, offset )	# MOV DPTR,#data16
 
-		# Prepare ans array
-		ans = bytearray()
+		# Let the proxy run the read loop if it can
+		if self.capabilities & CAP_BLOCK_RW:
+			return self.readBlockCODE(size)
 
-		# Read bytes
+		# Queue byte reads
+		ans = []
 		for i in range(0, size):
-			a = self.instr ( 0xE4 )			# MOVX A,@DPTR
-			a = self.instr ( 0x93 )			# MOVX A,@DPTR
-			ans.append(a)
-			a = self.instr ( 0xA3 )			# INC DPTR
+			self.queueInstr( 0xE4 )			# CLR A
+			ans.append( self.queueInstr( 0x93 ) )	# MOVC A,@A+DPTR
+			self.queueInstr( 0xA3 )			# INC DPTR
 
-
-		#
-		return ans
+		# Collect responses
+		self.flushQueue()
+		return bytearray([ a.result() for a in ans ])
 
 
 	def getRegister( self, reg ):
 		"""
-		Return the value of the given register
+		Return the value of the given register (from the shadow cache, for the
+		registers in SHADOW_SFRS that we already know)
 		"""
-		return self.instr( 0xE5, reg )		# MOV A,direct
+		a = self.getShadow( ('sfr', reg) )
+		if a is None:
+			a = self.instr( 0xE5, reg )		# MOV A,direct
+			if reg in SHADOW_SFRS:
+				self.setShadow( ('sfr', reg), a )
+		return a
 
 	def setRegister( self, reg, v ):
 		"""
-		Update the value of the
+		Update the value of the given register (unless the shadow cache says
+		it already has this value)
 		"""
-		return self.instr( 0x75, reg, v )	# MOV direct,#data
+		if self.getShadow( ('sfr', reg) ) == v:
+			return v
+		a = self.instr( 0x75, reg, v )	# MOV direct,#data
+		if reg in SHADOW_SFRS:
+			self.setShadow( ('sfr', reg), v )
+		return a
 
 	def selectXDATABank(self, bank):
 		"""
@@ -168,7 +232,7 @@ class CC2510(ChipDriver):
 		#a = self.getRegister( 0xC7 )
 		#a = (a & 0xF8) | (bank & 0x07)
 		#return self.setRegister( 0xC7, a )
-		return self.instr(0x75, 0xC7, bank*16 + 1);
+		return self.setRegister( 0xC7, bank*16 + 1 )
 
 
 	def selectFlashBank(self, bank):
@@ -249,125 +313,92 @@ class CC2510(ChipDriver):
 	###############################################
 
 	def readFlashPage(self, address):
-		if (not self.debug_active):
-			print("ERROR: not in debug mode! did you forget a enter() call?\n")
-			sys.exit(2)
+		"""
+		Return the flash page at the given address
+		"""
 		return self.readCODE(address & 0x7FFFF, self.flashPageSize)
 
 	def writeFlashPage(self, address, inputArray, erase_page=True):
+		"""
+		Program the flash page at the given address (erasing it first)
+		"""
 		if len(inputArray) != self.flashPageSize:
 			raise IOError("input data size != flash page size!")
+		return self.writeFlashPages(address, inputArray, erase_page)
 
-		if (not self.debug_active):
-			print("ERROR: not in debug mode! did you forget a enter() call?\n")
-			sys.exit(2)
-
-		#calc words per flash page
-		words_per_flash_page = self.flashPageSize / self.flashWordSize
-
-		#print "words_per_flash_page = %d" % (words_per_flash_page)
-		#print "flashWordSize = %d" % (self.flashWordSize)
-		if (erase_page):
-			print("[page erased]", end=' ')
-
-		routine8_1 = [
-			#see http://www.ti.com/lit/ug/swra124/swra124.pdf page 11
-			0x75, 0xAD, ((address >> 8) / self.flashWordSize) & 0x7E, 	#MOV FADDRH, #imm;
-			0x75, 0xAC, 0x00						#MOV FADDRL, #00;
-		]
-		routine8_erase = [
-			0x75, 0xAE, 0x01,						#MOV FLC, #01H; // ERASE
-			#; Wait for flash erase to complete
-			0xE5, 0xAE,							#eraseWaitLoop:  MOV A, FLC;
-			0x20, 0xE7, 0xFB						#JB ACC_BUSY, eraseWaitLoop;
-		]
-		routine8_2 = [
-			#; Initialize the data pointer
-			0x90, 0xF0, 0x00,						#MOV DPTR, #0F000H;
-			#; Outer loops
-			0x7F, (((words_per_flash_page)>>8)&0xFF),			#MOV R7, #imm;
-			0x7E, ((words_per_flash_page)&0xFF),				#MOV R6, #imm;
-			0x75, 0xAE, 0x02,						#MOV FLC, #02H; // WRITE
-			#; Inner loops
-			0x7D, self.flashWordSize,					#writeLoop:          MOV R5, #imm;
-			0xE0,								#writeWordLoop:          MOVX A, @DPTR;
-			0xA3,								#INC DPTR;
-			0xF5, 0xAF,							#MOV FWDATA, A;
-			0xDD, 0xFA,							#DJNZ R5, writeWordLoop;
-			#; Wait for completion
-			0xE5, 0xAE,							#writeWaitLoop:      MOV A, FLC;
-			0x20, 0xE6, 0xFB,						#JB ACC_SWBSY, writeWaitLoop;
-			0xDE, 0xF1,							#DJNZ R6, writeLoop;
-			0xDF, 0xEF,							#DJNZ R7, writeLoop;
-			#set green led for debugging info (DO NOT USE THIS!)
-			#LED_GREEN_DIR |= (1<<LED_GREEN_PIN);
-			#0x43, 0xFF, 0x18,	#      [24]  935         orl     _P2DIR,#0x10
-			#LED_GREEN_PORT = (1<<LED_GREEN_PIN);
-			#0x75, 0xA0, 0x18,	#      [24]  937         mov     _P2,#0x10
-			#; Done with writing, fake a breakpoint in order to HALT the cpu
-			0xA5								#DB 0xA5;
-		]
-
-		#build routine
-		routine = routine8_1
-		if (erase_page):
-			routine += routine8_erase
-		routine += routine8_2
-
-		#add led code to flash code (for debugging)
-		#aroutine = led_routine + routine
-		#routine = routine + led_routine
-
-		#for x in routine:
-		#	print "%02X" % (x),
-
-		#halt CPU
-		self.halt()
-
-		#send data to xdata memory:
-		if (self.show_debug_info): print("copying data to xdata")
-		self.writeXDATA(0xF000, inputArray)
-
-		#send program to xdata mem
-		if (self.show_debug_info): print("copying flash routine to xdata")
-		self.writeXDATA(0xF000 + self.flashPageSize, routine)
-
-		if (self.show_debug_info): print("executing code")
-		#execute MOV MEMCTR, (bank * 16) + 1;
-		self.instr(0x75, 0xC7, 0x51)
-
-		#set PC to start of program
-		self.setPC(0xF000 + self.flashPageSize)
-
-		#start program exec, will continue after routine exec due to breakpoint
-		self.resume()
-
-
-		if (self.show_debug_info): print("page write running", end=' ')
-
-		#set some timeout (2 seconds)
-		timeout = 200
-		while (timeout > 0):
-			#show progress
-			if (self.show_debug_info):
-				print(".", end=' ')
-				sys.stdout.flush()
-			#check status (bit 0x20 = cpu halted)
-			if ((self.getStatus() & 0x20 ) != 0):
-				if (self.show_debug_info): print("done")
-				break
-			#timeout increment
-			timeout -= 1
-			#delay (10ms)
-			time.sleep(0.01)
+	def getFlashPagesPerRun(self):
+		"""
+		Return how many pages the flash routine programs in one run: as many as
+		fit after it in the SRAM (the internal RAM is in its last 256 bytes)
+		"""
+		return int((0xF000 + self.sramSize - 0x100 - FLASH_BUFFER) / self.flashPageSize)
 
+	def writeFlashPages(self, address, data, erase=True):
+		"""
+		Program the consecutive flash pages at the given address (erasing them
+		first) through the resident flash routine. It is uploaded once, and
+		stays in the SRAM until something else is written there or the CPU
+		runs anything else. The data of as many pages as fit in the SRAM are
+		uploaded with writeXDATA, and programmed in a single run.
 
-		if (timeout <=0):
-			raise IOError("flash write timed out!")
+		The CPU registers are overwritten, while the program counter & MEMCTR
+		are restored.
+		"""
+		if (address % self.flashPageSize) or (len(data) % self.flashPageSize):
+			raise IOError("The data must cover entire flash pages!")
+		page = int(address / self.flashPageSize)
+		pages = int(len(data) / self.flashPageSize)
+		perRun = self.getFlashPagesPerRun()
 
-		self.halt()
+		# Keep what the routine changes (running it forgets the erased pages)
+		pc = self.getPC()
+		memctr = self.getRegister( 0xC7 )
+		erasedPages = set(self.erasedPages)
 
-		if (self.show_debug_info): print("done")
+		iOfs = 0
+		while pages > 0:
+			count = min( pages, perRun )
+
+			# Upload the routine unless it is still there, & the page data
+			if self.getShadow( ('routine', FLASH_ROUTINE) ) is None:
+				self.writeXDATA( FLASH_ROUTINE, FLASH_ROUTINE_CODE )
+			self.writeXDATA( FLASH_BUFFER, data[iOfs:iOfs+count*self.flashPageSize] )
+
+			# Pass the pages & run the routine
+			self.setRegister( 0xC7, 0x51 )
+			self.instr( 0x90, FLASH_BUFFER >> 8, FLASH_BUFFER & 0xFF )	# MOV DPTR,#FLASH_BUFFER
+			self.instr( 0x7C, count )									# MOV R4,#count
+			self.instr( 0x7B, (page << 1) & 0xFF )						# MOV R3,#FADDRH
+			self.instr( 0x7A, 1 if erase else 0 )						# MOV R2,#erase
+			self.setPC( FLASH_ROUTINE )
+			self.resume()
+
+			# Wait until it reaches its breakpoint (the time it takes is learned
+			# per page)
+			if not self.waitFor( 'flashRoutine', lambda: (self.getStatus() & 0x20) != 0, scale=count, timeout=2.0 * count ):
+				raise IOError("Flash write timed out!")
+			self.halt()
+
+			# Remember that the routine is still resident
+			self.setShadow( ('routine', FLASH_ROUTINE), len(FLASH_ROUTINE_CODE) )
+
+			page += count
+			pages -= count
+			iOfs += count * self.flashPageSize
+
+		# Restore the CPU state & the pages we know are erased
+		self.setRegister( 0xC7, memctr )
+		self.setPC( pc )
+		self.erasedPages.update( erasedPages )
+		self.markWritten( address, len(data) )
+
+		# Programming pages that were not erased clears the bits of what they
+		# had, so we only know what the erased ones hold
+		if erase:
+			self.cacheCODE( address, data )
+		else:
+			for p in range(int(address / self.flashPageSize), page):
+				self.flashCache.forget( self.cacheDevice(), p )
 
 
 	###############################################
@@ -384,16 +415,18 @@ class CC2510(ChipDriver):
 		cLow = (address & 0xFF)
 
 		# Place in FADDRH:FADDRL
-		self.writeXDATA( 0x6271, [cLow, cHigh])
+		self.setRegister( 0xAC, cLow )
+		self.setRegister( 0xAD, cHigh )
 
 	def isFlashFull(self):
 		"""
-		Check if the FULL bit is set in the flash register
+		Check if the SWBSY bit is set in the flash register (the CC251x
+		equivalent of FULL)
 		"""
 
 		# Read flash status register
-		a = self.readXDATA(0x6270, 1)
-		return (a[0] & 0x40 != 0)
+		a = self.getRegister( 0xAE )
+		return (a & 0x40 != 0)
 
 	def isFlashBusy(self):
 		"""
@@ -401,8 +434,8 @@ class CC2510(ChipDriver):
 		"""
 
 		# Read flash status register
-		a = self.readXDATA(0x6270, 1)
-		return (a[0] & 0x80 != 0)
+		a = self.getRegister( 0xAE )
+		return (a & 0x80 != 0)
 
 	def isFlashAbort(self):
 		"""
@@ -410,8 +443,8 @@ class CC2510(ChipDriver):
 		"""
 
 		# Read flash status register
-		a = self.readXDATA(0x6270, 1)
-		return (a[0] & 0x20 != 0)
+		a = self.getRegister( 0xAE )
+		return (a & 0x20 != 0)
 
 	def clearFlashStatus(self):
 		"""
@@ -419,9 +452,8 @@ class CC2510(ChipDriver):
 		"""
 
 		# Read & mask-out status register bits
-		a = self.readXDATA(0x6270, 1)
-		a[0] &= 0x1F
-		return self.writeXDATA(0x6270, a)
+		a = self.getRegister( 0xAE )
+		return self.setRegister( 0xAE, a & 0x1F )
 
 	def setFlashWrite(self):
 		"""
@@ -429,9 +461,8 @@ class CC2510(ChipDriver):
 		"""
 
 		# Set flash WRITE bit
-		a = self.readXDATA(0x6270, 1)
-		a[0] |= 0x02
-		return self.writeXDATA(0x6270, a)
+		a = self.getRegister( 0xAE )
+		return self.setRegister( 0xAE, a | 0x02 )
 
 	def setFlashErase(self):
 		"""
@@ -439,119 +470,74 @@ class CC2510(ChipDriver):
 		"""
 
 		# Set flash ERASE bit
-		a = self.readXDATA(0x6270, 1)
-		a[0] |= 0x01
-		return self.writeXDATA(0x6270, a)
+		a = self.getRegister( 0xAE )
+		return self.setRegister( 0xAE, a | 0x01 )
+
+	def erasePage(self, page):
+		"""
+		Erase the given flash page & wait for completion
+		"""
+
+		# Select the page to erase using FADDRH[7:1]
+		self.setFlashWordOffset( int(page * self.flashPageSize / self.flashWordSize) )
+		# Set the erase bit
+		self.setFlashErase()
+		# Wait until flash is not busy any more
+		self.waitFor( 'erasePage', lambda: not self.isFlashBusy() )
+
+		# The page is now blank
+		self.erasedPages.add(page)
+		self.flashCache.put( self.cacheDevice(), page, b'\xFF' * self.flashPageSize )
 
-	def writeCODE(self, offset, data, erase=False, verify=False, showProgress=False):
+	def writeCODE(self, offset, data, erase=False, verify=False, showProgress=False, stub=False):
 		"""
-		Fully automated function for writing the Flash memory.
+		Fully automated function for writing the Flash memory, through the
+		resident flash routine in runs of as many consecutive pages as fit in
+		the SRAM (see writeFlashPages). The pages the data fall on partially
+		are padded with 0xFF, which keeps what they had unless they are erased.
 
-		WARNING: This requires DMA operations to be unpaused ( use: self.pauseDMA(False) )
+		Blocks of 0xFF bytes that fall on pages known to be erased are skipped,
+		and their number is kept in `elidedPages`. There is no other way to
+		program this chip (it can't brust-write), so `stub` is ignored.
 		"""
 
-		# Prepare DMA-0 for DEBUG -> RAM (using DBG_BW trigger)
-		self.configDMAChannel( 0, 0x6260, 0x0000, 0x1F, tlen=self.bulkBlockSize, srcInc=0, dstInc=1, priority=1, interrupt=True )
-		# Prepare DMA-1 for RAM -> FLASH (using the FLASH trigger)
-		self.configDMAChannel( 1, 0x0000, 0x6273, 0x12, tlen=self.bulkBlockSize, srcInc=1, dstInc=0, priority=2, interrupt=True )
+		# Pad the data to entire pages
+		start = offset - offset % self.flashPageSize
+		pageData = bytearray([0xFF] * (offset - start)) + bytearray(data)
+		pageData += bytearray([0xFF] * (-len(pageData) % self.flashPageSize))
 
-		# Reset flags
-		self.clearFlashStatus()
-		self.clearDMAIRQ(0)
-		self.clearDMAIRQ(1)
-		self.disarmDMAChannel(0)
-		self.disarmDMAChannel(1)
-		flashRetries = 0
+		# Pick the pages to program (erasing is all it takes for a blank page,
+		# and nothing at all if it's already erased)
+		pages = []
+		self.elidedPages = 0
+		for iOfs in range(0, len(pageData), self.flashPageSize):
+			if self.skipBlankBlock( start + iOfs, pageData[iOfs:iOfs+self.flashPageSize], erase ):
+				continue
+			pages.append( iOfs )
 
-		# Split in 2048-byte chunks
-		iOfs = 0
-		while (iOfs < len(data)):
+		# Program them in runs of consecutive pages
+		perRun = self.getFlashPagesPerRun()
+		while pages:
+			iOfs = pages[0]
+			count = 1
+			while (count < min(len(pages), perRun)) and (pages[count] == iOfs + count * self.flashPageSize):
+				count += 1
+			pages = pages[count:]
 
 			# Check if we should show progress
 			if showProgress:
-				print("\r    Progress %0.0f%%... " % (iOfs*100/len(data)), end=' ')
+				print("\r    Progress %0.0f%%... " % (iOfs*100/len(pageData)), end=' ')
 				sys.stdout.flush()
 
-			# Get next page
-			iLen = min( len(data) - iOfs, self.bulkBlockSize )
-
-			# Update DMA configuration if we have less than bulk-block size data
-			if (iLen < self.bulkBlockSize):
-				self.configDMAChannel( 0, 0x6260, 0x0000, 0x1F, tlen=iLen, srcInc=0, dstInc=1, priority=1, interrupt=True )
-				self.configDMAChannel( 1, 0x0000, 0x6273, 0x12, tlen=iLen, srcInc=1, dstInc=0, priority=2, interrupt=True )
-
-			# Upload to RAM through DMA-0
-			self.armDMAChannel(0)
-			self.brustWrite( data[iOfs:iOfs+iLen] )
-
-			# Wait until DMA-0 raises interrupt
-			while not self.isDMAIRQ(0):
-				time.sleep(0.010)
-
-			# Clear DMA IRQ flag
-			self.clearDMAIRQ(0)
-
-			# Calculate the page where this data belong to
-			fAddr = offset + iOfs
-			fPage = int( fAddr / self.flashPageSize )
-
-			# Calculate FLASH address High/Low bytes
-			# for writing (addressable as 32-bit words)
-			fWordOffset = int(fAddr / 4)
-			cHigh = (fWordOffset >> 8) & 0xFF
-			cLow = fWordOffset & 0xFF
-			self.writeXDATA( 0x6271, [cLow, cHigh] )
-
-			# Debug
-			#print "[@%04x: p=%i, ofs=%04x, %02x:%02x]" % (fAddr, fPage, fWordOffset, cHigh, cLow),
-			#sys.stdout.flush()
-
-			# Check if we should erase page first
-			if erase:
-				# Select the page to erase using FADDRH[7:1]
-				#
-				# NOTE: Specific to (CC2530, CC2531, CC2540, and CC2541),
-				#       the CC2533 uses FADDRH[6:0]
-				#
-				cHigh = (fPage << 1)
-				cLow = 0
-				self.writeXDATA( 0x6271, [cLow, cHigh] )
-				# Set the erase bit
-				self.setFlashErase()
-				# Wait until flash is not busy any more
-				while self.isFlashBusy():
-					time.sleep(0.010)
-
-			# Upload to FLASH through DMA-1
-			self.armDMAChannel(1)
-			self.setFlashWrite()
-
-			# Wait until DMA-1 raises interrupt
-			while not self.isDMAIRQ(1):
-				# Also check for errors
-				if self.isFlashAbort():
-					self.disarmDMAChannel(1)
-					raise IOError("Flash page 0x%02x is locked!" % fPage)
-				time.sleep(0.010)
-
-			# Clear DMA IRQ flag
-			self.clearDMAIRQ(1)
-
-			# Check if we should verify
-			if verify:
-				verifyBytes = self.readCODE(fAddr, iLen)
-				for i in range(0, iLen):
-					if verifyBytes[i] != data[iOfs+i]:
-						if flashRetries < 3:
-							print("\n[Flash Error at @0x%04x, will retry]" % (fAddr+i))
-							flashRetries += 1
-							continue
-						else:
-							raise IOError("Flash verification error on offset 0x%04x" % (fAddr+i))
-			flashRetries = 0
-
-			# Forward to next page
-			iOfs += iLen
+			self.writeFlashPages( start + iOfs, pageData[iOfs:iOfs+count*self.flashPageSize], erase )
+
+		# Check if we should verify (writeFlashPages already updated the
+		# cached pages)
+		if verify:
+			self.verifyCODE(offset, data, verify)
 
 		if showProgress:
-			print("\r    Progress 100%... OK")
+			if self.elidedPages:
+				print("\r    Progress 100%%... OK (%i blank pages skipped)" % self.elidedPages)
+			else:
+				print("\r    Progress 100%... OK")
@@ -19,8 +19,187 @@
 #
 from __future__ import print_function
 from cclib.chip import ChipDriver
+from cclib.ccproxy import CAP_BLOCK_RW
 import sys
-import time
+
+# The registers only the debugger changes while the CPU is halted (FMAP,
+# MEMCTR, DMA1CFG, DMA0CFG & DMAARM), which are kept in the shadow cache
+SHADOW_SFRS = ( 0x9F, 0xC7, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6 )
+
+# RAM layout of the flash programming routine (see CC254X.writeCODEStub): two
+# buffers for a 4-byte header & a bulk block each, the DMA-0 descriptors for
+# them, the DMA-1 descriptor, the status byte & the routine itself, which runs
+# from CODE address 0x8000 + STUB_CODE once MEMCTR.XMAP maps the SRAM there
+STUB_BUFFERS = ( 0x0000, 0x0810 )
+STUB_DESC = 0x1020
+STUB_STATUS = 0x1038
+STUB_CODE = 0x1040
+STUB_RUN = 0x8000 + STUB_CODE
+
+# The block header flags (in the high byte of the length)
+STUB_ERASE = 0x80
+STUB_LAST = 0x40
+
+# The flash programming routine. It waits for DMA-0 to fill a buffer with a
+# block & its header ([FADDRL] [FADDRH] [flags|LENH] [LENL]), points DMA-0 to
+# the other buffer & stops at a breakpoint, so we can resume it and send the
+# next block while it erases the page (if asked to) and programs this block
+# through DMA-1. After the last block it waits for the flash write to complete,
+# sets STUB_STATUS to 0x01 (| 0x20 if the flash controller aborted) & stops.
+FLASH_STUB = [
+	0x7F, 0x00,					# 00:		MOV R7,#0 ; Buffer 0 first
+	0x80, 0x0F,					# 02:		SJMP waitFill
+								#		done:
+	0x90, 0x62, 0x70,			# 04:		MOV DPTR,#FCTL
+	0xE0,						# 07:		MOVX A,@DPTR
+	0x54, 0x20,					# 08:		ANL A,#0x20 ; ABORT
+	0x44, 0x01,					# 0A:		ORL A,#0x01
+	0x90, (STUB_STATUS >> 8), (STUB_STATUS & 0xFF),
+								# 0C:		MOV DPTR,#STUB_STATUS
+	0xF0,						# 0F:		MOVX @DPTR,A
+	0xA5,						# 10:		DB 0xA5 ; Breakpoint
+	0x80, 0xFE,					# 11:		SJMP $
+								#		waitFill:
+	0xE5, 0xD1,					# 13:		MOV A,DMAIRQ
+	0x30, 0xE0, 0xFB,			# 15:		JNB ACC.0,waitFill
+	0x75, 0xD1, 0xFE,			# 18:		MOV DMAIRQ,#0xFE
+								#		waitPrevious:
+	0x90, 0x62, 0x70,			# 1B:		MOV DPTR,#FCTL
+	0xE0,						# 1E:		MOVX A,@DPTR
+	0x20, 0xE7, 0xF9,			# 1F:		JB ACC.7,waitPrevious ; BUSY
+	0x20, 0xE5, 0xDF,			# 22:		JB ACC.5,done ; ABORT
+	0xEF,						# 25:		MOV A,R7
+	0x70, 0x09,					# 26:		JNZ buffer1
+	0x90, (STUB_BUFFERS[0] >> 8), (STUB_BUFFERS[0] & 0xFF),
+								# 28:		MOV DPTR,#STUB_BUFFERS[0]
+	0x7E, ((STUB_BUFFERS[0] + 4) >> 8),
+								# 2B:		MOV R6,#HIGH(STUB_BUFFERS[0] + 4)
+	0x79, ((STUB_BUFFERS[0] + 4) & 0xFF),
+								# 2D:		MOV R1,#LOW(STUB_BUFFERS[0] + 4)
+	0x80, 0x07,					# 2F:		SJMP header
+								#		buffer1:
+	0x90, (STUB_BUFFERS[1] >> 8), (STUB_BUFFERS[1] & 0xFF),
+								# 31:		MOV DPTR,#STUB_BUFFERS[1]
+	0x7E, ((STUB_BUFFERS[1] + 4) >> 8),
+								# 34:		MOV R6,#HIGH(STUB_BUFFERS[1] + 4)
+	0x79, ((STUB_BUFFERS[1] + 4) & 0xFF),
+								# 36:		MOV R1,#LOW(STUB_BUFFERS[1] + 4)
+								#		header:
+	0xE0, 0xFA, 0xA3,			# 38:		MOVX A,@DPTR ; MOV R2,A ; INC DPTR
+	0xE0, 0xFB, 0xA3,			# 3B:		MOVX A,@DPTR ; MOV R3,A ; INC DPTR
+	0xE0, 0xFC, 0xA3,			# 3E:		MOVX A,@DPTR ; MOV R4,A ; INC DPTR
+	0xE0, 0xFD,					# 41:		MOVX A,@DPTR ; MOV R5,A
+	0xEC,						# 43:		MOV A,R4
+	0x20, 0xE6, 0x15,			# 44:		JB ACC.6,erase ; Last block
+	0xEF,						# 47:		MOV A,R7
+	0x70, 0x08,					# 48:		JNZ armBuffer0
+	0x75, 0xD4, ((STUB_DESC + 8) & 0xFF),
+								# 4A:		MOV DMA0CFGL,#LOW(STUB_DESC + 8)
+	0x75, 0xD5, ((STUB_DESC + 8) >> 8),
+								# 4D:		MOV DMA0CFGH,#HIGH(STUB_DESC + 8)
+	0x80, 0x06,					# 50:		SJMP arm
+								#		armBuffer0:
+	0x75, 0xD4, (STUB_DESC & 0xFF),
+								# 52:		MOV DMA0CFGL,#LOW(STUB_DESC)
+	0x75, 0xD5, (STUB_DESC >> 8),
+								# 55:		MOV DMA0CFGH,#HIGH(STUB_DESC)
+								#		arm:
+	0x43, 0xD6, 0x01,			# 58:		ORL DMAARM,#0x01
+	0xA5,						# 5B:		DB 0xA5 ; Ready for the next block
+								#		erase:
+	0x90, 0x62, 0x71,			# 5C:		MOV DPTR,#FADDRL
+	0xEA, 0xF0, 0xA3,			# 5F:		MOV A,R2 ; MOVX @DPTR,A ; INC DPTR
+	0xEB, 0xF0,					# 62:		MOV A,R3 ; MOVX @DPTR,A
+	0x90, 0x62, 0x70,			# 64:		MOV DPTR,#FCTL
+	0xEC,						# 67:		MOV A,R4
+	0x30, 0xE7, 0x0A,			# 68:		JNB ACC.7,program
+	0xE0,						# 6B:		MOVX A,@DPTR
+	0x54, 0x1C,					# 6C:		ANL A,#0x1C
+	0x44, 0x01,					# 6E:		ORL A,#0x01 ; ERASE
+	0xF0,						# 70:		MOVX @DPTR,A
+								#		waitErase:
+	0xE0,						# 71:		MOVX A,@DPTR
+	0x20, 0xE7, 0xFC,			# 72:		JB ACC.7,waitErase
+								#		program:
+	0x90, ((STUB_DESC + 16) >> 8), ((STUB_DESC + 16) & 0xFF),
+								# 75:		MOV DPTR,#(STUB_DESC + 16)
+	0xEE, 0xF0, 0xA3,			# 78:		MOV A,R6 ; MOVX @DPTR,A ; INC DPTR
+	0xE9, 0xF0, 0xA3,			# 7B:		MOV A,R1 ; MOVX @DPTR,A ; INC DPTR
+	0xA3, 0xA3,					# 7E:		INC DPTR ; INC DPTR
+	0xEC, 0x54, 0x1F, 0xF0,		# 80:		MOV A,R4 ; ANL A,#0x1F ; MOVX @DPTR,A
+	0xA3, 0xED, 0xF0,			# 84:		INC DPTR ; MOV A,R5 ; MOVX @DPTR,A
+	0x75, 0xD1, 0xFD,			# 87:		MOV DMAIRQ,#0xFD
+	0x43, 0xD6, 0x02,			# 8A:		ORL DMAARM,#0x02
+	0x90, 0x62, 0x70,			# 8D:		MOV DPTR,#FCTL
+	0xE0,						# 90:		MOVX A,@DPTR
+	0x54, 0x1C,					# 91:		ANL A,#0x1C
+	0x44, 0x02,					# 93:		ORL A,#0x02 ; WRITE
+	0xF0,						# 95:		MOVX @DPTR,A
+	0xEC,						# 96:		MOV A,R4
+	0x20, 0xE6, 0x07,			# 97:		JB ACC.6,finish ; Last block
+	0xEF, 0x64, 0x01, 0xFF,		# 9A:		MOV A,R7 ; XRL A,#1 ; MOV R7,A
+	0x02, ((STUB_RUN + 0x13) >> 8), ((STUB_RUN + 0x13) & 0xFF),
+								# 9E:		LJMP waitFill
+								#		finish:
+	0xE0,						# A1:		MOVX A,@DPTR
+	0x20, 0xE5, 0x08,			# A2:		JB ACC.5,finished ; ABORT
+	0x20, 0xE7, 0xF9,			# A5:		JB ACC.7,finish ; BUSY
+	0xE5, 0xD1,					# A8:		MOV A,DMAIRQ
+	0x30, 0xE1, 0xF4,			# AA:		JNB ACC.1,finish
+								#		finished:
+	0x02, ((STUB_RUN + 0x04) >> 8), ((STUB_RUN + 0x04) & 0xFF),
+								# AD:		LJMP done
+]
+
+# RAM layout of the CRC & blank scan routines (see CC254X.runBlockRoutine):
+# the table of up to CRC_ENTRIES results & the routine, again running from CODE
+CRC_TABLE = 0x1100
+CRC_ENTRIES = 16
+CRC_CODE = 0x1120
+CRC_RUN = 0x8000 + CRC_CODE
+
+# The CRC routine. For each of the R5 blocks starting at XDATA address DPTR (in
+# the flash bank mapped by MEMCTR.XBANK), with R3:R2 being the loop counters of
+# their size, it feeds the block bytes to the CRC-16 of the random number
+# generator, appends the result (RNDL, RNDH) to the table at MPAGE:R1 and then
+# stops at a breakpoint.
+CRC_STUB = [
+								#		block:
+	0x75, 0xBC, 0xFF,			# 00:		MOV RNDL,#0xFF
+	0x75, 0xBC, 0xFF,			# 03:		MOV RNDL,#0xFF ; CRC = 0xFFFF
+	0xEA, 0xFE,					# 06:		MOV A,R2 ; MOV R6,A
+	0xEB, 0xFF,					# 08:		MOV A,R3 ; MOV R7,A
+								#		byte:
+	0xE0,						# 0A:		MOVX A,@DPTR
+	0xF5, 0xBD,					# 0B:		MOV RNDH,A
+	0xA3,						# 0D:		INC DPTR
+	0xDE, 0xFA,					# 0E:		DJNZ R6,byte
+	0xDF, 0xF8,					# 10:		DJNZ R7,byte
+	0xE5, 0xBC, 0xF3, 0x09,		# 12:		MOV A,RNDL ; MOVX @R1,A ; INC R1
+	0xE5, 0xBD, 0xF3, 0x09,		# 16:		MOV A,RNDH ; MOVX @R1,A ; INC R1
+	0xDD, 0xE4,					# 1A:		DJNZ R5,block
+	0xA5,						# 1C:		DB 0xA5 ; Breakpoint
+	0x80, 0xFE,					# 1D:		SJMP $
+]
+
+# The blank scan routine. Like CRC_STUB, but it appends the AND of all the
+# bytes of each block to the table, which is 0xFF only for the blank ones.
+BLANK_STUB = [
+								#		block:
+	0xEA, 0xFE,					# 00:		MOV A,R2 ; MOV R6,A
+	0xEB, 0xFF,					# 02:		MOV A,R3 ; MOV R7,A
+	0x7C, 0xFF,					# 04:		MOV R4,#0xFF
+								#		byte:
+	0xE0,						# 06:		MOVX A,@DPTR
+	0x5C, 0xFC,					# 07:		ANL A,R4 ; MOV R4,A
+	0xA3,						# 09:		INC DPTR
+	0xDE, 0xFA,					# 0A:		DJNZ R6,byte
+	0xDF, 0xF8,					# 0C:		DJNZ R7,byte
+	0xEC, 0xF3, 0x09,			# 0E:		MOV A,R4 ; MOVX @R1,A ; INC R1
+	0xDD, 0xED,					# 11:		DJNZ R5,block
+	0xA5,						# 13:		DB 0xA5 ; Breakpoint
+	0x80, 0xFE,					# 14:		SJMP $
+]
 
 # From the SWRU191F user guide, section 3.6, CHIPID register
 chipIDs = {
@@ -41,11 +220,54 @@ def getChipName(chipID):
 	return chipIDs[shortID]
 
 
+def dmaDescriptor(srcAddr, dstAddr, trigger, vlen=0, tlen=1, word=False,
+	transferMode=0, srcInc=0, dstInc=0, interrupt=False, m8=True, priority=0):
+	"""
+	Build the 8-byte DMA configuration data structure
+	"""
+
+	# Calculate numeric flags
+	nword = 0
+	if word:
+		nword = 1
+	nirq = 0
+	if interrupt:
+		nirq = 1
+	nm8 = 1
+	if m8:
+		nm8 = 0
+
+	# Prepare DMA configuration bytes
+	config = [
+		(srcAddr >> 8) & 0xFF,		# 0: SRCADDR[15:8]
+		(srcAddr & 0xFF),			# 1: SRCADDR[7:0]
+		(dstAddr >> 8) & 0xFF,		# 2: DESTADDR[15:8]
+		(dstAddr & 0xFF),			# 3: DESTADDR[7:0]
+		(vlen & 0x07) << 5 |		# 4: VLEN[2:0]
+		((tlen >> 8) & 0x1F),		# 4: LEN[12:8]
+		(tlen & 0xFF),				# 5: LEN[7:0]
+		(nword << 7) |				# 6: WORDSIZE
+		(transferMode << 5) |		# 6: TMODE[1:0]
+		(trigger & 0x1F),			# 6: TRIG[4:0]
+		((srcInc & 0x03) << 6) |	# 7: SRCINC[1:0]
+		((dstInc & 0x03) << 4) |	# 7: DESTINC[1:0]
+		(nirq << 3) |				# 7: IRQMASK
+		(nm8 << 2) |				# 7: M8
+		(priority & 0x03)			# 7: PRIORITY[1:0]
+	]
+
+	# Return configuration bytes
+	return config
+
+
 class CC254X(ChipDriver):
 	"""
 	Chip-specific code for CC253X and CC2540/41 SOC
 	"""
 
+	# The flash CRCs are computed by CRC_STUB
+	onChipCRC = True
+
 	@staticmethod
 	def test(chipID):
 		"""
@@ -95,6 +317,9 @@ class CC254X(ChipDriver):
 		self.sramSize = self.chipInfo['sram'] * 1024
 		self.bulkBlockSize = 0x800
 
+		# Buffers of this size or more are written in XDATA through DMA
+		self.dmaWriteThreshold = 64
+
 
 	###############################################
 	# Data reading
@@ -106,64 +331,186 @@ class CC254X(ChipDriver):
 		"""
 
 		# Setup DPTR
-		a = self.instri( 0x90, offset )		# MOV DPTR,#data16
+		self.queueInstri( 0x90, offset )	# MOV DPTR,#data16
+		return self.readDPTR( size )
 
-		# Prepare ans array
-		ans = bytearray()
+	def readDPTR( self, size ):
+		"""
+		Read `size` bytes from the XDATA region starting at DPTR (which is left
+		right after them)
+		"""
+
+		# Let the proxy run the read loop if it can
+		if self.capabilities & CAP_BLOCK_RW:
+			return self.readBlockXDATA(size)
 
-		# Read bytes
+		# Queue byte reads
+		ans = []
 		for i in range(0, size):
-			a = self.instr ( 0xE0 )			# MOVX A,@DPTR
-			ans.append(a)
-			a = self.instr ( 0xA3 )			# INC DPTR
+			ans.append( self.queueInstr( 0xE0 ) )	# MOVX A,@DPTR
+			self.queueInstr( 0xA3 )			# INC DPTR
 
-		# Return ans
-		return ans
+		# Collect responses
+		self.flushQueue()
+		return bytearray([ a.result() for a in ans ])
 
 	def writeXDATA( self, offset, bytes ):
 		"""
 		Write any size of buffer in the XDATA region
 		"""
+		self.forgetShadowXDATA( offset, len(bytes) )
+
+		# Large buffers are much faster to brust-write through DMA
+		if len(bytes) >= self.dmaWriteThreshold:
+			return self.writeXDATADMA( offset, bytes )
 
 		# Setup DPTR
-		a = self.instri( 0x90, offset )		# MOV DPTR,#data16
+		self.queueInstri( 0x90, offset )	# MOV DPTR,#data16
+
+		# Let the proxy run the write loop if it can
+		if self.capabilities & CAP_BLOCK_RW:
+			return self.writeBlockXDATA(bytes)
 
-		# Read bytes
+		# Queue byte writes
 		for b in bytes:
-			a = self.instr ( 0x74, b )		# MOV A,#data
-			a = self.instr ( 0xF0 )			# MOVX @DPTR,A
-			a = self.instr ( 0xA3 )			# INC DPTR
+			self.queueInstr( 0x74, b )		# MOV A,#data
+			self.queueInstr( 0xF0 )			# MOVX @DPTR,A
+			self.queueInstr( 0xA3 )			# INC DPTR
 
-		# Return bytes written
+		# Wait for completion
+		self.flushQueue()
 		return len(bytes)
 
+	def writeXDATADMA( self, offset, data ):
+		"""
+		Write any size of buffer in the XDATA region by brust-writing it into
+		DMA channel 0 (DBG_BW trigger), in bulk-block size chunks. The DMA
+		descriptor area, the channel configuration and the DMA pause flag of
+		the debug configuration are restored afterwards.
+		"""
+		data = bytearray(data)
+		self.forgetShadowXDATA( offset, len(data) )
+
+		# Let the DMA run while the CPU is halted
+		config = self.readConfig()
+		if config & 0x04:
+			self.writeConfig( config & ~0x04 )
+
+		# Save the DMA-0 configuration pointer & IRQ flag
+		cfgLow = self.getRegister( 0xD4 )
+		cfgHigh = self.getRegister( 0xD5 )
+		irq = self.getRegister( 0xD1 )
+
+		saved = {}
+		iOfs = 0
+		while (iOfs < len(data)):
+			iLen = min( len(data) - iOfs, self.bulkBlockSize )
+			addr = offset + iOfs
+
+			# Place the descriptor where this chunk does not go (a chunk can't
+			# overlap both places) & keep what was there
+			memBase = 0x1000
+			if (addr < memBase + 8) and (addr + iLen > memBase):
+				memBase = 0x1E00
+			if not memBase in saved:
+				saved[memBase] = self.readXDATA( memBase, 8 )
+
+			# Move the chunk from DEBUG to its place through DMA-0
+			self.configDMAChannel( 0, 0x6260, addr, 0x1F, tlen=iLen, srcInc=0, dstInc=1, priority=1, interrupt=True, memBase=memBase )
+			self.clearDMAIRQ(0)
+			self.armDMAChannel(0)
+			self.brustWrite( data[iOfs:iOfs+iLen] )
+
+			# Wait until DMA-0 raises interrupt
+			self.waitFor( 'brustDMA', lambda: self.isDMAIRQ(0) )
+
+			iOfs += iLen
+
+		# Restore the descriptor areas (unless we just wrote there), DMA-0 &
+		# the debug configuration
+		for (memBase, descriptor) in saved.items():
+			for i in range(0, 8):
+				if offset <= memBase + i < offset + len(data):
+					descriptor[i] = data[memBase + i - offset]
+			self.writeXDATA( memBase, descriptor )
+		self.setRegister( 0xD4, cfgLow )
+		self.setRegister( 0xD5, cfgHigh )
+		self.setRegister( 0xD1, 0xFE | (irq & 0x01) )
+		if config & 0x04:
+			self.writeConfig( config )
+
+		return len(data)
+
 	def readCODE( self, offset, size ):
 		"""
 		Read any size of buffer from the XDATA+0x8000 (code-mapped) region
 		"""
 
-		# Pick the code bank this code chunk belongs to
-		fBank = int(offset / 0x8000 )
-		self.selectXDATABank( fBank )
+		ans = bytearray()
+		while size > 0:
 
-		# Recalibrate offset
-		offset -= fBank * 0x8000
+			# Pick the code bank this code chunk belongs to
+			fBank = int(offset / 0x8000 )
+			self.selectXDATABank( fBank )
 
-		# Read XDATA-mapped CODE region
-		return self.readXDATA( 0x8000 + offset, size )
+			# Read up to the end of the bank from the XDATA-mapped CODE region
+			iLen = min( size, (fBank + 1) * 0x8000 - offset )
+			ans += self.readXDATA( 0x8000 + offset - fBank * 0x8000, iLen )
+			offset += iLen
+			size -= iLen
 
+		return ans
+
+	def iterCODE( self, offset, size, chunkSize=0x1000 ):
+		"""
+		Read the CODE region in chunks of `chunkSize` bytes (the last one can be
+		shorter), yielding them as they arrive. The XDATA bank & DPTR are only
+		set up at the 32Kb boundaries, since DPTR carries on from the previous
+		chunk, so the driver should not be used in between.
+		"""
+		chunk = bytearray()
+		bank = None
+		while size > 0:
+
+			# Map the code bank this chunk continues in
+			fBank = int(offset / 0x8000)
+			if fBank != bank:
+				bank = fBank
+				self.selectXDATABank( fBank )
+				self.queueInstri( 0x90, 0x8000 + offset - fBank * 0x8000 )	# MOV DPTR,#data16
+
+			# Read up to the end of the chunk or the bank
+			iLen = min( size, chunkSize - len(chunk), (fBank + 1) * 0x8000 - offset )
+			chunk += self.readDPTR( iLen )
+			offset += iLen
+			size -= iLen
+			if (len(chunk) == chunkSize) or (size == 0):
+				yield chunk
+				chunk = bytearray()
 
 	def getRegister( self, reg ):
 		"""
-		Return the value of the given register
+		Return the value of the given register (from the shadow cache, for the
+		registers in SHADOW_SFRS that we already know)
 		"""
-		return self.instr( 0xE5, reg )		# MOV A,direct
+		a = self.getShadow( ('sfr', reg) )
+		if a is None:
+			a = self.instr( 0xE5, reg )		# MOV A,direct
+			if reg in SHADOW_SFRS:
+				self.setShadow( ('sfr', reg), a )
+		return a
 
 	def setRegister( self, reg, v ):
 		"""
-		Update the value of the
+		Update the value of the given register (unless the shadow cache says
+		it already has this value)
 		"""
-		return self.instr( 0x75, reg, v )	# MOV direct,#data
+		if self.getShadow( ('sfr', reg) ) == v:
+			return v
+		a = self.instr( 0x75, reg, v )	# MOV direct,#data
+		if reg in SHADOW_SFRS:
+			self.setShadow( ('sfr', reg), v )
+		return a
 
 	def selectXDATABank(self, bank):
 		"""
@@ -251,20 +598,6 @@ class CC254X(ChipDriver):
 	# DMA functions
 	###############################################
 
-	def pauseDMA(self, pause):
-		"""
-		Pause/Unpause DMA in debug mode
-		"""
-		# Get current debug config
-		a = self.readConfig()
-		# Update
-		if pause:
-			a |= 0x4
-		else:
-			a &= ~0x4
-		# Commit
-		self.writeConfig(a)
-
 	def configDMAChannel(self, index, srcAddr, dstAddr, trigger, vlen=0, tlen=1,
 		word=False, transferMode=0, srcInc=0, dstInc=0, interrupt=False, m8=True,
 		priority=0, memBase=0x1000):
@@ -272,39 +605,17 @@ class CC254X(ChipDriver):
 		Create a DMA buffer and place it in memory
 		"""
 
-		# Calculate numeric flags
-		nword = 0
-		if word:
-			nword = 1
-		nirq = 0
-		if interrupt:
-			nirq = 1
-		nm8 = 1
-		if m8:
-			nm8 = 0
-
 		# Prepare DMA configuration bytes
-		config = [
-			(srcAddr >> 8) & 0xFF,		# 0: SRCADDR[15:8]
-			(srcAddr & 0xFF),			# 1: SRCADDR[7:0]
-			(dstAddr >> 8) & 0xFF,		# 2: DESTADDR[15:8]
-			(dstAddr & 0xFF),			# 3: DESTADDR[7:0]
-			(vlen & 0x07) << 5 |		# 4: VLEN[2:0]
-			((tlen >> 8) & 0x1F),		# 4: LEN[12:8]
-			(tlen & 0xFF),				# 5: LEN[7:0]
-			(nword << 7) |				# 6: WORDSIZE
-			(transferMode << 5) |		# 6: TMODE[1:0]
-			(trigger & 0x1F),			# 6: TRIG[4:0]
-			((srcInc & 0x03) << 6) |	# 7: SRCINC[1:0]
-			((dstInc & 0x03) << 4) |	# 7: DESTINC[1:0]
-			(nirq << 3) |				# 7: IRQMASK
-			(nm8 << 2) |				# 7: M8
-			(priority & 0x03)			# 7: PRIORITY[1:0]
-		]
+		config = dmaDescriptor(srcAddr, dstAddr, trigger, vlen=vlen, tlen=tlen,
+			word=word, transferMode=transferMode, srcInc=srcInc, dstInc=dstInc,
+			interrupt=interrupt, m8=m8, priority=priority)
 
-		# Pick an offset in memory to store the configuration
+		# Pick an offset in memory to store the configuration (unless it's
+		# already there)
 		memAddr = memBase + index*8
-		self.writeXDATA( memAddr, config )
+		if self.getShadow( ('dma', memAddr) ) != config:
+			self.writeXDATA( memAddr, config )
+			self.setShadow( ('dma', memAddr), config )
 
 		# Split address in high/low
 		cHigh = (memAddr >> 8) & 0xFF
@@ -312,8 +623,8 @@ class CC254X(ChipDriver):
 
 		# Update DMA registers
 		if index == 0:
-			self.instr( 0x75, 0xD4, cLow  ) # MOV direct,#data @ DMA0CFGL
-			self.instr( 0x75, 0xD5, cHigh ) # MOV direct,#data @ DMA0CFGH
+			self.setRegister( 0xD4, cLow  ) # MOV direct,#data @ DMA0CFGL
+			self.setRegister( 0xD5, cHigh ) # MOV direct,#data @ DMA0CFGH
 
 		else:
 
@@ -323,8 +634,8 @@ class CC254X(ChipDriver):
 			cHigh = (memAddr >> 8) & 0xFF
 			cLow = (memAddr & 0xFF)
 
-			self.instr( 0x75, 0xD2, cLow  ) # MOV direct,#data @ DMA1CFGL
-			self.instr( 0x75, 0xD3, cHigh ) # MOV direct,#data @ DMA1CFGH
+			self.setRegister( 0xD2, cLow  ) # MOV direct,#data @ DMA1CFGL
+			self.setRegister( 0xD3, cHigh ) # MOV direct,#data @ DMA1CFGH
 
 	def getDMAConfig(self, index, memBase=0x1000):
 		"""
@@ -372,8 +683,6 @@ class CC254X(ChipDriver):
 		# Update DMAARM state
 		self.setRegister(0xD6, a) # MOV direct,#data @ DMAARM
 
-		time.sleep(0.01)
-
 	def disarmDMAChannel(self, index):
 		"""
 		Disarm a DMA channel (index in 0-4)
@@ -411,6 +720,11 @@ class CC254X(ChipDriver):
 		# Get DMAIRQ state
 		a = self.getRegister( 0xD1 )
 
+		# The channels that raised their IRQ are done & no longer armed
+		armed = self.getShadow( ('sfr', 0xD6) )
+		if armed is not None:
+			self.setShadow( ('sfr', 0xD6), armed & ~a )
+
 		# Lookup IRQ bit
 		bit = pow(2, index)
 
@@ -422,15 +736,10 @@ class CC254X(ChipDriver):
 		Clear DMA IRQ flag (index in 0-4)
 		"""
 
-		# Get DMAIRQ state
-		a = self.getRegister( 0xD1 )
-
-		# Unset given flag
+		# Writing 1 has no effect on DMAIRQ (R/W0), so we don't have to read
+		# the other flags first
 		flag = pow(2, index)
-		a &= ~flag
-
-		# Update DMAIRQ state
-		self.setRegister( 0xD1, a )
+		self.setRegister( 0xD1, 0xFF & ~flag )
 
 	###############################################
 	# Flash functions
@@ -475,15 +784,34 @@ class CC254X(ChipDriver):
 		a = self.readXDATA(0x6270, 1)
 		return (a[0] & 0x20 != 0)
 
+	def getFlashControl(self):
+		"""
+		Return the bits of the flash control register we have to preserve
+		when writing it (the cache mode), from the shadow cache if possible
+		"""
+		a = self.getShadow( ('xdata', 0x6270) )
+		if a is None:
+			a = self.readXDATA(0x6270, 1)[0] & 0x1C
+			self.setShadow( ('xdata', 0x6270), a )
+		return a
+
+	def writeFlashControl(self, value):
+		"""
+		Write the flash control register, keeping the cache mode in the
+		shadow cache
+		"""
+		cm = self.getFlashControl()
+		ans = self.writeXDATA(0x6270, [ cm | value ])
+		self.setShadow( ('xdata', 0x6270), cm )
+		return ans
+
 	def clearFlashStatus(self):
 		"""
 		Clear the flash status register
 		"""
 
-		# Read & mask-out status register bits
-		a = self.readXDATA(0x6270, 1)
-		a[0] &= 0x1F
-		return self.writeXDATA(0x6270, a)
+		# Write back only the control bits
+		return self.writeFlashControl(0x00)
 
 	def setFlashWrite(self):
 		"""
@@ -491,9 +819,7 @@ class CC254X(ChipDriver):
 		"""
 
 		# Set flash WRITE bit
-		a = self.readXDATA(0x6270, 1)
-		a[0] |= 0x02
-		return self.writeXDATA(0x6270, a)
+		return self.writeFlashControl(0x02)
 
 	def setFlashErase(self):
 		"""
@@ -501,16 +827,42 @@ class CC254X(ChipDriver):
 		"""
 
 		# Set flash ERASE bit
-		a = self.readXDATA(0x6270, 1)
-		a[0] |= 0x01
-		return self.writeXDATA(0x6270, a)
+		return self.writeFlashControl(0x01)
 
-	def writeCODE(self, offset, data, erase=False, verify=False, showProgress=False):
+	def erasePage(self, page):
+		"""
+		Erase the given flash page & wait for completion
+		"""
+
+		# Select the page to erase using FADDRH[7:1]
+		#
+		# NOTE: Specific to (CC2530, CC2531, CC2540, and CC2541),
+		#       the CC2533 uses FADDRH[6:0]
+		#
+		cHigh = (page << 1)
+		cLow = 0
+		self.writeXDATA( 0x6271, [cLow, cHigh] )
+		# Set the erase bit
+		self.setFlashErase()
+		# Wait until flash is not busy any more
+		self.waitFor( 'erasePage', lambda: not self.isFlashBusy() )
+
+		# The page is now blank
+		self.erasedPages.add(page)
+		self.flashCache.put( self.cacheDevice(), page, b'\xFF' * self.flashPageSize )
+
+	def writeCODE(self, offset, data, erase=False, verify=False, showProgress=False, stub=False):
 		"""
 		Fully automated function for writing the Flash memory.
 
+		Blocks of 0xFF bytes that fall on pages known to be erased are skipped,
+		and their number is kept in `elidedPages`. If `stub` is set, the flash
+		is programmed through a RAM-resident routine (see writeCODEStub).
+
 		WARNING: This requires DMA operations to be unpaused ( use: self.pauseDMA(False) )
 		"""
+		if stub:
+			return self.writeCODEStub(offset, data, erase=erase, verify=verify, showProgress=showProgress)
 
 		# Prepare DMA-0 for DEBUG -> RAM (using DBG_BW trigger)
 		self.configDMAChannel( 0, 0x6260, 0x0000, 0x1F, tlen=self.bulkBlockSize, srcInc=0, dstInc=1, priority=1, interrupt=True )
@@ -525,6 +877,7 @@ class CC254X(ChipDriver):
 		self.disarmDMAChannel(1)
 
 		# Split in 2048-byte chunks
+		self.elidedPages = 0
 		iOfs = 0
 		while (iOfs < len(data)):
 
@@ -536,6 +889,11 @@ class CC254X(ChipDriver):
 			# Get next page
 			iLen = min( len(data) - iOfs, self.bulkBlockSize )
 
+			# Skip the blank blocks (after erasing their page)
+			if self.skipBlankBlock( offset + iOfs, data[iOfs:iOfs+iLen], erase ):
+				iOfs += iLen
+				continue
+
 			# Update DMA configuration if we have less than bulk-block size data
 			if (iLen < self.bulkBlockSize):
 				self.configDMAChannel( 0, 0x6260, 0x0000, 0x1F, tlen=iLen, srcInc=0, dstInc=1, priority=1, interrupt=True )
@@ -546,8 +904,7 @@ class CC254X(ChipDriver):
 			self.brustWrite( data[iOfs:iOfs+iLen] )
 
 			# Wait until DMA-0 raises interrupt
-			while not self.isDMAIRQ(0):
-				time.sleep(0.010)
+			self.waitFor( 'brustDMA', lambda: self.isDMAIRQ(0) )
 
 			# Clear DMA IRQ flag
 			self.clearDMAIRQ(0)
@@ -569,41 +926,216 @@ class CC254X(ChipDriver):
 
 			# Check if we should erase page first
 			if erase:
-				# Select the page to erase using FADDRH[7:1]
-				#
-				# NOTE: Specific to (CC2530, CC2531, CC2540, and CC2541),
-				#       the CC2533 uses FADDRH[6:0]
-				#
-				cHigh = (fPage << 1)
-				cLow = 0
-				self.writeXDATA( 0x6271, [cLow, cHigh] )
-				# Set the erase bit
-				self.setFlashErase()
-				# Wait until flash is not busy any more
-				while self.isFlashBusy():
-					time.sleep(0.010)
+				self.erasePage(fPage)
+				self.writeXDATA( 0x6271, [fWordOffset & 0xFF, (fWordOffset >> 8) & 0xFF] )
+			self.markWritten(fAddr, iLen)
 
 			# Upload to FLASH through DMA-1
 			self.armDMAChannel(1)
 			self.setFlashWrite()
 
-			# Wait until DMA-1 raises interrupt
-			while not self.isDMAIRQ(1):
+			# Wait until DMA-1 raises interrupt (the time it takes is
+			# learned per bulk block)
+			def written():
+				if self.isDMAIRQ(1):
+					return True
 				# Also check for errors
 				if self.isFlashAbort():
 					self.disarmDMAChannel(1)
 					raise IOError("Flash page 0x%02x is locked!" % fPage)
-				time.sleep(0.010)
+				return False
+			self.waitFor( 'flashWrite', written, scale=float(iLen) / self.bulkBlockSize )
 
 			# Clear DMA IRQ flag
 			self.clearDMAIRQ(1)
 
-			# Check if we should verify
-			if verify:
+			# Check if we should read it back
+			if verify == 'read':
 				verifyBytes = self.readCODE(fAddr, iLen)
 				if verifyBytes != data[iOfs:iOfs+iLen]:
 					raise IOError("Flash verification error on offset 0x%04x" % fAddr)
 			iOfs += iLen
 
+		# Or compare the CRCs
+		if verify and (verify != 'read'):
+			self.verifyCODE(offset, data)
+		self.cacheCODE(offset, data)
+
+		if showProgress:
+			if self.elidedPages:
+				print("\r    Progress 100%%... OK (%i blank pages skipped)" % self.elidedPages)
+			else:
+				print("\r    Progress 100%... OK")
+
+	def writeCODEStub(self, offset, data, erase=False, verify=False, showProgress=False):
+		"""
+		Write the Flash memory through the FLASH_STUB routine, which runs from
+		the SRAM and erases & programs every block while we brust-write the next
+		one in its other buffer. The time it takes is therefore the longest of
+		the link and the flash times, instead of their sum.
+
+		The blocks are skipped like in writeCODE. The SRAM below 0x1100, the DMA
+		configuration and the CPU registers are overwritten, while the program
+		counter & MEMCTR are restored.
+
+		WARNING: This requires DMA operations to be unpaused ( use: self.pauseDMA(False) )
+		"""
+
+		# Pick the blocks to program (erasing is all it takes for a blank page,
+		# and nothing at all if it's already erased)
+		blocks = []
+		self.elidedPages = 0
+		for iOfs in range(0, len(data), self.bulkBlockSize):
+			block = bytearray(data[iOfs:iOfs+self.bulkBlockSize])
+			if self.skipBlankBlock( offset + iOfs, block, erase ):
+				continue
+			blocks.append( (offset + iOfs, block) )
+
+		if blocks:
+
+			# Keep what the routine changes (running it forgets the erased pages)
+			pc = self.getPC()
+			memctr = self.getRegister( 0xC7 )
+			erasedPages = set(self.erasedPages)
+
+			# Upload the routine & the DMA descriptors of the buffers
+			self.writeXDATA( STUB_CODE, FLASH_STUB )
+			self.writeXDATA( STUB_DESC,
+				dmaDescriptor( 0x6260, STUB_BUFFERS[0], 0x1F, tlen=4+self.bulkBlockSize, srcInc=0, dstInc=1, priority=1, interrupt=True ) +
+				dmaDescriptor( 0x6260, STUB_BUFFERS[1], 0x1F, tlen=4+self.bulkBlockSize, srcInc=0, dstInc=1, priority=1, interrupt=True ) +
+				dmaDescriptor( 0x0000, 0x6273, 0x12, tlen=self.bulkBlockSize, srcInc=1, dstInc=0, priority=2, interrupt=True ) +
+				[ 0x00 ] )
+
+			# Point DMA-0 to the first buffer & DMA-1 to its descriptor
+			self.clearFlashStatus()
+			self.disarmDMAChannel(0)
+			self.disarmDMAChannel(1)
+			self.clearDMAIRQ(0)
+			self.clearDMAIRQ(1)
+			self.setRegister( 0xD4, STUB_DESC & 0xFF )
+			self.setRegister( 0xD5, STUB_DESC >> 8 )
+			self.setRegister( 0xD2, (STUB_DESC + 16) & 0xFF )
+			self.setRegister( 0xD3, (STUB_DESC + 16) >> 8 )
+			self.armDMAChannel(0)
+
+			# Map the SRAM in CODE & run the routine
+			self.setRegister( 0xC7, memctr | 0x08 )
+			self.setPC( STUB_RUN )
+			self.resume()
+
+			for i in range(0, len(blocks)):
+				(fAddr, block) = blocks[i]
+				last = (i == len(blocks) - 1)
+
+				# Check if we should show progress
+				if showProgress:
+					print("\r    Progress %0.0f%%... " % ((fAddr - offset)*100/len(data)), end=' ')
+					sys.stdout.flush()
+
+				# Wait until the routine stops for the next block (the response of
+				# the brust usually says it already did) & let it go on
+				if i > 0:
+					if not (self.debugStatus & 0x20):
+						self.waitFor( 'stubReady', lambda: (self.getStatus() & 0x20) != 0 )
+					self.resume()
+
+				# Send the header & the block, padded to the size of the buffer
+				fWordOffset = int(fAddr / 4)
+				bLen = (len(block) + 3) & ~3
+				flags = (STUB_ERASE if erase else 0) | (STUB_LAST if last else 0)
+				self.brustWrite([ fWordOffset & 0xFF, (fWordOffset >> 8) & 0xFF, flags | (bLen >> 8), bLen & 0xFF ])
+				self.brustWrite( block + bytearray([0xFF] * (self.bulkBlockSize - len(block))) )
+
+			# Wait for the last block to be programmed
+			self.waitFor( 'stubFinish', lambda: (self.getStatus() & 0x20) != 0 )
+			self.halt()
+			status = self.readXDATA( STUB_STATUS, 1 )[0]
+
+			# Restore the CPU state & the pages we know are erased
+			self.setRegister( 0xC7, memctr )
+			self.setPC( pc )
+			self.erasedPages.update( erasedPages )
+			for (fAddr, block) in blocks:
+				self.markWritten( fAddr, len(block) )
+			if status & 0x20:
+				raise IOError("Flash write aborted, a page in 0x%05x-0x%05x is locked!" % (offset, offset + len(data)))
+
+			# Check if we should verify
+			if verify:
+				self.verifyCODE(offset, data, verify)
+			self.cacheCODE(offset, data)
+
 		if showProgress:
-			print("\r    Progress 100%... OK")
+			if self.elidedPages:
+				print("\r    Progress 100%%... OK (%i blank pages skipped)" % self.elidedPages)
+			else:
+				print("\r    Progress 100%... OK")
+
+	def getCODECRCs(self, offset, size, count=1):
+		"""
+		Return the CRC-16 of `count` consecutive blocks of `size` bytes from the
+		given CODE offset, computed on the chip by the CRC_STUB routine, so that
+		only the CRCs are transferred (see runBlockRoutine)
+		"""
+		table = self.runBlockRoutine( CRC_STUB, 2, 'pageCRC', offset, size, count )
+		return [ table[2*i] | (table[2*i+1] << 8) for i in range(0, count) ]
+
+	def getUsedPages(self, page, count):
+		"""
+		Return the numbers of the given flash pages that are not blank, as found
+		on the chip by the BLANK_STUB routine (see runBlockRoutine)
+		"""
+		table = self.runBlockRoutine( BLANK_STUB, 1, 'blankScan', page * self.flashPageSize, self.flashPageSize, count )
+		return [ page + i for i in range(0, count) if table[i] != 0xFF ]
+
+	def runBlockRoutine(self, routine, entrySize, operation, offset, size, count):
+		"""
+		Run a routine like CRC_STUB on `count` consecutive blocks of `size` bytes
+		from the given CODE offset & return the table of its results, of
+		`entrySize` bytes per block. The blocks can't cross a flash bank. The
+		SRAM at CRC_TABLE & CRC_CODE and the CPU registers are overwritten,
+		while the program counter, MEMCTR & the pages known to be erased are
+		restored.
+		"""
+		ans = bytearray()
+
+		# Keep what the routine changes (running it forgets the erased pages)
+		pc = self.getPC()
+		memctr = self.getRegister( 0xC7 )
+		erasedPages = set(self.erasedPages)
+		self.writeXDATA( CRC_CODE, routine )
+
+		# The loop counters of the block size (the low byte goes first)
+		self.instr( 0x7A, size & 0xFF )									# MOV R2,#LOW(size)
+		self.instr( 0x7B, ((size >> 8) + (1 if size & 0xFF else 0)) & 0xFF )	# MOV R3,#HIGH(size)
+
+		while count > 0:
+
+			# The blocks in this bank
+			fBank = int(offset / 0x8000)
+			iCount = min( count, int(((fBank + 1) * 0x8000 - offset) / size), int(CRC_ENTRIES * 2 / entrySize) )
+			if iCount == 0:
+				raise ValueError("The block at 0x%05x crosses a flash bank" % offset)
+			fAddr = 0x8000 + offset - fBank * 0x8000
+
+			# Map the bank in XDATA & the SRAM in CODE, then run the routine
+			self.setRegister( 0xC7, (memctr & 0xF0) | 0x08 | fBank )
+			self.instr( 0x90, fAddr >> 8, fAddr & 0xFF )		# MOV DPTR,#fAddr
+			self.instr( 0x7D, iCount )							# MOV R5,#iCount
+			self.instr( 0x79, CRC_TABLE & 0xFF )				# MOV R1,#LOW(CRC_TABLE)
+			self.instr( 0x75, 0x93, CRC_TABLE >> 8 )			# MOV MPAGE,#HIGH(CRC_TABLE)
+			self.setPC( CRC_RUN )
+			self.resume()
+			self.waitFor( operation, lambda: (self.getStatus() & 0x20) != 0, scale=float(iCount * size) / self.flashPageSize )
+			self.halt()
+
+			# Collect the results
+			ans += self.readXDATA( CRC_TABLE, entrySize * iCount )
+			offset += iCount * size
+			count -= iCount
+
+		# Restore the CPU state & the pages we know are erased
+		self.setRegister( 0xC7, memctr )
+		self.setPC( pc )
+		self.erasedPages.update( erasedPages )
+		return ans
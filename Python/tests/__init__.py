@@ -18,7 +18,52 @@
 #
 import os
 import atexit
+import random
 from tempfile import NamedTemporaryFile
+from cclib.ccprotocol import ANS_OK, ANS_ERROR
+
+class ScriptedSerial:
+  """
+  Serial port stand-in that answers every frame with OK and the command in the
+  low byte, or with the error code scripted for its frame number in `errors`.
+  The frames it received are kept in `frames`.
+  """
+  port = "scripted"
+  baudrate = 115200
+  timeout = None
+  closed = False
+
+  def __init__(self, errors=None):
+    self.errors = errors or {}
+    self.frames = []
+    self.rx = bytearray()
+    self.tx = bytearray()
+
+  def write(self, data):
+    self.rx += bytearray(data)
+    while len(self.rx) >= 4:
+      error = self.errors.get(len(self.frames))
+      if error is None:
+        self.tx += bytearray([ANS_OK, 0x00, self.rx[0]])
+      else:
+        self.tx += bytearray([ANS_ERROR, 0x00, error])
+      self.frames.append(self.rx[0:4])
+      self.rx = self.rx[4:]
+    return len(data)
+
+  def read(self, size=1):
+    ans = self.tx[:size]
+    self.tx = self.tx[size:]
+    return bytes(ans)
+
+  def reset_input_buffer(self):
+    self.tx = bytearray()
+
+  def flush(self):
+    pass
+
+  def close(self):
+    self.closed = True
 
 def temp_hexfile(contents):
   """
@@ -34,3 +79,31 @@ def temp_hexfile(contents):
   atexit.register(os.unlink, hexfile.name)
 
   return hexfile.name
+
+def randomData(size, seed=1):
+  """
+  Return `size` pseudo-random bytes, the same for the same seed
+  """
+  rnd = random.Random(seed)
+  return bytearray([ rnd.randint(0, 255) for i in range(0, size) ])
+
+def hexFile(*blocks):
+  """
+  Return a CCHEXFile with a memory block for every (address, bytes) given
+  """
+  from cclib.cchex import CCHEXFile, CCMemBlock
+  ans = CCHEXFile()
+  for (addr, data) in blocks:
+    ans.memBlocks.append(CCMemBlock(addr))
+    ans.memBlocks[-1].stack(data)
+  return ans
+
+def openEmulated(chip='CC2540', flash=32):
+  """
+  Open a debugger on an emulated chip, with the DMA unpaused
+  """
+  from cclib.ccdebugger import openCCDebugger
+  from cclib.ccemulator import CCProxyEmulator, CC254XEmulator
+  dbg = openCCDebugger(CCProxyEmulator(CC254XEmulator(chip, flash=flash)), verbose=False)
+  dbg.pauseDMA(False)
+  return dbg
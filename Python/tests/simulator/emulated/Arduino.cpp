@@ -18,6 +18,7 @@
  */
 
 #include "Arduino.h"
+#include <ctime>
 
 void pinMode(const int pin, const unsigned char mode)
 {
@@ -38,3 +39,8 @@ void delay(const int ms)
 {
 
 }
+
+unsigned long millis()
+{
+  return (unsigned long)(clock() * 1000.0 / CLOCKS_PER_SEC);
+}
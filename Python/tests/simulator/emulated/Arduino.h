@@ -20,6 +20,8 @@
 #ifndef ARDUINO_H
 #define ARDUINO_H
 
+#include <cstring>
+
 typedef unsigned char byte;
 typedef bool boolean;
 
@@ -34,5 +36,6 @@ void pinMode(const int pin, const unsigned char mode);
 void digitalWrite(const int pin, const unsigned char value);
 unsigned char digitalRead(const int pin);
 void delay(const int ms);
+unsigned long millis();
 
 #endif
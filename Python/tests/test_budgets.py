@@ -0,0 +1,159 @@
+#
+# Protocol budgets of the chip drivers
+# Copyright (c) 2014-2016 Ioannis Charalampidis
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# The driver operations run against the emulated proxy & chip and their
+# frames, serial bytes, round trips and modelled time (per KB for the bulk
+# operations) are checked against budgets.json. Set CC_UPDATE_BUDGETS=1 to
+# rewrite the budgets from the current measurements (plus 10% headroom)
+# after an intentional change.
+#
+
+from cclib.ccdebugger import openCCDebugger
+from cclib.ccemulator import CCProxyEmulator, CC254XEmulator
+from cclib.ccprotocol import CAP_BLOCK_RW, CAP_BRUST_RLE
+from unittest import TestCase
+from tests import randomData
+import json
+import os
+
+BUDGETS_FILE = os.path.join(os.path.dirname(__file__), "budgets.json")
+HEADROOM = 1.1
+
+measured = {}
+
+def measure(dbg, fn, kb=None):
+  # Run an operation & return its counters (per KB if kb is given)
+  dbg.resetStats()
+  fn()
+  stats = dbg.getStats()
+  commands = stats['commands'].values()
+  ans = {
+    'frames': sum([ c['frames'] for c in commands ]),
+    'bytes': sum([ c['bytesOut'] + c['bytesIn'] for c in commands ]),
+    'roundTrips': sum([ c['roundTrips'] for c in commands ]),
+    'seconds': stats['elapsed'],
+  }
+  if kb:
+    ans = dict([ (k, v / float(kb)) for (k, v) in ans.items() ])
+  return ans
+
+class TestBudgets(TestCase):
+  @classmethod
+  def setUpClass(cls):
+    with open(BUDGETS_FILE) as f:
+      cls.budgets = json.load(f)
+
+  @classmethod
+  def tearDownClass(cls):
+    if os.environ.get("CC_UPDATE_BUDGETS"):
+      budgets = dict(cls.budgets)
+      for (name, values) in measured.items():
+        budgets[name] = dict([ (k, round(v * HEADROOM, 4)) for (k, v) in values.items() ])
+      with open(BUDGETS_FILE, "w") as f:
+        json.dump(budgets, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+  def open(self, capabilities=CAP_BLOCK_RW | CAP_BRUST_RLE):
+    return openCCDebugger(CCProxyEmulator(CC254XEmulator('CC2540'), capabilities=capabilities), verbose=False)
+
+  def check(self, name, values):
+    measured[name] = values
+    if os.environ.get("CC_UPDATE_BUDGETS"):
+      return
+    budget = self.budgets[name]
+    for (k, v) in values.items():
+      assert v <= budget[k], "%s: %s is %.4f, over the budget of %.4f" % (name, k, v, budget[k])
+
+  def test_getChipInfo(self):
+    dbg = self.open()
+    self.check("getChipInfo", measure(dbg, dbg.getChipInfo))
+
+  def test_chipErase(self):
+    # With the timing learned from a first one
+    dbg = self.open()
+    dbg.chipErase()
+    self.check("chipErase", measure(dbg, dbg.chipErase))
+
+  def test_readXDATA(self):
+    dbg = self.open()
+    self.check("readXDATA", measure(dbg, lambda: dbg.readXDATA(0x0000, 4096), 4))
+
+  def test_writeXDATA(self):
+    # Crosses the DMA descriptor area
+    dbg = self.open()
+    data = randomData(4096)
+    self.check("writeXDATA", measure(dbg, lambda: dbg.writeXDATA(0x0C00, data), 4))
+    assert dbg.ser.chip.sram[0x0C00:0x1C00] == data
+
+  def test_writeXDATA_small(self):
+    dbg = self.open()
+    data = randomData(32)
+    self.check("writeXDATA_small", measure(dbg, lambda: dbg.writeXDATA(0x0100, data)))
+    assert dbg.ser.chip.sram[0x0100:0x0120] == data
+
+  def test_readXDATA_legacy(self):
+    dbg = self.open(capabilities=0)
+    self.check("readXDATA_legacy", measure(dbg, lambda: dbg.readXDATA(0x0000, 1024), 1))
+
+  def test_writeXDATA_legacy(self):
+    dbg = self.open(capabilities=0)
+    data = randomData(1024)
+    self.check("writeXDATA_legacy", measure(dbg, lambda: dbg.writeXDATA(0x0000, data), 1))
+    assert dbg.ser.chip.sram[0x0000:0x0400] == data
+
+  def test_readCODE(self):
+    # Crosses from bank 0 to bank 1
+    dbg = self.open()
+    dbg.ser.chip.flash[0x7000:0x9000] = randomData(0x2000)
+    ans = []
+    self.check("readCODE", measure(dbg, lambda: ans.append(dbg.readCODE(0x7000, 0x2000)), 8))
+    assert ans[0] == dbg.ser.chip.flash[0x7000:0x9000]
+
+  def writeCODE(self, name, erase, verify, stub=False):
+    dbg = self.open()
+    dbg.chipErase()
+    dbg.pauseDMA(False)
+    data = randomData(0x4000)
+    self.check(name, measure(dbg, lambda: dbg.writeCODE(0x1000, data, erase=erase, verify=verify, stub=stub), 16))
+    assert dbg.ser.chip.flash[0x1000:0x5000] == data
+
+  def test_writeCODE(self):
+    self.writeCODE("writeCODE", False, False)
+
+  def test_writeCODE_erase(self):
+    self.writeCODE("writeCODE_erase", True, False)
+
+  def test_writeCODE_verify(self):
+    self.writeCODE("writeCODE_verify", False, True)
+
+  def test_writeCODE_erase_verify(self):
+    self.writeCODE("writeCODE_erase_verify", True, True)
+
+  def test_writeCODE_stub(self):
+    self.writeCODE("writeCODE_stub", True, False, stub=True)
+
+  def test_writeCODEDiff_unchanged(self):
+    # Only the CRCs cross the link
+    dbg = self.open()
+    dbg.pauseDMA(False)
+    data = randomData(0x4000)
+    pages = dict([ (p, data[(p - 2) * 0x800:(p - 1) * 0x800]) for p in range(2, 10) ])
+    dbg.writeCODEDiff(pages)
+    self.check("writeCODEDiff_unchanged", measure(dbg, lambda: dbg.writeCODEDiff(pages), 16))
+
+  def test_writeCODE_verify_read(self):
+    self.writeCODE("writeCODE_verify_read", False, 'read')
@@ -0,0 +1,81 @@
+#
+# Test for the asyncio front-end of the chip drivers
+# Copyright (c) 2014-2016 Ioannis Charalampidis
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from unittest import TestCase, skipIf
+from tests import randomData, openEmulated
+import sys
+
+# The front-end is not importable before python 3.5
+@skipIf(sys.version_info < (3, 5), "asyncio requires python 3.5 or later")
+class TestCCAsync(TestCase):
+  def setUp(self):
+    import asyncio
+    self.loop = asyncio.new_event_loop()
+
+  def tearDown(self):
+    self.loop.close()
+
+  def open(self, dbg):
+    from cclib.ccasync import asyncDriver
+    return asyncDriver(dbg, self.loop)
+
+  def run_until_complete(self, coro):
+    return self.loop.run_until_complete(coro)
+
+  def test_read_code(self):
+    dbg = openEmulated(flash=128)
+    adbg = self.open(dbg)
+    # Across the end of the first code bank
+    dbg.ser.chip.flash[0x7800:0x8800] = randomData(0x1000)
+    assert self.run_until_complete(adbg.readCODE(0x7800, 0x1000)) == randomData(0x1000)
+
+  def test_write_read_code(self):
+    dbg = openEmulated(flash=128)
+    adbg = self.open(dbg)
+    data = randomData(0x1000)
+    self.run_until_complete(adbg.writeCODE(0x7800, data, erase=True, verify=True))
+    assert dbg.ser.chip.flash[0x7800:0x8800] == data
+    assert dbg.readCODE(0x7800, 0x1000) == data
+
+  def test_cache(self):
+    dbg = openEmulated(flash=128)
+    adbg = self.open(dbg)
+    data = randomData(0x1000)
+    self.run_until_complete(adbg.writeCODE(0x0800, data, erase=True))
+    pages = dbg.flashCache.pages(dbg.cacheDevice())
+    assert pages[1][1] == data[0:0x800] and pages[2][1] == data[0x800:0x1000]
+    # The sync driver can use it
+    assert dbg.readCODECached(0x0800, 0x1000) == data
+    self.run_until_complete(adbg.chipErase())
+    assert dbg.flashCache.pages(dbg.cacheDevice()) == {}
+
+  def test_write_read_code_cc2510(self):
+    from cclib.ccdebugger import openCCDebugger
+    dbg = openCCDebugger("emulator:CC2510", verbose=False)
+    adbg = self.open(dbg)
+    flash = dbg.ser.chip.flash
+    flash[0x0000:0x2000] = bytearray([0x55] * 0x2000)
+    data = randomData(0x1200)
+    self.run_until_complete(adbg.writeCODE(0x0500, data, erase=True, verify=True))
+    assert flash[0x0500:0x1700] == data
+    assert flash[0x0400:0x0500] == flash[0x1700:0x1800] == bytearray([0xFF] * 0x100)
+    assert flash[0x1800:0x2000] == bytearray([0x55] * 0x800)
+    assert self.run_until_complete(adbg.readCODE(0x0500, 0x1200)) == data
+    # Through the flash routine, not the CC254x DMA
+    assert not 'CMD_BRUSTWR' in dbg.getStats()['commands']
+    assert dbg.readCODECached(0x0400, 0x1400) == flash[0x0400:0x1800]
@@ -0,0 +1,138 @@
+#
+# Test for the cclib daemon & its clients
+# Copyright (c) 2014-2016 Ioannis Charalampidis
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from cclib.ccdaemon import CCDaemon, CCDaemonDriver, encodeValue, decodeValue
+from tests import randomData
+from unittest import TestCase
+import threading
+import tempfile
+import shutil
+import serial
+import json
+import time
+import os
+
+PORT = "emulator:CC2540"
+
+class TestEncodeValue(TestCase):
+  def test_roundtrip(self):
+    value = { 'data': randomData(300), 'list': [ 1, bytearray(b'\x00\xff'), [ "text", None ] ],
+      'tuple': (bytearray(), 2.5) }
+    ans = decodeValue(json.loads(json.dumps(encodeValue(value))))
+    assert ans['data'] == randomData(300) and isinstance(ans['data'], bytearray)
+    assert ans['list'] == [ 1, bytearray(b'\x00\xff'), [ "text", None ] ]
+    assert ans['tuple'] == [ bytearray(), 2.5 ]
+
+class TestDaemon(TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.path = os.path.join(self.dir, "cclib.sock")
+    self.threads = threading.active_count()
+    self.daemon = CCDaemon(self.path)
+    self.thread = threading.Thread(target=self.daemon.serve_forever, kwargs={ 'poll_interval': 0.05 })
+    self.thread.daemon = True
+    self.thread.start()
+    self.clients = []
+
+  def tearDown(self):
+    for client in self.clients:
+      client.close()
+    self.daemon.shutdown()
+    self.daemon.server_close()
+    self.thread.join()
+    # Let the handlers notice their clients are gone
+    deadline = time.time() + 5
+    while (threading.active_count() > self.threads) and (time.time() < deadline):
+      time.sleep(0.01)
+    shutil.rmtree(self.dir)
+
+  def connect(self, port=PORT):
+    client = CCDaemonDriver(port, path=self.path)
+    self.clients.append(client)
+    return client
+
+  def driver(self):
+    return self.daemon.sessions[PORT].driver
+
+  def test_session(self):
+    a = self.connect()
+    b = self.connect()
+    # Both clients use the same chip & mirror its state
+    assert list(self.daemon.sessions.keys()) == [ PORT ]
+    assert a.port == b.port == PORT
+    assert a.chipID == b.chipID == self.driver().chipID
+    assert a.chipName() == "CC2540"
+    # Bytes travel both ways
+    a.writeXDATA(0x0100, randomData(300))
+    data = b.readXDATA(0x0100, 300)
+    assert isinstance(data, bytearray) and data == randomData(300)
+    # Auto-detection picks the open session
+    assert self.connect(None).port == PORT
+
+  def test_serialized(self):
+    a = self.connect()
+    b = self.connect()
+
+    # A driver call that notes how many calls run at the same time
+    lock = threading.Lock()
+    calls = { 'active': 0, 'most': 0, 'threads': set() }
+    def slow(n):
+      with lock:
+        calls['active'] += 1
+        calls['most'] = max(calls['most'], calls['active'])
+        calls['threads'].add(threading.current_thread().ident)
+      time.sleep(0.02)
+      with lock:
+        calls['active'] -= 1
+      return n
+    self.driver().slow = slow
+
+    # The clients are served concurrently, but the calls on the port one by one
+    results = []
+    def run(client, base):
+      for i in range(0, 10):
+        results.append(client.slow(base + i))
+    threads = [ threading.Thread(target=run, args=(a, 0)), threading.Thread(target=run, args=(b, 100)) ]
+    for t in threads:
+      t.start()
+    for t in threads:
+      t.join()
+    assert sorted(results) == list(range(0, 10)) + list(range(100, 110))
+    assert len(calls['threads']) == 2
+    assert calls['most'] == 1
+
+  def test_serial_error(self):
+    a = self.connect()
+    b = self.connect()
+
+    # Other errors keep the session
+    self.assertRaises(IOError, a.readXDATA)
+    assert a.readXDATA(0x0100, 4) is not None
+
+    # The port is gone: the session is dropped for every client
+    def unplugged(data):
+      raise serial.SerialException("device disconnected")
+    self.driver().ser.write = unplugged
+    self.assertRaises(IOError, a.readXDATA, 0x0100, 4)
+    assert self.daemon.sessions == {}
+    self.assertRaises(IOError, b.readXDATA, 0x0100, 4)
+
+    # Opening the port again starts a new session
+    c = self.connect()
+    c.writeXDATA(0x0100, randomData(16))
+    assert c.readXDATA(0x0100, 16) == randomData(16)
@@ -0,0 +1,243 @@
+#
+# Test for the emulated CCLib_proxy & chips
+# Copyright (c) 2014-2016 Ioannis Charalampidis
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from cclib.ccdebugger import openCCDebugger
+from cclib.ccemulator import CCProxyEmulator, CC254XEmulator
+from cclib.ccflash import crc16, isBlank
+from cclib.chip.cc2510 import FLASH_ROUTINE_CODE
+from unittest import TestCase
+import random
+
+class TestCCEmulator(TestCase):
+  def open(self, chip='CC2540'):
+    return openCCDebugger("emulator:%s" % chip, verbose=False)
+
+  def test_detect(self):
+    dbg = self.open('CC2531')
+    assert dbg.chipID >> 8 == 0xB5
+    assert dbg.getChipInfo() == { 'flash': 256, 'usb': True, 'sram': 8 }
+    assert dbg.getSerial() == "00124b00b503"
+
+  def test_detect_cc2510(self):
+    dbg = self.open('CC2510')
+    assert dbg.instructionTableVersion == 2
+    dbg.writeXDATA(0xF100, [1, 2, 3, 4])
+    assert list(dbg.readXDATA(0xF100, 4)) == [1, 2, 3, 4]
+
+  def test_write_read_code(self):
+    dbg = self.open()
+    dbg.chipErase()
+    dbg.pauseDMA(False)
+    rnd = random.Random(1)
+    data = bytearray([ rnd.randint(0, 255) for i in range(0, 5000) ])
+    for offset in (0x100, 0x18000):
+      dbg.writeCODE(offset, data, verify=True)
+      assert dbg.readCODE(offset, len(data)) == data
+    assert dbg.ser.chip.flash[0x18000:0x18000 + len(data)] == data
+
+  def test_chip_erase(self):
+    dbg = self.open()
+    dbg.ser.chip.flash[0x1234] = 0x00
+    dbg.chipErase()
+    assert isBlank(dbg.ser.chip.flash)
+    assert dbg.readCODE(0x1230, 8) == bytearray([0xFF] * 8)
+
+  def test_erase_page(self):
+    dbg = self.open()
+    dbg.ser.chip.flash[0x0800:0x1800] = bytearray(0x1000)
+    dbg.erasePage(1)
+    assert dbg.ser.chip.flash[0x0800:0x1000] == bytearray([0xFF] * 0x800)
+    assert dbg.ser.chip.flash[0x1000:0x1800] == bytearray(0x800)
+
+  def test_run_program(self):
+    # MOV A,#5; ADD A,#3; MOV DPTR,#0x0100; MOVX @DPTR,A; (breakpoint)
+    chip = CC254XEmulator()
+    chip.flash[0:9] = bytearray([0x74, 0x05, 0x24, 0x03, 0x90, 0x01, 0x00, 0xF0, 0xA5])
+    dbg = openCCDebugger(CCProxyEmulator(chip), verbose=False)
+    dbg.resume()
+    assert dbg.getStatus() & 0x28 == 0x28
+    assert dbg.getPC() == 9
+    assert dbg.readXDATA(0x0100, 1)[0] == 8
+
+  def test_crc(self):
+    # The RNDH register of the chip computes the same CRC
+    dbg = self.open()
+    dbg.instr(0x75, 0xBC, 0xFF)
+    dbg.instr(0x75, 0xBC, 0xFF)
+    for b in bytearray(b"123456789"):
+      dbg.instr(0x75, 0xBD, b)
+    assert (dbg.instr(0xE5, 0xBD) << 8) | dbg.instr(0xE5, 0xBC) == crc16(b"123456789") == 0xAEE7
+
+  def test_modelled_time(self):
+    dbg = self.open()
+    dbg.resetStats()
+    dbg.readXDATA(0x0000, 2048)
+    stats = dbg.getStats()
+    # Bound by the debug interface (6 bytes per XDATA byte)
+    assert 1.0 < stats['elapsed'] < 1.5
+
+  def test_dry_run(self):
+    dbg = self.open()
+    dbg.chipErase()
+    data = bytearray(range(256)) * 16
+    costs = []
+    for baudrate in (115200, 38400):
+      est = dbg.dryRun(baudrate=baudrate)
+      est.pauseDMA(False)
+      est.writeCODE(0x800, data, verify=True)
+      costs.append(est.getStats())
+    assert isBlank(dbg.ser.chip.flash)
+    assert costs[0]['commands']['CMD_BRUSTWR']['brustBytes'] == costs[1]['commands']['CMD_BRUSTWR']['brustBytes'] == 4096
+    assert costs[0]['elapsed'] < costs[1]['elapsed']
+
+  def test_shadow(self):
+    dbg = self.open()
+    dbg.ser.chip.flash[0x8000:0x8004] = bytearray([1, 2, 3, 4])
+    dbg.readCODE(0x8000, 4)
+    # The bank is already selected
+    dbg.resetStats()
+    assert dbg.readCODE(0x8000, 4) == bytearray([1, 2, 3, 4])
+    assert dbg.getStats()['commands']['CMD_EXEC_3']['frames'] == 1
+    # Writing the SFR through XDATA or running the CPU forgets it
+    dbg.writeXDATA(0x70C7, [0x00])
+    assert dbg.getShadow(('sfr', 0xC7)) is None
+    assert dbg.readCODE(0x8000, 4) == bytearray([1, 2, 3, 4])
+    dbg.resume()
+    assert dbg.getShadow(('sfr', 0xC7)) is None
+    dbg.halt()
+    # Clearing a DMA IRQ flag leaves the others alone
+    dbg.ser.chip.sfr[0xD1] = 0x03
+    dbg.clearDMAIRQ(1)
+    assert dbg.ser.chip.sfr[0xD1] == 0x01
+
+  def test_learned_timings(self):
+    dbg = self.open()
+    dbg.erasePage(1)
+    expected = dbg.getTimings()['erasePage']
+    assert 0.019 < expected < 0.025
+    # Sleeps until just before the erase completes
+    dbg.resetStats()
+    dbg.erasePage(2)
+    assert dbg.getStats()['polls'] <= 2
+
+  def test_state_after_verify(self):
+    # Verifying by CRC keeps what we know about the erased pages & registers
+    dbg = self.open()
+    dbg.chipErase()
+    dbg.pauseDMA(False)
+    dbg.writeCODE(0x0000, bytearray(range(256)) * 8, verify=True)
+    assert not dbg.cpuRunning
+    assert dbg.getShadow(('sfr', 0xC7)) is not None
+    dbg.writeCODE(0x1000, bytearray([0xFF] * 0x2000))
+    assert dbg.elidedPages == 4
+
+  def test_write_code_stub(self):
+    dbg = self.open()
+    dbg.pauseDMA(False)
+    dbg.ser.chip.flash[0x0000:0x4000] = bytearray([0x55] * 0x4000)
+    rnd = random.Random(1)
+    data = bytearray([ rnd.randint(0, 255) for i in range(0, 0x3000 + 10) ])
+    data[0x800:0x1000] = bytearray([0xFF] * 0x800)
+    pc = dbg.getPC()
+    dbg.writeCODE(0x0000, data, erase=True, verify=True, stub=True)
+    assert dbg.ser.chip.flash[0x0000:len(data)] == data
+    assert dbg.ser.chip.flash[len(data):0x3800] == bytearray([0xFF] * (0x3800 - len(data)))
+    # The CPU is left like we found it
+    assert dbg.getPC() == pc
+    assert dbg.getRegister(0xC7) & 0x08 == 0
+
+  def test_page_crcs(self):
+    # Computed on the chip, across the flash banks
+    dbg = self.open()
+    rnd = random.Random(1)
+    dbg.ser.chip.flash[0x7000:0x9000] = bytearray([ rnd.randint(0, 255) for i in range(0, 0x2000) ])
+    expected = [ crc16(dbg.ser.chip.flash[p * 0x800:(p + 1) * 0x800]) for p in range(14, 18) ]
+    assert dbg.getPageCRCs(14, 4) == expected
+
+  def test_write_code_diff(self):
+    dbg = self.open()
+    dbg.pauseDMA(False)
+    rnd = random.Random(1)
+    pages = dict([ (p, bytearray([ rnd.randint(0, 255) for i in range(0, 0x800) ])) for p in range(4, 10) ])
+    dbg.writeCODEDiff(pages)
+    # Only the changed pages are written
+    pages[5][0x10] ^= 0xFF
+    pages[9][0x7FF] ^= 0xFF
+    assert dbg.writeCODEDiff(pages) == [5, 9]
+    for (p, data) in pages.items():
+      assert dbg.ser.chip.flash[p * 0x800:(p + 1) * 0x800] == data
+
+  def test_verify_code(self):
+    dbg = self.open()
+    rnd = random.Random(1)
+    data = bytearray([ rnd.randint(0, 255) for i in range(0, 0x1800) ])
+    dbg.ser.chip.flash[0x7800:0x9000] = data
+    dbg.verifyCODE(0x7800, data)
+    # The CRCs locate the bank, the read back the byte
+    dbg.ser.chip.flash[0x8123] ^= 0x01
+    for verify in (True, 'read'):
+      try:
+        dbg.verifyCODE(0x7800, data, verify)
+        assert False, "The verification should fail"
+      except IOError as e:
+        assert "0x8123" in str(e)
+
+  def test_iter_code(self):
+    # A CC2530F256 dump, in chunks that cross the banks
+    dbg = self.open('CC2530')
+    rnd = random.Random(1)
+    flash = dbg.ser.chip.flash
+    flash[0x6000:0x1A000] = bytearray([ rnd.randint(0, 255) for i in range(0, 0x14000) ])
+    chunks = list(dbg.iterCODE(0x6000, 0x14000, 0x3000))
+    assert [ len(c) for c in chunks ] == [ 0x3000 ] * 6 + [ 0x2000 ]
+    assert bytearray().join(chunks) == flash[0x6000:0x1A000]
+
+  def test_used_pages(self):
+    dbg = self.open()
+    flash = dbg.ser.chip.flash
+    flash[0x1805] = 0x00
+    flash[0x8800:0x9800] = bytearray(0x1000)
+    flash[0x3FFFF] = 0xFE
+    dbg.resetStats()
+    assert dbg.getUsedPages(0, 128) == [3, 17, 18, 127]
+    # Much faster than reading the flash
+    assert dbg.getStats()['elapsed'] < 1.0
+
+  def test_write_flash_pages(self):
+    # Like a CC2510F32, with 4KB of SRAM for 3 pages per run
+    dbg = self.open('CC2510')
+    dbg.sramSize = 0x1000
+    flash = dbg.ser.chip.flash
+    flash[0x0000:0x2000] = bytearray([0x55] * 0x2000)
+    rnd = random.Random(1)
+    data = bytearray([ rnd.randint(0, 255) for i in range(0, 0x1200) ])
+    dbg.writeCODE(0x0500, data, erase=True, verify=True)
+    assert flash[0x0500:0x1700] == data
+    assert flash[0x0400:0x0500] == flash[0x1700:0x1800] == bytearray([0xFF] * 0x100)
+    assert flash[0x1800:0x2000] == bytearray([0x55] * 0x800)
+    # Only the pages programmed after an erase are known
+    assert 1 in dbg.flashCache.pages(dbg.cacheDevice())
+    before = bytearray(flash[0x0400:0x0800])
+    dbg.writeCODE(0x0400, data[0:0x400])
+    assert flash[0x0400:0x0800] == bytearray([ a & b for (a, b) in zip(before, data[0:0x400]) ])
+    assert not 1 in dbg.flashCache.pages(dbg.cacheDevice())
+    # The routine is still resident, only the page data are uploaded
+    dbg.resetStats()
+    dbg.writeFlashPage(0x3C00, data[0:0x400])
+    assert flash[0x3C00:0x4000] == data[0:0x400]
+    assert dbg.getStats()['commands']['CMD_XDATA_WR']['bytesOut'] < 0x400 + len(FLASH_ROUTINE_CODE)
@@ -0,0 +1,129 @@
+#
+# CCLib_proxy Interface Library for High-Level operations
+# Copyright (c) 2014-2016 Ioannis Charalampidis
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from cclib.ccflash import crc16
+from cclib.ccflash import CCFlashPlan, CCFlashCache, sharedFlashCache
+from unittest import TestCase
+from tests import randomData, hexFile, openEmulated
+import tempfile
+import shutil
+
+class TestCCFlashPlan(TestCase):
+  def test_keep_partial_pages(self):
+    dbg = openEmulated()
+    flash = dbg.ser.chip.flash
+    flash[0x0000:0x1800] = randomData(0x1800, seed=2)
+    old = bytearray(flash)
+    image = hexFile((0x0900, randomData(0x0400)), (0x1400, randomData(0x0A00, seed=3)))
+    plan = CCFlashPlan(dbg, image)
+    # Page 0 holds data too, so no chip erase
+    assert not plan.chipErase
+    assert plan.erasedPages() == 2
+    # Only the bytes the image doesn't overwrite on the used pages 1 & 2
+    assert plan.keptBytes == (0x800 - 0x400) + 0x400
+    plan.execute()
+    assert flash[0x0000:0x0900] == old[0x0000:0x0900]
+    assert flash[0x0900:0x0D00] == image.memBlocks[0].bytes
+    assert flash[0x0D00:0x1400] == old[0x0D00:0x1400]
+    assert flash[0x1400:0x1E00] == image.memBlocks[1].bytes
+    assert flash[0x1E00:0x2000] == bytearray([0xFF] * 0x200)
+    # Nothing to do the next time
+    plan = CCFlashPlan(dbg, image)
+    assert (plan.erasedPages(), plan.programmedPages()) == (0, 0)
+
+  def test_used_page_with_blank_crc(self):
+    # A used page that happens to have the CRC of a blank one
+    dbg = openEmulated()
+    flash = dbg.ser.chip.flash
+    page = bytearray([0xFF] * 0x7FE)
+    page[0x10] = 0x00
+    (crc, blankCRC) = (crc16(page), crc16(b'\xFF' * 0x800))
+    for x in range(0, 0x10000):
+      if crc16(bytearray([x >> 8, x & 0xFF]), crc) == blankCRC:
+        break
+    page += bytearray([x >> 8, x & 0xFF])
+    assert crc16(page) == blankCRC
+    flash[0x1800:0x2000] = page
+    image = hexFile((0x1900, randomData(0x100)))
+    plan = CCFlashPlan(dbg, image)
+    assert plan.erasedPages() == 1
+    plan.execute()
+    assert flash[0x1900:0x1A00] == image.memBlocks[0].bytes
+    assert flash[0x1800:0x1900] + flash[0x1A00:0x2000] == page[0:0x100] + page[0x200:0x800]
+
+  def test_chip_erase(self):
+    # Cheaper when all the pages with data are overwritten
+    dbg = openEmulated()
+    flash = dbg.ser.chip.flash
+    flash[0x0000:0x6000] = randomData(0x6000, seed=2)
+    image = hexFile((0x0000, randomData(0x6000)))
+    plan = CCFlashPlan(dbg, image)
+    assert plan.chipErase
+    assert plan.keptBytes == 0
+    plan.execute(verify=True)
+    assert flash[0x0000:0x6000] == image.memBlocks[0].bytes
+    assert flash[0x6000:0x8000] == bytearray([0xFF] * 0x2000)
+
+class TestCCFlashCache(TestCase):
+  def test_persist(self):
+    directory = tempfile.mkdtemp()
+    try:
+      cache = CCFlashCache(directory)
+      cache.put("8d03-00124b008d03", 3, randomData(0x800))
+      cache.save()
+      cache = CCFlashCache(directory)
+      assert cache.get("8d03-00124b008d03", 3, crc16(randomData(0x800))) == randomData(0x800)
+      assert cache.get("8d03-00124b008d03", 3, 0x1234) is None
+      assert cache.get("8d03-00124b008d03", 4, crc16(randomData(0x800))) is None
+    finally:
+      shutil.rmtree(directory)
+
+  def test_shared(self):
+    directory = tempfile.mkdtemp()
+    try:
+      assert sharedFlashCache(directory) is sharedFlashCache(directory)
+      # Without a directory, nothing is shared nor saved
+      assert sharedFlashCache("") is not sharedFlashCache("")
+      assert sharedFlashCache("").directory is None
+    finally:
+      shutil.rmtree(directory)
+
+  def test_read_cached(self):
+    dbg = openEmulated()
+    flash = dbg.ser.chip.flash
+    flash[0x0000:0x8000] = randomData(0x8000)
+    assert dbg.readCODECached(0x0100, 0x3000) == flash[0x0100:0x3100]
+    # Only the page that changed is read again
+    flash[0x1234] ^= 0xFF
+    dbg.resetStats()
+    assert dbg.readCODECached(0x0100, 0x3000) == flash[0x0100:0x3100]
+    assert dbg.getStats()['commands']['CMD_XDATA_RD']['bytesIn'] < 0x900
+
+  def test_write_updates_cache(self):
+    dbg = openEmulated()
+    dbg.erasePage(2)
+    data = randomData(0x900)
+    dbg.writeCODE(0x1000, data)
+    assert dbg.getCachedPage(2, crc16(data[0:0x800])) == data[0:0x800]
+    # Only its CRC is read back
+    dbg.resetStats()
+    assert dbg.readCODECached(0x1000, 0x800) == data[0:0x800]
+    assert dbg.getStats()['commands']['CMD_XDATA_RD']['bytesIn'] < 0x20
+    # Until the chip is erased
+    dbg.chipErase()
+    assert dbg.getCachedPage(2, crc16(data[0:0x800])) is None
@@ -16,8 +16,11 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
-from cclib.cchex import CCHEXFile
+from cclib.cchex import CCHEXFile, CCHEXWriter, CCMemBlock
 from unittest import TestCase
+import tempfile
+import shutil
+import os
 from binascii import unhexlify
 from tests import temp_hexfile
 
@@ -58,3 +61,44 @@ class TestCCHEXFile(TestCase):
     cchex.load(hexfile)
 
     assert len(cchex.memBlocks) == 1
+
+  def test_pages(self):
+    cchex = CCHEXFile()
+    cchex.memBlocks.append(CCMemBlock(0x07FE))
+    cchex.memBlocks[0].stack(bytearray(b"\x01\x02\x03\x04"))
+    pages = cchex.pages(0x800, offset=0x800)
+    assert sorted(pages.keys()) == [1, 2]
+    assert pages[1] == bytearray(b"\xFF" * 0x7FE + b"\x01\x02")
+    assert pages[2] == bytearray(b"\x03\x04" + b"\xFF" * 0x7FE)
+
+  def test_save_bin(self):
+    # The gaps are blank flash
+    directory = tempfile.mkdtemp()
+    try:
+      with CCHEXWriter(os.path.join(directory, "out.bin"), size=0x1000) as f:
+        f.write(0x800, bytearray([1, 2, 3]))
+        f.write(0x000, bytearray([4, 5]))
+      with open(os.path.join(directory, "out.bin"), "rb") as f:
+        image = bytearray(f.read())
+      assert len(image) == 0x1000
+      assert image[0:2] == bytearray([4, 5]) and image[0x800:0x803] == bytearray([1, 2, 3])
+      assert image[2:0x800] == bytearray(b"\xFF" * 0x7FE)
+      assert image[0x803:] == bytearray(b"\xFF" * 0x7FD)
+    finally:
+      shutil.rmtree(directory)
+
+  def test_save_load_hex(self):
+    # Across a 64Kb segment
+    directory = tempfile.mkdtemp()
+    try:
+      data = bytearray([ i & 0xFF for i in range(0, 0x123) ])
+      with CCHEXWriter(os.path.join(directory, "out.hex")) as f:
+        f.write(0xFFF0, data[0:0x100])
+        f.write(0x100F0, data[0x100:])
+      cchex = CCHEXFile(os.path.join(directory, "out.hex"))
+      cchex.load()
+      assert len(cchex.memBlocks) == 1
+      assert cchex.memBlocks[0].addr == 0xFFF0
+      assert cchex.memBlocks[0].bytes == data
+    finally:
+      shutil.rmtree(directory)
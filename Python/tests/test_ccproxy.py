@@ -0,0 +1,388 @@
+#
+# Test for the CCLib_proxy protocol helpers
+# Copyright (c) 2014-2016 Ioannis Charalampidis
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from cclib import ccproxy
+from cclib.ccproxy import CCLibProxy, probePorts, rleCompress, CCTimings, sharedTimings, CMD_EXEC_1, \
+  ANS_ERROR, CAP_BLOCK_RW, CAP_BRUST_RLE, CAP_RELIABLE
+from cclib.ccdebugger import openCCDebugger
+from cclib.ccemulator import CCProxyEmulator, CC254XEmulator
+from tests import randomData, ScriptedSerial
+from unittest import TestCase
+import serial.tools.list_ports
+import serial
+import tempfile
+import shutil
+import time
+import json
+import os
+
+def rle_expand(data):
+  # Same decoding as brustFeed() in CCLib_proxy.ino
+  data = bytearray(data)
+  ans = bytearray()
+  i = 0
+  while i < len(data):
+    c = data[i]
+    if c & 0x80:
+      ans += bytearray([data[i + 1]]) * ((c & 0x7F) + 2)
+      i += 2
+    else:
+      ans += data[i + 1:i + c + 2]
+      i += c + 2
+  return ans
+
+class TestRLECompress(TestCase):
+  def test_roundtrip(self):
+    samples = [
+      bytearray(),
+      bytearray([0x12]),
+      bytearray([0xFF] * 2048),
+      bytearray(range(256)) * 2,
+      bytearray([1, 1, 2, 2, 2, 3, 3, 3, 3]) * 50,
+      bytearray([0x02, 0x00, 0x10] + [0xFF] * 130 + [0x00] * 3 + list(range(200))),
+    ]
+    for data in samples:
+      assert rle_expand(rleCompress(data)) == data
+
+  def test_blank_flash_compresses(self):
+    packed = rleCompress(bytearray([0xFF] * 2048))
+    assert len(packed) <= 2 * (2048 // 129 + 1)
+
+  def test_literal_runs_are_bounded(self):
+    packed = rleCompress(bytearray(range(256)))
+    assert len(packed) == 256 + 2
+    assert packed[0] == 127
+
+class TestCCTimings(TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.filename = os.path.join(self.dir, "timings")
+
+  def tearDown(self):
+    shutil.rmtree(self.dir)
+
+  def test_learn(self):
+    timings = CCTimings()
+    assert timings.expected("CC2540", "erasePage") is None
+    timings.learn("CC2540", "erasePage", 0.020)
+    timings.learn("CC2540", "erasePage", 0.024)
+    assert abs(timings.expected("CC2540", "erasePage") - 0.021) < 1e-9
+    assert timings.snapshot("CC2541") == {}
+
+  def test_persist(self):
+    timings = CCTimings(self.filename)
+    timings.learn("CC2540", "erasePage", 0.020)
+    # Another session saves in the meantime
+    other = CCTimings(self.filename)
+    other.learn("CC2510", "erasePage", 0.018)
+    other.save()
+    timings.save()
+    loaded = CCTimings(self.filename)
+    assert loaded.snapshot("CC2540") == { "erasePage": 0.020 }
+    assert loaded.snapshot("CC2510") == { "erasePage": 0.018 }
+
+  def test_shared(self):
+    assert sharedTimings(self.filename) is sharedTimings(self.filename)
+    # Without a file, nothing is shared nor saved
+    assert sharedTimings("") is not sharedTimings("")
+    assert sharedTimings("").filename is None
+
+class TestPipeline(TestCase):
+  def setUp(self):
+    self.ser = ScriptedSerial()
+    self.proxy = CCLibProxy(self.ser)
+    self.first = len(self.ser.frames)
+
+  def queue(self, count, fail=()):
+    # Frame i executes instruction i, the ones in `fail` get an error
+    for i in fail:
+      self.ser.errors[self.first + i] = 0x03
+    return [ self.proxy.queueFrame(CMD_EXEC_1, i) for i in range(0, count) ]
+
+  def executed(self):
+    return [ f[1] for f in self.ser.frames[self.first:] ]
+
+  def test_error_on_its_frame(self):
+    for k in (0, 5, 15):
+      self.setUp()
+      ans = self.queue(16, fail=[k])
+      self.assertRaises(IOError, self.proxy.flushQueue)
+      for (i, a) in enumerate(ans):
+        assert a.done
+        if i == k:
+          self.assertRaises(IOError, a.result)
+        else:
+          assert a.result() == CMD_EXEC_1
+      # Every frame was sent exactly once, in order
+      assert self.executed() == list(range(0, 16))
+      # The error was reported & the queue is usable again
+      self.proxy.flushQueue()
+      assert self.proxy.queueFrame(CMD_EXEC_1, 16).result() == CMD_EXEC_1
+      assert self.executed() == list(range(0, 17))
+
+  def test_error_beyond_window(self):
+    # The error comes back while the rest of the queue is still in flight
+    ans = self.queue(40, fail=[3, 20])
+    self.assertRaises(IOError, self.proxy.flushQueue)
+    failed = [ i for (i, a) in enumerate(ans) if a.error is not None ]
+    assert failed == [3, 20]
+    assert self.executed() == list(range(0, 40))
+
+  def test_result_raises_own_error(self):
+    ans = self.queue(8, fail=[2])
+    # Waiting for a good frame does not raise the error of another one
+    assert ans[6].result() == CMD_EXEC_1
+    self.assertRaises(IOError, ans[2].result)
+    # Neither does the next flush, now that the error was reported
+    self.proxy.flushQueue()
+    assert self.executed() == list(range(0, 8))
+
+  def test_no_exception(self):
+    self.ser.errors[self.first] = 0x03
+    ans = self.proxy.queueFrame(CMD_EXEC_1, 0, raiseException=False)
+    self.proxy.flushQueue()
+    assert ans.result() == -3
+
+class SilentSerial(ScriptedSerial):
+  # A port without a CCLib_proxy
+  def write(self, data):
+    return len(data)
+
+  def read(self, size=1):
+    time.sleep(0.01)
+    return b''
+
+class PortInfo(tuple):
+  # What serial.tools.list_ports.comports() returns for an USB port
+  def __new__(cls, name, serial_number):
+    ans = tuple.__new__(cls, (name, "USB serial", ""))
+    ans.vid = 0x2341
+    ans.pid = 0x0043
+    ans.serial_number = serial_number
+    return ans
+
+class TestDetectPort(TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.saved = (serial.Serial, serial.tools.list_ports.comports, ccproxy.PORT_CACHE,
+      ccproxy.PROBE_TIMEOUT, ccproxy.TIMINGS_FILE, ccproxy.CACHE_DIR)
+    serial.Serial = self.openPort
+    serial.tools.list_ports.comports = lambda: list(self.ports)
+    ccproxy.PORT_CACHE = os.path.join(self.dir, "port")
+    ccproxy.PROBE_TIMEOUT = 0.2
+    ccproxy.TIMINGS_FILE = ccproxy.CACHE_DIR = ""
+    self.ports = []
+    self.proxies = set()
+    self.opened = []
+
+  def tearDown(self):
+    (serial.Serial, serial.tools.list_ports.comports, ccproxy.PORT_CACHE,
+      ccproxy.PROBE_TIMEOUT, ccproxy.TIMINGS_FILE, ccproxy.CACHE_DIR) = self.saved
+    shutil.rmtree(self.dir)
+
+  def openPort(self, name, **kwargs):
+    if not name in [ p[0] for p in self.ports ]:
+      raise IOError("No such port: %s" % name)
+    ser = ScriptedSerial() if name in self.proxies else SilentSerial()
+    ser.port = name
+    self.opened.append(ser)
+    return ser
+
+  def addPorts(self, *names):
+    for name in names:
+      self.ports.append(PortInfo(name, name[-1]))
+
+  def detect(self):
+    proxy = CCLibProxy()
+    assert proxy.ser.port == proxy.port
+    assert not proxy.ser.closed
+    return proxy.port
+
+  def cachedPort(self):
+    with open(ccproxy.PORT_CACHE) as f:
+      return json.load(f)['port']
+
+  def test_cache_miss(self):
+    self.addPorts("/dev/ttyS0", "/dev/ttyACM0", "/dev/ttyACM1")
+    self.proxies.add("/dev/ttyACM1")
+    assert self.detect() == "/dev/ttyACM1"
+    assert self.cachedPort() == "/dev/ttyACM1"
+    assert all([ s.closed for s in self.opened if s.port != "/dev/ttyACM1" ])
+
+  def test_cache_hit(self):
+    self.addPorts("/dev/ttyACM0", "/dev/ttyACM1", "/dev/ttyACM2")
+    self.proxies.update([ "/dev/ttyACM0", "/dev/ttyACM1" ])
+    ccproxy.savePortCache(self.ports[1])
+    # Only the last used port is opened (and reset)
+    assert self.detect() == "/dev/ttyACM1"
+    assert [ s.port for s in self.opened ] == [ "/dev/ttyACM1" ]
+
+  def test_cache_follows_device(self):
+    # The same board on another port name
+    self.addPorts("/dev/ttyACM0", "/dev/ttyACM1")
+    self.proxies.add("/dev/ttyACM1")
+    ccproxy.savePortCache(PortInfo("/dev/ttyACM3", "1"))
+    assert self.detect() == "/dev/ttyACM1"
+    assert [ s.port for s in self.opened ] == [ "/dev/ttyACM1" ]
+
+  def test_stale_cache(self):
+    # The last used port no longer responds, so the rest are probed
+    self.addPorts("/dev/ttyACM0", "/dev/ttyACM1", "/dev/ttyACM2")
+    self.proxies.add("/dev/ttyACM2")
+    ccproxy.savePortCache(self.ports[0])
+    assert self.detect() == "/dev/ttyACM2"
+    assert self.opened[0].port == "/dev/ttyACM0" and self.opened[0].closed
+    assert self.cachedPort() == "/dev/ttyACM2"
+
+  def test_no_proxy(self):
+    self.addPorts("/dev/ttyACM0", "/dev/ttyACM1")
+    ccproxy.savePortCache(self.ports[0])
+    self.assertRaises(IOError, self.detect)
+    assert all([ s.closed for s in self.opened ])
+
+  def test_multiple_candidates(self):
+    # The first one to respond wins, the rest are closed
+    self.addPorts("/dev/ttyACM0", "/dev/ttyACM1", "/dev/ttyACM2")
+    self.proxies.update([ "/dev/ttyACM0", "/dev/ttyACM2" ])
+    (name, ser) = probePorts([ "/dev/ttyACM0", "/dev/ttyACM1", "/dev/ttyACM2", "/dev/missing" ])
+    assert name in self.proxies and ser.port == name and not ser.closed
+    assert ser.timeout is None
+    assert all([ s.closed for s in self.opened if s is not ser ])
+    assert probePorts([ "/dev/ttyACM1", "/dev/missing" ]) == (None, None)
+
+class LossyProxy(CCProxyEmulator):
+  # Drops the responses & corrupts the requests or responses of the packets
+  # with the given sequence numbers (once each), counting the commands run
+  # and failing the ones with the given numbers
+  def __init__(self):
+    CCProxyEmulator.__init__(self, CC254XEmulator("CC2540", flash=128),
+      capabilities=CAP_BLOCK_RW | CAP_BRUST_RLE | CAP_RELIABLE)
+    self.dropReplies = set()
+    self.corruptReplies = set()
+    self.corruptRequests = set()
+    self.failCommands = set()
+    self.commands = []
+
+  def write(self, data):
+    data = bytearray(data)
+    i = 0
+    while self.linkReliable and (i + 6 <= len(data)):
+      end = i + data[i + 5] + 7
+      if data[i + 4] in self.corruptRequests:
+        self.corruptRequests.discard(data[i + 4])
+        data[end - 1] ^= 0xFF
+      i = end
+    return CCProxyEmulator.write(self, data)
+
+  def _send(self, data):
+    data = bytearray(data)
+    if self.linkReliable:
+      if data[3] in self.dropReplies:
+        self.dropReplies.discard(data[3])
+        return
+      if data[3] in self.corruptReplies:
+        self.corruptReplies.discard(data[3])
+        data[-1] ^= 0xFF
+    CCProxyEmulator._send(self, data)
+
+  def _command(self, cmd, *args):
+    self.commands.append(cmd)
+    if len(self.commands) - 1 in self.failCommands:
+      return self._frame(ANS_ERROR, 0x03)
+    return CCProxyEmulator._command(self, cmd, *args)
+
+class TestReliableLink(TestCase):
+  def setUp(self):
+    self.proxy = LossyProxy()
+    self.dbg = openCCDebugger(self.proxy, verbose=False, baudrate=1000000)
+    assert self.dbg.linkReliable and self.proxy.linkReliable
+
+  def incDPTR(self, count):
+    # Queue INC DPTR instructions, returning how many the proxy ran
+    chip = self.proxy.chip
+    chip._setDptr(0x1000)
+    del self.proxy.commands[:]
+    for i in range(0, count):
+      self.dbg.queueInstr(0xA3)
+    self.dbg.flushQueue()
+    assert chip._dptr() == 0x1000 + count
+    return self.proxy.commands.count(CMD_EXEC_1)
+
+  def test_roundtrip(self):
+    self.dbg.writeXDATA(0x0100, randomData(300))
+    assert self.dbg.readXDATA(0x0100, 300) == randomData(300)
+    assert self.dbg.getStats()['retransmits'] == 0
+
+  def test_corrupted_request(self):
+    self.proxy.corruptRequests.add((self.dbg.linkSeq + 3) & 0xFF)
+    assert self.incDPTR(16) == 16
+    assert self.dbg.getStats()['retransmits'] > 0
+
+  def test_corrupted_reply(self):
+    # The data of a block read are sent again
+    self.dbg.writeXDATA(0x0100, randomData(100))
+    self.proxy.corruptReplies.add((self.dbg.linkSeq + 1) & 0xFF)
+    assert self.dbg.readXDATA(0x0100, 100) == randomData(100)
+    assert self.dbg.getStats()['retransmits'] > 0
+
+  def test_dropped_reply(self):
+    # The proxy re-sends the cached response without running it again
+    self.proxy.dropReplies.add((self.dbg.linkSeq + 5) & 0xFF)
+    assert self.incDPTR(16) == 16
+    assert self.dbg.getStats()['retransmits'] > 0
+
+  def test_sequence_wrap(self):
+    while self.dbg.linkSeq != 250:
+      self.dbg.ping()
+    self.proxy.dropReplies.update([ 255, 0, 2 ])
+    self.proxy.corruptRequests.add(4)
+    assert self.incDPTR(16) == 16
+    assert self.dbg.linkSeq == 10
+    assert self.proxy.expectSeq == 10
+
+  def test_error_on_its_frame(self):
+    # The error response is cached like any other
+    chip = self.proxy.chip
+    chip._setDptr(0x1000)
+    del self.proxy.commands[:]
+    self.proxy.failCommands.add(5)
+    self.proxy.dropReplies.add((self.dbg.linkSeq + 6) & 0xFF)
+    ans = [ self.dbg.queueInstr(0xA3) for i in range(0, 16) ]
+    self.assertRaises(IOError, self.dbg.flushQueue)
+    assert [ i for (i, a) in enumerate(ans) if a.error is not None ] == [5]
+    assert self.proxy.commands.count(CMD_EXEC_1) == 16
+    assert chip._dptr() == 0x1000 + 15
+    assert self.dbg.getStats()['retransmits'] > 0
+    self.dbg.flushQueue()
+
+  def test_brust_retransmit(self):
+    # DMA-0 moves the brust in the SRAM (in 6 packets)
+    dbg = self.dbg
+    data = randomData(300)
+    dbg.pauseDMA(False)
+    dbg.configDMAChannel( 0, 0x6260, 0x0000, 0x1F, tlen=len(data), srcInc=0, dstInc=1, priority=1, interrupt=True )
+    dbg.clearDMAIRQ(0)
+    dbg.armDMAChannel(0)
+    seq = dbg.linkSeq
+    self.proxy.dropReplies.add((seq + 2) & 0xFF)
+    self.proxy.corruptRequests.add((seq + 4) & 0xFF)
+    self.proxy.corruptReplies.add((seq + 6) & 0xFF)
+    dbg.brustWrite(data)
+    assert dbg.isDMAIRQ(0)
+    assert dbg.readXDATA(0x0000, len(data)) == data
+    assert dbg.getStats()['retransmits'] > 0
@@ -0,0 +1,62 @@
+#
+# Test for the serial traffic recorder & replayer
+# Copyright (c) 2014-2016 Ioannis Charalampidis
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from cclib.ccproxy import CCLibProxy, CMD_STATUS
+from cclib.cctrace import CCTraceReplay, REC_WRITE, REC_READ, readTrace
+from tests import ScriptedSerial
+from unittest import TestCase
+import tempfile
+import shutil
+import os
+
+class TestTrace(TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.trace = os.path.join(self.dir, "session.trace")
+
+  def tearDown(self):
+    shutil.rmtree(self.dir)
+
+  def record(self):
+    proxy = CCLibProxy(ScriptedSerial(), trace=self.trace)
+    status = proxy.getStatus()
+    proxy.ser.close()
+    return status
+
+  def test_records_frames(self):
+    self.record()
+    (header, records) = readTrace(self.trace)
+    assert header['port'] == "scripted"
+    writes = bytearray().join([ r[2] for r in records if r[0] == REC_WRITE ])
+    reads = bytearray().join([ r[2] for r in records if r[0] == REC_READ ])
+    assert len(writes) % 4 == 0
+    assert len(reads) == len(writes) // 4 * 3
+    assert writes[-4] == CMD_STATUS
+
+  def test_replay(self):
+    status = self.record()
+    proxy = CCLibProxy("replay:%s" % self.trace)
+    assert proxy.port == "replay:%s" % self.trace
+    assert proxy.getStatus() == status
+    assert proxy.ser.finished()
+
+  def test_replay_mismatch(self):
+    self.record()
+    proxy = CCLibProxy(CCTraceReplay(self.trace))
+    with self.assertRaises(IOError):
+      proxy.getChipID()
@@ -0,0 +1,81 @@
+#
+# Test for the gang flash writer tool
+# Copyright (c) 2014-2016 Ioannis Charalampidis
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from cc_gang_flash import gangFlash, main
+from tests import randomData, hexFile
+from unittest import TestCase
+import tempfile
+import shutil
+import sys
+import os
+
+try:
+  from StringIO import StringIO
+except ImportError:
+  from io import StringIO
+
+MISSING = "/dev/cclib-missing"
+
+class TestGangFlash(TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.hex = hexFile( (0x0000, randomData(0x900)), (0x4000, randomData(0x300, seed=2)) )
+    self.stdout = sys.stdout
+    sys.stdout = StringIO()
+
+  def tearDown(self):
+    sys.stdout = self.stdout
+    shutil.rmtree(self.dir)
+
+  def row(self, port):
+    # The report row of the port
+    rows = [ l.split() for l in sys.stdout.getvalue().splitlines() if l.startswith(" %-20s " % port) ]
+    assert len(rows) == 1
+    return rows[0]
+
+  def test_success(self):
+    report = gangFlash([ "emulator:CC2540", "emulator:CC2541" ], self.hex, erase=True)
+    assert sorted(report.keys()) == [ "emulator:CC2540", "emulator:CC2541" ]
+    for (written, portTime, error) in report.values():
+      assert (written, error) == (0xC00, None)
+    assert self.row("emulator:CC2541")[1] == str(0xC00)
+    assert self.row("emulator:CC2541")[-1] == "OK"
+    assert "Programmed 2 of 2 targets" in sys.stdout.getvalue()
+
+  def test_failing_port(self):
+    # The others are still programmed
+    report = gangFlash([ "emulator:CC2540", MISSING ], self.hex)
+    assert report["emulator:CC2540"][2] is None
+    assert "Could not find" in report[MISSING][2]
+    assert self.row(MISSING)[1:2] + self.row(MISSING)[-1:] == [ "0", "FAILED" ]
+    assert "[FAIL] %s" % MISSING in sys.stdout.getvalue()
+    assert "Programmed 1 of 2 targets" in sys.stdout.getvalue()
+
+  def test_exit_code(self):
+    filename = os.path.join(self.dir, "image.hex")
+    self.hex.save(filename)
+    argv = sys.argv
+    sys.argv = [ "cc_gang_flash.py", "--in=%s" % filename, "--ports=emulator:CC2540,%s" % MISSING ]
+    try:
+      main()
+      assert False, "main() did not exit"
+    except SystemExit as e:
+      assert e.code == 3
+    finally:
+      sys.argv = argv
+    assert self.row(MISSING)[-1] == "FAILED"